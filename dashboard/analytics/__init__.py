@@ -0,0 +1,47 @@
+"""Importable analytics behind the dashboard, usable without Streamlit.
+
+Open a dataset handle once and call one function per chart with it:
+
+    import analytics
+
+    dataset = analytics.open_dataset()
+    analytics.monthly_orders(dataset, 2017)
+
+Results are memoized per function on (dataset version, filters), so repeated
+renders, batch jobs and benchmarks share them until the data changes.
+``filter_dataset(dataset, start=..., states=[...], ...)`` applies global
+filters to every function called with the returned dataset.
+"""
+from .cache import memoize
+from .charts import (
+    average_spend,
+    category_rating,
+    category_sales,
+    city_customers,
+    city_sales,
+    city_sales_page,
+    city_sales_ranking,
+    cohort_retention,
+    customer_segments,
+    delivery_stats,
+    delivery_status_counts,
+    filter_options,
+    hour_rating,
+    lead_time_histogram,
+    monthly_orders,
+    payment_segments,
+    product_ranking,
+    rating_distribution,
+    time_of_day_counts,
+    top_customer_cities,
+    top_rated_categories,
+    top_rated_per_category,
+    top_rated_products,
+    top_selling_categories,
+    weekday_counts,
+    worst_customer_cities,
+    worst_rated_categories,
+    worst_selling_categories,
+    years,
+)
+from .dataset import BACKENDS, Dataset, filter_dataset, open_dataset
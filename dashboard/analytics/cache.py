@@ -0,0 +1,44 @@
+"""Per-function LRU memoization of analytics results."""
+import functools
+import threading
+from collections import OrderedDict
+
+import instrument
+
+
+def memoize(maxsize=64, filtered=True):
+    """Memoize ``function(dataset, *filters)`` on ``(dataset.version, dataset.filters, filters)``.
+
+    Each decorated function keeps its own LRU of at most ``maxsize`` results.
+    Keys hold the dataset version rather than the dataset, so results of an
+    old version are simply evicted over time. Results are shared by every
+    caller and must be treated as read-only. Functions that ignore the
+    dataset's global filters pass ``filtered=False`` to share one result
+    across filter combinations.
+    """
+    def decorate(function):
+        entries = OrderedDict()
+        lock = threading.RLock()
+
+        @functools.wraps(function)
+        def wrapper(dataset, *args, **kwargs):
+            key = (dataset.version, dataset.filters if filtered else None, args, tuple(sorted(kwargs.items())))
+            with lock:
+                if key in entries:
+                    entries.move_to_end(key)
+                    return entries[key]
+            # Computed outside the lock so slow queries do not serialize
+            with instrument.stage("aggregate", function.__name__) as stage:
+                value = function(dataset, *args, **kwargs)
+                stage["result_rows"] = len(value) if hasattr(value, "__len__") else None
+            with lock:
+                entries[key] = value
+                entries.move_to_end(key)
+                while len(entries) > maxsize:
+                    entries.popitem(last=False)
+            return value
+
+        wrapper.cache_clear = entries.clear
+        return wrapper
+
+    return decorate
@@ -0,0 +1,243 @@
+"""One function per dashboard chart.
+
+Each function takes a ``Dataset`` plus the chart's filters and returns the
+small frame (or value) the chart plots. ``year`` is a purchase year or None
+for all years; it narrows the dataset's global filters, if any.
+"""
+import pandas as pd
+
+import delivery
+import filters
+import instrument
+import metrics
+import ranking
+import segments
+
+from .cache import memoize
+from .dataset import open_dataset
+
+
+def _star(dataset):
+    """The star schema behind ``dataset``, for queries only it answers."""
+    return dataset.data if dataset.queries is metrics else open_dataset("star").data
+
+
+def _period(dataset, year=None):
+    """``year`` combined with the dataset's global filters, as the query functions take it."""
+    return year if dataset.filters is None else filters.restrict(dataset.filters, year)
+
+
+@memoize(filtered=False)
+def years(dataset):
+    """Purchase years present in the data, for the year filter."""
+    return dataset.queries.years(dataset.data)
+
+
+@memoize()
+def monthly_orders(dataset, year=None):
+    """Number of orders per month, indexed by month end."""
+    return dataset.queries.monthly_orders(dataset.data, _period(dataset, year))
+
+
+@memoize()
+def category_sales(dataset, year=None):
+    """Sales per product category, best-selling first."""
+    return dataset.queries.category_sales(dataset.data, _period(dataset, year))
+
+
+@memoize()
+def top_selling_categories(dataset, n=10):
+    return category_sales(dataset).head(n)
+
+
+@memoize()
+def worst_selling_categories(dataset, n=10):
+    return category_sales(dataset).tail(n)
+
+
+@memoize()
+def category_rating(dataset, year=None):
+    """Mean review score per product category, best-rated first."""
+    return dataset.queries.category_rating(dataset.data, _period(dataset, year))
+
+
+@memoize()
+def top_rated_categories(dataset, n=10):
+    return category_rating(dataset).head(n)
+
+
+@memoize()
+def worst_rated_categories(dataset, n=10):
+    return category_rating(dataset).tail(n)
+
+
+@memoize(maxsize=4)
+def product_ranking(dataset):
+    """The ``ranking.ProductRanking`` index of every reviewed product."""
+    # All-time unless global filters are set
+    period = () if dataset.filters is None else (dataset.filters,)
+    return ranking.ProductRanking(ranking.product_stats(dataset.queries.product_rating(dataset.data, *period)))
+
+
+@memoize()
+def top_rated_products(dataset, n=5, min_reviews=1, category=None, bottom=False):
+    """The ``n`` products with the best adjusted rating (the worst with ``bottom``), see ``ranking.py``."""
+    return product_ranking(dataset).top(n, category, min_reviews, bottom)
+
+
+@memoize()
+def top_rated_per_category(dataset, min_reviews=1):
+    """The product with the best adjusted rating in each category."""
+    return product_ranking(dataset).top_per_category(1, min_reviews)
+
+
+@memoize()
+def rating_distribution(dataset, year=None):
+    return dataset.queries.rating_distribution(dataset.data, _period(dataset, year))
+
+
+@memoize()
+def city_customers(dataset, year=None):
+    """Distinct customers per city, most customers first."""
+    return dataset.queries.city_customers(dataset.data, _period(dataset, year))
+
+
+@memoize()
+def top_customer_cities(dataset, year=None, n=5):
+    return city_customers(dataset, year).head(n)
+
+
+@memoize()
+def worst_customer_cities(dataset, year=None, n=5):
+    return city_customers(dataset, year).tail(n)
+
+
+@memoize()
+def payment_segments(dataset, year=None):
+    return dataset.queries.payment_segments(dataset.data, _period(dataset, year))
+
+
+@memoize()
+def average_spend(dataset, year=None):
+    return dataset.queries.average_spend(dataset.data, _period(dataset, year))
+
+
+@memoize()
+def delivery_status_counts(dataset, year=None):
+    return dataset.queries.delivery_status_counts(dataset.data, _period(dataset, year))
+
+
+@memoize()
+def hour_rating(dataset, year=None):
+    return dataset.queries.hour_rating(dataset.data, _period(dataset, year))
+
+
+@memoize()
+def time_of_day_counts(dataset, year=None):
+    return dataset.queries.time_of_day_counts(dataset.data, _period(dataset, year))
+
+
+@memoize()
+def weekday_counts(dataset, year=None):
+    return dataset.queries.weekday_counts(dataset.data, _period(dataset, year))
+
+
+@memoize()
+def city_sales(dataset, year=None):
+    """Total sales and items sold per customer city, best-selling first."""
+    return dataset.queries.city_sales(dataset.data, _period(dataset, year))
+
+
+@memoize()
+def city_sales_ranking(dataset, n=20, bottom=False, year=None):
+    """The ``n`` best- (or worst-) selling cities plus one "Other" row for the rest.
+
+    The chart stays at ``n + 1`` bars however many cities the data has.
+    """
+    sales = city_sales(dataset, year)
+    ranked = sales.nsmallest(n, 'Total Sales') if bottom else sales.nlargest(n, 'Total Sales')
+    ranked = ranked.astype({'City': str})
+    rest = sales.drop(ranked.index)
+    if rest.empty:
+        return ranked.reset_index(drop=True)
+    other = pd.DataFrame({
+        'City': [f"Other ({len(rest):,} cities)"],
+        'Total Sales': [rest['Total Sales'].sum()],
+        'Product Sold': [rest['Product Sold'].sum()],
+    })
+    return pd.concat([ranked, other], ignore_index=True)
+
+
+@memoize(maxsize=256)
+def city_sales_page(dataset, search="", page=0, page_size=25, year=None):
+    """One page of cities ranked by sales, filtered by a case-insensitive substring.
+
+    Returns ``(rows, matching)``: the page's rows, with each city's overall
+    sales rank, and how many cities match. A page past the last one gives
+    the last page.
+    """
+    sales = city_sales(dataset, year)
+    sales = sales.assign(Rank=range(1, len(sales) + 1))
+    if search:
+        sales = sales[sales['City'].str.contains(search, case=False, regex=False)]
+    page = min(page, max(0, len(sales) - 1) // page_size)
+    rows = sales.iloc[page * page_size:(page + 1) * page_size].astype({'City': str})
+    return rows[['Rank', 'City', 'Total Sales', 'Product Sold']], len(sales)
+
+
+@memoize(filtered=False)
+def filter_options(dataset):
+    """Values offered by each global filter (see ``filters.options``), from the star schema."""
+    return filters.options(_star(dataset))
+
+
+def _stored_delivery(dataset, year):
+    # Materialized by the pipeline for all years; computed from the star schema otherwise or when stale
+    if dataset.filters is not None or year is not None:
+        return None
+    with instrument.stage("load", "delivery"):
+        return delivery.load_delivery()
+
+
+@memoize()
+def delivery_stats(dataset, by="state", year=None):
+    """Lead time and carrier handoff percentiles and lateness per ``by`` group (see ``delivery.py``).
+
+    Read from the tables the pipeline materialized, else answered from the
+    star schema whatever the dataset's backend.
+    """
+    stored = _stored_delivery(dataset, year)
+    if stored is not None and f"by_{by}" in stored:
+        return stored[f"by_{by}"]
+    return delivery.delivery_stats(_star(dataset), by, _period(dataset, year))
+
+
+@memoize()
+def lead_time_histogram(dataset, year=None):
+    """Delivered orders per whole day of lead time, from the materialized tables or the star schema."""
+    stored = _stored_delivery(dataset, year)
+    if stored is not None:
+        return stored["lead_time_histogram"]
+    return delivery.lead_time_histogram(_star(dataset), _period(dataset, year))
+
+
+@memoize(maxsize=8)
+def _customer_segments(dataset):
+    # Materialized by the pipeline; computed from the star schema under filters or when stale
+    if dataset.filters is None:
+        stored = segments.load_segments()
+        if stored is not None:
+            return stored
+    return segments.build_segments(_star(dataset), _period(dataset))
+
+
+@memoize()
+def customer_segments(dataset):
+    """Customers, share and mean recency, orders and spend per RFM segment (see ``segments.py``)."""
+    return _customer_segments(dataset)["segments"]
+
+
+@memoize()
+def cohort_retention(dataset):
+    """Share of each monthly acquisition cohort active in each month since, in %."""
+    return segments.retention_matrix(_customer_segments(dataset)["cohorts"])
@@ -0,0 +1,83 @@
+"""The dataset handle every analytics function takes."""
+import os
+from collections import namedtuple
+
+import metrics
+import rollups
+import sql_backend
+from data_loader import source_key
+from filters import make_filters
+from star_schema import load_star, star_key
+
+# ``data`` is answered by the query functions of module ``queries``;
+# ``version`` changes whenever the data does and keys the memoized results,
+# along with the global ``filters`` (see ``filter_dataset``).
+Dataset = namedtuple("Dataset", ["data", "queries", "version", "filters"], defaults=[None])
+
+# Values of ``DASHBOARD_BACKEND``
+BACKENDS = ["auto", "rollups", "star", "sqlite"]
+
+# Backend -> dataset ``open_dataset`` returns without checking the files (see ``pin``)
+_pinned = {}
+
+
+def pin(datasets):
+    """Have ``open_dataset`` return ``datasets[backend]`` for these backends until the next ``pin``.
+
+    The whole mapping is replaced in one assignment, so callers get either
+    the previous datasets or these. Other backends are opened from the files
+    as usual; ``pin({})`` unpins everything. ``refresh.py`` pins the datasets
+    it has rebuilt.
+    """
+    global _pinned
+    _pinned = dict(datasets)
+
+
+def open_dataset(backend=None, pinned=True):
+    """Return the current dataset, answered by ``backend``.
+
+    * ``rollups``: pre-aggregated rollups (see ``rollups.py``);
+    * ``star``: the star schema in memory (loaded once per process, see
+      ``star_schema.py``);
+    * ``sqlite``: SQL queries against the embedded database built by
+      ``sql_backend.py``; nothing is loaded up front;
+    * ``auto``: the rollups when they have been built for the current data,
+      otherwise the star schema.
+
+    ``backend`` defaults to the ``DASHBOARD_BACKEND`` environment variable,
+    else ``auto``. All backends expose the same query functions. A pinned
+    dataset (see ``pin``) is returned as is unless ``pinned`` is False.
+    """
+    backend = backend or os.environ.get("DASHBOARD_BACKEND", "auto")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+    datasets = _pinned
+    if pinned and backend in datasets:
+        return datasets[backend]
+
+    if backend in ("auto", "rollups"):
+        rollup_store = rollups.load_rollups()
+        if rollup_store is not None:
+            return Dataset(rollup_store, rollups, ("rollups",) + source_key(rollups.ROLLUPS_DIR))
+        if backend == "rollups":
+            raise FileNotFoundError("The rollups are missing or out of date; run python dashboard/rollups.py")
+    if backend == "sqlite":
+        db = sql_backend.load_database()
+        if db is None:
+            raise FileNotFoundError("The SQLite database is missing or out of date; run python dashboard/sql_backend.py")
+        return Dataset(db, sql_backend, ("sqlite",) + source_key(db))
+    return Dataset(load_star(), metrics, ("star",) + star_key())
+
+
+def filter_dataset(dataset, **filters):
+    """``dataset`` with global filters applied to every query (see ``filters.make_filters``).
+
+    Filters are answered by the star schema's mask indexes; a dataset on
+    another backend is swapped for the star schema while any filter is set.
+    """
+    filters = make_filters(**filters)
+    if filters is None:
+        return dataset._replace(filters=None)
+    if dataset.queries is not metrics:
+        dataset = open_dataset("star")
+    return dataset._replace(filters=filters)
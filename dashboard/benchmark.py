@@ -0,0 +1,321 @@
+"""Headless benchmarks for the dashboard's data functions.
+
+For each scale, a synthetic star schema shaped like Olist's (same columns and
+types, similar fan-out and cardinalities) is written to a temporary
+directory. The run then times loading it, slicing it by period, and every
+dashboard page's queries on both backends: the star schema through
+``metrics.py`` and the rollups through ``rollups.py``, plus the delivery
+statistics of every group (``delivery.py``) and the customer segments
+(``segments.py``) on the star schema. Each scale runs in its own process so
+that its peak RSS is its own.
+
+Results are written as JSON. With ``--baseline``, every timing and the peak
+RSS are compared against a stored run at the same scale, and the command
+exits non-zero on a regression. Baselines are machine specific: record one
+with ``--save-baseline`` on the box that runs the comparison.
+
+Usage:
+    python dashboard/benchmark.py [--scales 100000 1000000 10000000] [--output results.json]
+                                  [--baseline [PATH]] [--save-baseline]
+"""
+import argparse
+import binascii
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import delivery
+import metrics
+import rollups
+import segments
+from shared import export_star, map_star
+from star_schema import prepare_star, read_star
+from time_index import ORDER_FACTS
+
+SCALES = [100_000, 1_000_000, 10_000_000]
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# Dashboard page -> (queries it runs, whether it has a year filter)
+PAGES = {
+    "Monthly Orders Trend": (["monthly_orders"], True),
+    "Total Sales by Product Category": (["category_sales"], False),
+    "Average Rating by Product Category": (["category_rating", "product_rating", "rating_distribution"], False),
+    "Customer Distribution": (["city_customers", "payment_segments", "average_spend"], True),
+    "Time Analysis": (["delivery_status_counts", "hour_rating", "time_of_day_counts", "weekday_counts"], False),
+    "Sales and Product by City": (["city_sales"], False),
+}
+
+FIRST_PURCHASE = np.datetime64("2016-09-04", "ns")
+LAST_PURCHASE = np.datetime64("2018-10-17", "ns")
+DAY = np.timedelta64(1, "D").astype("timedelta64[ns]").astype("int64")
+
+
+def _hex_ids(rng, n):
+    """``n`` random 32-hex-character IDs, like Olist's."""
+    raw = np.frombuffer(binascii.hexlify(rng.bytes(16 * n)), dtype="S32")
+    return pa.array(raw, type=pa.binary(32)).cast(pa.string())
+
+
+def _skewed(rng, values, n):
+    # A few cities, products and categories account for most rows, as in Olist
+    weights = 1 / np.arange(1, len(values) + 1)
+    return values.take(pa.array(rng.choice(len(values), n, p=weights / weights.sum())))
+
+
+def _timestamps(nanoseconds, missing=None):
+    return pa.array(nanoseconds.astype("datetime64[ns]"), mask=missing)
+
+
+def generate_star(orders, root, seed=0):
+    """Write a synthetic star schema with ``orders`` orders to ``root``."""
+    rng = np.random.default_rng(seed)
+    n_products, n_sellers = max(1_000, orders // 3), max(100, orders // 32)
+    cities = pa.array([f"city_{i}" for i in range(4_000)])
+    states = pa.array(["SP", "RJ", "MG", "RS", "PR", "SC", "BA", "DF", "GO", "ES"])
+    categories = pa.array([f"category_{i}" for i in range(73)])
+
+    order_ids, customer_ids = _hex_ids(rng, orders), _hex_ids(rng, orders)
+    product_ids, seller_ids = _hex_ids(rng, n_products), _hex_ids(rng, n_sellers)
+
+    purchase = rng.integers(FIRST_PURCHASE.astype("int64"), LAST_PURCHASE.astype("int64"), orders)
+    approved = purchase + rng.integers(0, DAY, orders)
+    carrier = approved + rng.integers(0, 5 * DAY, orders)
+    delivered = carrier + rng.integers(DAY, 20 * DAY, orders)
+    estimated = purchase // DAY * DAY + rng.integers(10, 30, orders) * DAY
+    undelivered = rng.random(orders) < 0.03
+    tables = {"orders": pa.table({
+        "order_id": order_ids,
+        "customer_id": customer_ids.take(pa.array(rng.permutation(orders))),
+        "order_status": pa.array(np.where(undelivered, "shipped", "delivered")),
+        "order_purchase_timestamp": _timestamps(purchase),
+        "order_approved_at": _timestamps(approved),
+        "order_delivered_carrier_date": _timestamps(carrier, undelivered & (rng.random(orders) < 0.5)),
+        "order_delivered_customer_date": _timestamps(delivered, undelivered),
+        "order_estimated_delivery_date": _timestamps(estimated),
+    })}
+
+    per_order = rng.choice([1, 1, 1, 1, 2, 3], orders)
+    item_orders = np.repeat(np.arange(orders), per_order)
+    tables["items"] = pa.table({
+        "order_id": order_ids.take(pa.array(item_orders)),
+        "order_item_id": pa.array(np.arange(len(item_orders)) - np.repeat(np.cumsum(per_order) - per_order, per_order) + 1,
+                                  type=pa.int32()),
+        "product_id": _skewed(rng, product_ids, len(item_orders)),
+        "seller_id": seller_ids.take(pa.array(rng.integers(0, n_sellers, len(item_orders)))),
+        "price": rng.gamma(2, 60, len(item_orders)).round(2),
+        "freight_value": rng.gamma(2, 10, len(item_orders)).round(2),
+    })
+
+    payment_orders = np.repeat(np.arange(orders), rng.choice([1, 1, 1, 2], orders))
+    tables["payments"] = pa.table({
+        "order_id": order_ids.take(pa.array(payment_orders)),
+        "payment_type": pa.array(rng.choice(["credit_card", "credit_card", "boleto", "voucher", "debit_card"],
+                                            len(payment_orders))),
+        "payment_value": rng.gamma(2, 80, len(payment_orders)).round(2),
+    })
+
+    reviewed = np.flatnonzero(rng.random(orders) < 0.99)
+    tables["reviews"] = pa.table({
+        "order_id": order_ids.take(pa.array(reviewed)),
+        "review_score": pa.array(rng.choice([1, 2, 3, 4, 5, 5, 5], len(reviewed)), type=pa.int8()),
+    })
+
+    unique_customers = _hex_ids(rng, int(orders * 0.97))
+    tables["customers"] = pa.table({
+        "customer_id": customer_ids,
+        "customer_unique_id": unique_customers.take(pa.array(rng.integers(0, len(unique_customers), orders))),
+        "customer_city": _skewed(rng, cities, orders),
+        "customer_state": _skewed(rng, states, orders),
+    })
+    tables["products"] = pa.table({
+        "product_id": product_ids,
+        "product_category_name": _skewed(rng, categories, n_products),
+    })
+    tables["sellers"] = pa.table({
+        "seller_id": seller_ids,
+        "seller_city": _skewed(rng, cities, n_sellers),
+        "seller_state": _skewed(rng, states, n_sellers),
+    })
+
+    # One unpartitioned part per table, which ``read_star`` reads like the pipeline's layout
+    for name, table in tables.items():
+        os.makedirs(os.path.join(root, name))
+        pq.write_table(table, os.path.join(root, name, "part-0.parquet"))
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_page(queries, data, names, years):
+    for year in years:
+        for name in names:
+            function = getattr(queries, name)
+            function(data) if name == "product_rating" else function(data, year)
+
+
+def run_scale(orders, repeat=3):
+    """Benchmark one scale in this process and return its results."""
+    result = {"orders": orders, "seconds": {}, "peak_rss_mb": {}}
+
+    def measure(name, function, times=1):
+        # Best of ``times`` runs; peak RSS is the process high-water mark so far
+        best, value = None, None
+        for _ in range(times):
+            start = time.perf_counter()
+            value = function()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        result["seconds"][name] = round(best, 4)
+        result["peak_rss_mb"][name] = round(_peak_rss_mb(), 1)
+        return value
+
+    with tempfile.TemporaryDirectory() as tmp:
+        star_dir, shared_dir = os.path.join(tmp, "star"), os.path.join(tmp, "shared")
+        os.makedirs(star_dir)
+        start = time.perf_counter()
+        generate_star(orders, star_dir)
+        result["generate_seconds"] = round(time.perf_counter() - start, 2)
+        baseline_rss = _peak_rss_mb()
+
+        raw = measure("load.read", lambda: read_star(star_dir))
+        star = measure("load.prepare", lambda: prepare_star(raw))
+        del raw
+        measure("load.export", lambda: export_star(star, shared_dir))
+        star = measure("load.map", lambda: map_star(shared_dir))
+
+        years = metrics.years(star)
+        last = pd.Timestamp(LAST_PURCHASE)
+        measure("filter.year", lambda: [
+            metrics.select(star, name, metrics.period_slice(star, year))
+            for year in years for name in ["orders", "order_features"] + ORDER_FACTS
+        ], repeat)
+        measure("filter.date_range", lambda: [
+            metrics.select(star, name, metrics.period_slice(star, (last - pd.Timedelta(days=days), None)))
+            for days in (7, 30, 90, 365) for name in ["orders", "order_features"] + ORDER_FACTS
+        ], repeat)
+
+        built = measure("rollups.build", lambda: rollups.build_rollups(star))
+        for backend, queries, data in [("star", metrics, star), ("rollups", rollups, built)]:
+            for page, (names, by_year) in PAGES.items():
+                measure(f"{backend}.{page}", lambda: _run_page(queries, data, names, [None]), repeat)
+                if by_year:
+                    measure(f"{backend}.{page} [each year]", lambda: _run_page(queries, data, names, years), repeat)
+        measure("star.Delivery Performance", lambda: [delivery.delivery_stats(star, by) for by in delivery.GROUPS],
+                repeat)
+        measure("segments.build", lambda: segments.build_segments(star), repeat)
+
+    result["peak_rss_mb"]["total"] = round(_peak_rss_mb(), 1)
+    result["peak_rss_mb"]["data"] = round(_peak_rss_mb() - baseline_rss, 1)
+    return result
+
+
+def run(scales, repeat=3):
+    """Run every scale in a fresh interpreter and collect the results.
+
+    A scale whose process fails, say killed when the machine runs out of
+    memory, is listed under ``failed`` and the other scales still run.
+    """
+    results, failed = [], []
+    for orders in scales:
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--one-scale", str(orders), "--repeat", str(repeat)],
+            capture_output=True, text=True,
+        )
+        if process.returncode:
+            failed.append(orders)
+            reason = f"killed by signal {-process.returncode}" if process.returncode < 0 else process.stderr.strip()
+            print(f"{orders:>12,} orders: failed ({reason})", file=sys.stderr)
+            continue
+        results.append(json.loads(process.stdout))
+        print(f"{orders:>12,} orders: load {sum(v for k, v in results[-1]['seconds'].items() if k.startswith('load.')):.2f}s, "
+              f"peak RSS {results[-1]['peak_rss_mb']['total']:,.0f} MB", file=sys.stderr)
+    return {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "pyarrow": pa.__version__,
+        "machine": platform.machine(),
+        "results": results,
+        "failed": failed,
+    }
+
+
+def compare(report, baseline, tolerance=0.5, min_seconds=0.05):
+    """Return the regressions of ``report`` against ``baseline`` as messages.
+
+    A timing regresses when it is more than ``tolerance`` (a fraction) slower
+    and at least ``min_seconds`` slower than the baseline; the total peak RSS
+    when it is more than ``tolerance`` larger. A scale that failed to run,
+    and a scale or timing that only one of them has, are reported too, so a
+    stale baseline cannot pass unnoticed: record a new one with
+    ``--save-baseline``.
+    """
+    baseline_runs = {run["orders"]: run for run in baseline["results"]}
+    regressions = [f"{orders:,} orders: failed" for orders in report.get("failed", [])]
+    for run in report["results"]:
+        before = baseline_runs.get(run["orders"])
+        if before is None:
+            regressions.append(f"{run['orders']:,} orders: no baseline at this scale")
+            continue
+        for name in sorted(before["seconds"].keys() - run["seconds"].keys()):
+            regressions.append(f"{run['orders']:,} orders: {name} is in the baseline but was not run")
+        for name, seconds in run["seconds"].items():
+            expected = before["seconds"].get(name)
+            if expected is None:
+                regressions.append(f"{run['orders']:,} orders: {name} has no baseline")
+            elif seconds > expected * (1 + tolerance) and seconds - expected >= min_seconds:
+                regressions.append(f"{run['orders']:,} orders: {name} took {seconds:.3f}s (baseline {expected:.3f}s)")
+        peak, expected = run["peak_rss_mb"]["total"], before["peak_rss_mb"]["total"]
+        if peak > expected * (1 + tolerance):
+            regressions.append(f"{run['orders']:,} orders: peak RSS {peak:,.0f} MB (baseline {expected:,.0f} MB)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard's data functions on synthetic data.")
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES, help="numbers of orders")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per query timing (best is kept)")
+    parser.add_argument("--output", help="write the JSON results here (default: stdout)")
+    parser.add_argument("--baseline", nargs="?", const=BASELINE, help="compare against this stored run")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown as a fraction")
+    parser.add_argument("--one-scale", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.one_scale:
+        print(json.dumps(run_scale(args.one_scale, args.repeat)))
+        return
+
+    report = run(args.scales, args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        with open(args.baseline or BASELINE, "w") as f:
+            json.dump(report, f, indent=2)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            raise SystemExit(1)
+        print("No regressions against the baseline", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Compact in-memory representation of the star schema.
+
+As read from Parquet, every ID, city and category is an object column holding
+one Python string per row, and counts such as ``review_score`` are 64-bit.
+``compact_star`` re-encodes the tables once at load:
+
+* ID columns become categoricals whose categories are shared by every table
+  that holds the column, so each value is an int32 code (int16/int8 for
+  small data) and fact-dimension joins compare codes;
+* low-cardinality text (status, payment type, city, state, category) becomes
+  a per-column categorical;
+* integer-valued numerics are downcast. Money columns stay float64 so totals
+  keep their precision.
+
+``python dashboard/star_schema.py`` prints the bytes per column before and
+after.
+"""
+import numpy as np
+import pandas as pd
+
+ID_COLUMNS = ["order_id", "customer_id", "customer_unique_id", "product_id", "seller_id"]
+CATEGORY_COLUMNS = [
+    "order_status", "payment_type", "customer_city", "customer_state", "product_category_name",
+    "seller_city", "seller_state",
+]
+INTEGER_COLUMNS = ["order_item_id", "review_score"]
+
+
+def _values(column):
+    return column.cat.categories.to_numpy() if isinstance(column.dtype, pd.CategoricalDtype) else column.dropna().unique()
+
+
+def _downcast(column):
+    if column.isna().any() or not np.array_equal(column, column.round()):
+        return column
+    return pd.to_numeric(column, downcast="integer")
+
+
+def compact_star(star):
+    """Return a copy of ``star`` (a dict of frames) with compact column dtypes."""
+    tables = {name: table for name, table in star.items() if isinstance(table, pd.DataFrame)}
+    compact = dict(star)
+    for name, table in tables.items():
+        compact[name] = table.copy(deep=False)
+
+    for column in ID_COLUMNS:
+        holders = [name for name, table in tables.items() if column in table.columns]
+        if not holders:
+            continue
+        categories = pd.unique(np.concatenate([_values(tables[name][column]) for name in holders]))
+        dtype = pd.CategoricalDtype(categories)
+        for name in holders:
+            compact[name][column] = tables[name][column].astype(dtype)
+
+    for name, table in tables.items():
+        for column in table.columns:
+            if column in CATEGORY_COLUMNS:
+                compact[name][column] = table[column].astype("category")
+            elif column in INTEGER_COLUMNS:
+                compact[name][column] = _downcast(table[column])
+    return compact
+
+
+def dimension_codes(star, table, key, column, keys):
+    """Codes of ``column`` of dimension ``table`` for the ``key`` ID codes ``keys``, and its categories.
+
+    ID categories are shared by every table (see ``compact_star``), so this
+    join is an array lookup by code. Missing IDs (code -1) get code -1.
+    """
+    dimension = star[table]
+    lookup = np.full(len(dimension[key].cat.categories) + 1, -1, dtype=np.int64)
+    lookup[dimension[key].cat.codes.to_numpy()] = dimension[column].cat.codes.to_numpy()
+    # Code -1 reads the extra last entry
+    return lookup[keys], dimension[column].cat.categories
+
+
+def memory_usage(star):
+    """Bytes held by each column of each table, as a Series indexed by (table, column).
+
+    Categories shared between columns are counted once, at their first column.
+    """
+    usage = {}
+    seen = set()
+    for name, table in star.items():
+        if not isinstance(table, pd.DataFrame):
+            continue
+        for column in table.columns:
+            values = table[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                categories = values.cat.categories
+                nbytes = values.cat.codes.nbytes
+                if id(categories) not in seen:
+                    seen.add(id(categories))
+                    nbytes += categories.memory_usage(deep=True)
+            else:
+                nbytes = values.memory_usage(index=False, deep=True)
+            usage[name, column] = int(nbytes)
+    return pd.Series(usage, name="bytes").rename_axis(["table", "column"])
+
+
+def memory_report(before, after):
+    """Bytes per column of two versions of the star schema, with a total row."""
+    report = pd.concat([memory_usage(before).rename("before"), memory_usage(after).rename("after")], axis=1)
+    report.loc[("total", ""), :] = report.sum()
+    report = report.astype("int64")
+    report["ratio"] = (report["after"] / report["before"]).round(3)
+    return report
+
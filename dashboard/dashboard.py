@@ -1,667 +1,324 @@
-import pandas as pd
-import seaborn as sns
-import streamlit as st
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-from streamlit_option_menu import option_menu
-import os
-from babel.numbers import format_currency
-
-st.set_page_config(
-    page_title="E-Commerce Dashboard | Azegdita Vanaya Lerrick",
-    layout="wide",
-)
-
-# Load data
-all_df = pd.read_csv("dashboard/main_data.csv", low_memory=False)
-all_df.reset_index(inplace=True)
-
-# Parse date columns
-datetime_columns = ["order_purchase_timestamp", "order_approved_at", 
-                    "order_delivered_carrier_date", "order_delivered_customer_date", 
-                    "order_estimated_delivery_date"]
-for column in datetime_columns:
-    if column in all_df.columns:
-        all_df[column] = pd.to_datetime(all_df[column])
-
-# Sidebar Menu for Year Selection
-with st.sidebar:
-    selected = option_menu(
-        menu_title="Olist Dashboard Analysis",
-        options=["Monthly Orders Trend", "Total Sales by Product Category", "Average Rating by Product Category", "Customer Distribution", "Time Analysis", "Sales and Product by City"],
-        default_index=0,
-    )
-
-# Filter Data for Selected Year
-if selected == "Monthly Orders Trend":
-    st.title("Monthly Orders Trend")
-    # Sidebar for Year Selection
-    year_selected = st.sidebar.selectbox("Select Year", ["2016", "2017", "2018"], index=0)
-    if year_selected == "2016":
-        year_df = all_df[all_df['order_purchase_timestamp'].dt.year == 2016]
-    elif year_selected == "2017":
-        year_df = all_df[all_df['order_purchase_timestamp'].dt.year == 2017]
-    else:
-        year_df = all_df[all_df['order_purchase_timestamp'].dt.year == 2018]
-
-    # Monthly Orders Trend Visualization
-    def monthly_orders_trend(df):
-        monthly_orders_df = df.resample('M', on='order_purchase_timestamp').size()
-
-        fig = go.Figure()
-
-        fig.add_trace(go.Scatter(
-            x=monthly_orders_df.index,
-            y=monthly_orders_df.values,
-            mode='lines+markers',
-            marker=dict(color='blue', size=8),
-            line=dict(width=3),
-        ))
-
-        fig.update_layout(
-            title="Monthly Orders Trend",
-            xaxis=dict(
-                title="Month",
-                titlefont=dict(size=14),
-                tickfont=dict(size=12),
-            ),
-            yaxis=dict(
-                title="Number of Orders",
-                titlefont=dict(size=14),
-                tickfont=dict(size=12),
-            ),
-            width=650,
-            height=400,
-        )
-        st.plotly_chart(fig)
-
-    # Show Monthly Orders Trend
-    monthly_orders_trend(year_df)
-
-elif selected == "Total Sales by Product Category":
-    st.title("Total Sales by Product Category")
-
-    # Nested option menu for "Top-selling" and "Worst-selling" categories
-    sales_category = option_menu(
-        menu_title="Sales Category",
-        options=["Top-selling Category", "Worst-selling Category"],
-        default_index=0,
-        orientation="horizontal"
-    )
-
-    # Function to calculate total sales by product category
-    def df_product_sales_by_category(df):
-        # Group data by product category and sum the sales
-        df_category_sales = df.groupby(by="product_category_name").agg({
-            "payment_value": "sum",
-        }).reset_index().sort_values(by="payment_value", ascending=False)
-        return df_category_sales
-
-    # Function to calculate top-selling categories
-    def df_top_selling_category(df):
-        df_category_sales = df_product_sales_by_category(df)
-        return df_category_sales.head(10)
-
-    # Function to calculate worst-selling categories
-    def df_worst_selling_category(df):
-        df_category_sales = df_product_sales_by_category(df)
-        return df_category_sales.tail(10)
-
-    if sales_category == "Top-selling Category":
-        st.subheader("Top-selling Categories Over 2016 - 2018")
-
-        # Get the sales data by product category for top-selling
-        df_category_sales = df_top_selling_category(all_df)
-
-        with st.container():
-            fig = go.Figure()
-
-            fig.add_trace(go.Bar(
-                x=df_category_sales['product_category_name'],
-                y=df_category_sales['payment_value'],
-                marker=dict(
-                    color='rgb(173, 216, 230)',  # Set color here
-                ),
-            ))
-
-            # Use zip to iterate over the data correctly
-            for category, value in zip(df_category_sales['product_category_name'], df_category_sales['payment_value']):
-                fig.add_annotation(
-                    x=category,
-                    y=value,
-                    text=str(value),
-                    font=dict(
-                        size=10,
-                        color='white',  # Set text color here
-                    ),
-                    showarrow=False,
-                    textangle=0,
-                    align='center',
-                    yshift=10
-                )
-
-            fig.update_layout(
-                title='Top-selling Product Categories',
-                xaxis=dict(
-                    title='Product Category',
-                    tickangle=45,
-                    tickfont=dict(
-                        size=12,
-                    ),
-                    automargin=True,
-                ),
-                yaxis=dict(
-                    title='Total Sales',
-                    tickformat='plain',
-                    tickfont=dict(
-                        size=12,
-                    ),
-                ),
-                width=800,
-                height=500,
-                showlegend=False,
-            )
-
-            st.plotly_chart(fig)
-
-    elif sales_category == "Worst-selling Category":
-        st.subheader("Worst-selling Categories Over 2016 - 2018")
-
-        # Get the sales data by product category for worst-selling
-        df_category_sales = df_worst_selling_category(all_df)
-
-        with st.container():
-            fig = go.Figure()
-
-            fig.add_trace(go.Bar(
-                x=df_category_sales['product_category_name'],
-                y=df_category_sales['payment_value'],
-                marker=dict(
-                    color='rgb(173, 216, 230)',  # Set color here
-                ),
-            ))
-
-            # Use zip to iterate over the data correctly
-            for category, value in zip(df_category_sales['product_category_name'], df_category_sales['payment_value']):
-                fig.add_annotation(
-                    x=category,
-                    y=value,
-                    text=str(value),
-                    font=dict(
-                        size=10,
-                        color='white',  # Set text color here
-                    ),
-                    showarrow=False,
-                    textangle=0,
-                    align='center',
-                    yshift=10
-                )
-
-            fig.update_layout(
-                title='Worst-selling Product Categories',
-                xaxis=dict(
-                    title='Product Category',
-                    tickangle=45,
-                    tickfont=dict(
-                        size=12,
-                    ),
-                    automargin=True,
-                ),
-                yaxis=dict(
-                    title='Total Sales',
-                    tickformat='plain',
-                    tickfont=dict(
-                        size=12,
-                    ),
-                ),
-                width=800,
-                height=500,
-                showlegend=False,
-            )
-
-            st.plotly_chart(fig)
-
-elif selected == "Average Rating by Product Category":
-    st.title("Average Rating by Product Category")
-
-    # Nested option menu for "Top-rated" and "Worst-rated" categories
-    rating_category = option_menu(
-        menu_title="Rating Category",
-        options=["Top-rated Category", "Worst-rated Category"],
-        default_index=0,
-        orientation="horizontal"
-    )
-
-    # Function to calculate average rating by product category
-    def df_average_rating_by_category(df):
-        df_avg_rating = df.groupby('product_category_name')['review_score'].mean().reset_index()
-        df_avg_rating = df_avg_rating.sort_values(by='review_score', ascending=False)
-        return df_avg_rating
-
-    # Get the average rating by category
-    df_avg_rating = df_average_rating_by_category(all_df)
-
-    if rating_category == "Top-rated Category":
-        st.subheader("Top-rated Product Categories")
-
-        # Get the top-rated categories
-        top_rated_category = df_avg_rating.head(10)
-
-        with st.container():
-            fig = go.Figure()
-
-            fig.add_trace(go.Bar(
-                x=top_rated_category['product_category_name'],
-                y=top_rated_category['review_score'],
-                marker=dict(color='rgb(0, 128, 0)'),  # Green for top-rated categories
-            ))
-
-            # Annotate each bar with the average rating value
-            for category, value in zip(top_rated_category['product_category_name'], top_rated_category['review_score']):
-                fig.add_annotation(
-                    x=category,
-                    y=value,
-                    text=f"{value:.2f}",
-                    font=dict(size=10, color='white'),
-                    showarrow=False,
-                    textangle=0,
-                    align='center',
-                    yshift=10
-                )
-
-            fig.update_layout(
-                title='Top-rated Product Categories',
-                xaxis=dict(
-                    title='Product Category',
-                    tickangle=45,
-                    tickfont=dict(size=12),
-                    automargin=True,
-                ),
-                yaxis=dict(
-                    title='Average Rating',
-                    tickfont=dict(size=12),
-                ),
-                width=800,
-                height=500,
-                showlegend=False,
-            )
-
-            st.plotly_chart(fig)
-
-    elif rating_category == "Worst-rated Category":
-        st.subheader("Worst-rated Product Categories")
-
-        # Get the worst-rated categories
-        worst_rated_category = df_avg_rating.tail(10)
-
-        with st.container():
-            fig = go.Figure()
-
-            fig.add_trace(go.Bar(
-                x=worst_rated_category['product_category_name'],
-                y=worst_rated_category['review_score'],
-                marker=dict(color='rgb(255, 0, 0)'),  # Red for worst-rated categories
-            ))
-
-            # Annotate each bar with the average rating value
-            for category, value in zip(worst_rated_category['product_category_name'], worst_rated_category['review_score']):
-                fig.add_annotation(
-                    x=category,
-                    y=value,
-                    text=f"{value:.2f}",
-                    font=dict(size=10, color='white'),
-                    showarrow=False,
-                    textangle=0,
-                    align='center',
-                    yshift=10
-                )
-
-            fig.update_layout(
-                title='Worst-rated Product Categories',
-                xaxis=dict(
-                    title='Product Category',
-                    tickangle=45,
-                    tickfont=dict(size=12),
-                    automargin=True,
-                ),
-                yaxis=dict(
-                    title='Average Rating',
-                    tickfont=dict(size=12),
-                ),
-                width=800,
-                height=500,
-                showlegend=False,
-            )
-
-            st.plotly_chart(fig)
-    
-    # Add Rating and Review Analysis
-    st.subheader("Rating and Review Analysis")
-
-    # Top 5 Products with the Highest Rating
-    avg_rating_df = all_df.groupby(['product_id', 'product_category_name']).agg({'review_score': 'mean'}).reset_index()
-    top_rated_products = avg_rating_df.sort_values(by='review_score', ascending=False).head(5)
-    st.write("Top 5 Products with the Highest Ratings:")
-    st.table(top_rated_products[['product_id', 'product_category_name', 'review_score']])
-
-    # Rating Distribution
-    rating_dist_df = all_df.groupby('review_score').agg({'order_id': 'nunique'}).reset_index()
-    rating_dist_df.columns = ['Review Score', 'Order Count']
-
-    rating_fig = go.Figure()
-
-    rating_fig.add_trace(go.Bar(
-        x=rating_dist_df['Review Score'],
-        y=rating_dist_df['Order Count'],
-        name='Order Count',
-        marker=dict(color='rgb(102, 205, 170)'),
-    ))
-
-    rating_fig.update_layout(
-        title="Rating Distribution",
-        xaxis=dict(title='Review Score'),
-        yaxis=dict(title='Order Count'),
-        width=800,
-        height=500,
-    )
-
-    st.plotly_chart(rating_fig)
-
-
-elif selected == "Customer Distribution":
-    st.title("Customer Distribution")
-    
-    # Dropdown for year selection
-    year_selected = st.sidebar.selectbox("Select Year", ["2016", "2017", "2018"], index=0)
-
-    # Filter Data for Selected Year
-    if year_selected == "2016":
-        year_df = all_df[all_df['order_purchase_timestamp'].dt.year == 2016]
-    elif year_selected == "2017":
-        year_df = all_df[all_df['order_purchase_timestamp'].dt.year == 2017]
-    else:
-        year_df = all_df[all_df['order_purchase_timestamp'].dt.year == 2018]
-    
-    # Customer Distribution by City
-    city_df = year_df.groupby('customer_city').agg({'customer_id': 'nunique'}).reset_index()
-    city_df.columns = ['City', 'Customer Count']
-
-    # Sort the cities by customer count
-    sorted_city_df = city_df.sort_values(by='Customer Count', ascending=False)
-    
-    # Top Customers and Worst Customers
-    top_customers = sorted_city_df.head(5)  # Top 5 cities
-    worst_customers = sorted_city_df.tail(5)  # Worst 5 cities
-
-    # Create visualization for customer distribution
-    fig = go.Figure()
-
-    # Add trace for top customers
-    fig.add_trace(go.Bar(
-        x=top_customers['City'],
-        y=top_customers['Customer Count'],
-        name="Top Customers",
-        marker=dict(color='rgb(102, 205, 170)'),
-    ))
-
-    # Add trace for worst customers
-    fig.add_trace(go.Bar(
-        x=worst_customers['City'],
-        y=worst_customers['Customer Count'],
-        name="Worst Customers",
-        marker=dict(color='rgb(255, 99, 71)'),
-    ))
-
-    # Annotate bars
-    for city, count in zip(top_customers['City'], top_customers['Customer Count']):
-        fig.add_annotation(
-            x=city,
-            y=count,
-            text=str(count),
-            font=dict(size=12, color='white'),
-            showarrow=False,
-            textangle=0,
-            align='center',
-            yshift=10
-        )
-
-    for city, count in zip(worst_customers['City'], worst_customers['Customer Count']):
-        fig.add_annotation(
-            x=city,
-            y=count,
-            text=str(count),
-            font=dict(size=12, color='white'),
-            showarrow=False,
-            textangle=0,
-            align='center',
-            yshift=10
-        )
-
-    # Update layout for the plot
-    fig.update_layout(
-        title=f"Customer Distribution for {year_selected}",
-        xaxis=dict(title='City', tickangle=45),
-        yaxis=dict(title='Customer Count'),
-        barmode='group',  # Display bars side by side
-        width=800,
-        height=500,
-    )
-    
-    st.plotly_chart(fig)
-
-    # Segmentasi Pembelian Berdasarkan Metode Pembayaran
-    payment_method_df = year_df.groupby('payment_type').agg({'order_id': 'nunique'}).reset_index()
-    payment_method_df.columns = ['Payment Type', 'Purchase Count']
-
-    st.subheader(f"Purchase Segmentation Based on Payment Method ({year_selected})")
-    payment_fig = go.Figure()
-
-    payment_fig.add_trace(go.Pie(
-        labels=payment_method_df['Payment Type'],
-        values=payment_method_df['Purchase Count'],
-        hole=0.3,
-        marker=dict(colors=['rgb(102, 205, 170)', 'rgb(255, 99, 71)', 'rgb(255, 215, 0)', 'rgb(70, 130, 180)']),
-    ))
-
-    st.plotly_chart(payment_fig)
-
-    # Rata-rata Pengeluaran per Pelanggan
-    avg_spending_df = year_df.groupby('customer_id').agg({'payment_value': 'sum'}).reset_index()
-    avg_spending_per_customer = avg_spending_df['payment_value'].mean()
-
-    st.subheader(f"Average Spend per Customer ({year_selected})")
-    st.write(f"Average Spend per Customer is: {avg_spending_per_customer:.2f}")
-
-
-    # # Analisis Rating dan Review
-    # avg_rating_df = year_df.groupby('product_id').agg({'review_score': 'mean'}).reset_index()
-    # top_rated_products = avg_rating_df.sort_values(by='review_score', ascending=False).head(5)
-
-    # st.subheader(f"Rating and Review Analysis ({year_selected})")
-    # st.write("Top 5 Products with the Highest Rating::")
-
-    # # Create a table or visualization for top-rated products
-    # st.write(top_rated_products[['product_id', 'review_score']])
-
-    # # Visualize the rating distribution
-    # rating_dist_df = year_df.groupby('review_score').agg({'order_id': 'nunique'}).reset_index()
-    # rating_dist_df.columns = ['Review Score', 'Order Count']
-
-    # rating_fig = go.Figure()
-
-    # rating_fig.add_trace(go.Bar(
-    #     x=rating_dist_df['Review Score'],
-    #     y=rating_dist_df['Order Count'],
-    #     marker=dict(color='rgb(102, 205, 170)'),
-    # ))
-
-    # st.plotly_chart(rating_fig)
-
-elif selected == "Time Analysis":
-    st.title("Time Based Sales Analysis")
-    
-    # Rata-rata Waktu Pengiriman (Tepat Waktu vs Terlambat)
-    st.subheader("Average Delivery Time (On Time vs Late)")
-    
-    # Menghitung selisih waktu antara pengiriman yang diestimasi dan yang sebenarnya
-    all_df['order_purchase_timestamp'] = pd.to_datetime(all_df['order_purchase_timestamp'])
-    all_df['order_delivered_customer_date'] = pd.to_datetime(all_df['order_delivered_customer_date'])
-    all_df['order_estimated_delivery_date'] = pd.to_datetime(all_df['order_estimated_delivery_date'])
-    
-    # Menghitung selisih waktu pengiriman
-    all_df['delivery_time_diff'] = (all_df['order_delivered_customer_date'] - all_df['order_estimated_delivery_date']).dt.days
-    
-    # Label pengiriman tepat waktu atau terlambat
-    all_df['delivery_status'] = all_df['delivery_time_diff'].apply(lambda x: 'On time' if x <= 0 else 'Late')
-    
-    # Visualisasi pengiriman tepat waktu dan terlambat
-    delivery_status_count = all_df['delivery_status'].value_counts()
-    fig = go.Figure(data=[go.Bar(
-        x=delivery_status_count.index,
-        y=delivery_status_count.values,
-        marker=dict(color=['rgb(102, 205, 170)', 'rgb(255, 99, 71)'])
-    )])
-
-    fig.update_layout(
-        title="On Time vs Late Delivery",
-        xaxis=dict(title="Delivery Status"),
-        yaxis=dict(title="Order Quantity"),
-        width=800,
-        height=500
-    )
-    st.plotly_chart(fig)
-
-    # Waktu Pembelian dan Rating Produk
-    st.subheader("Purchase Time and Product Ratings")
-    
-    # Menghitung rata-rata rating berdasarkan jam pembelian
-    all_df['hour_of_purchase'] = all_df['order_purchase_timestamp'].dt.hour
-    purchase_rating = all_df.groupby('hour_of_purchase')['review_score'].mean().reset_index()
-    
-    # Visualisasi rating berdasarkan jam pembelian
-    fig = go.Figure(data=[go.Scatter(
-        x=purchase_rating['hour_of_purchase'],
-        y=purchase_rating['review_score'],
-        mode='lines+markers',
-        marker=dict(color='rgb(255, 99, 71)')
-    )])
-
-    fig.update_layout(
-        title="Average Product Rating Based on Time of Purchase",
-        xaxis=dict(title="Purchase Time"),
-        yaxis=dict(title="Average Rating"),
-        width=800,
-        height=500
-    )
-    st.plotly_chart(fig)
-
-    # Customer Purchase Time (Pagi, Siang, Malam)
-    st.subheader("Customer Purchase Time (Morning, Afternoon, Evening)")
-    
-    # Membuat kategori waktu pembelian
-    def categorize_purchase_time(hour):
-        if 0 <= hour < 6:
-            return 'Malam'
-        elif 6 <= hour < 12:
-            return 'Pagi'
-        elif 12 <= hour < 18:
-            return 'Siang'
-        else:
-            return 'Sore'
-    
-    all_df['purchase_time_of_day'] = all_df['hour_of_purchase'].apply(categorize_purchase_time)
-    
-    # Visualisasi distribusi waktu pembelian
-    purchase_time_distribution = all_df['purchase_time_of_day'].value_counts()
-    fig = go.Figure(data=[go.Bar(
-        x=purchase_time_distribution.index,
-        y=purchase_time_distribution.values,
-        marker=dict(color='rgb(102, 205, 170)')
-    )])
-
-    fig.update_layout(
-        title="Purchase Time Distribution",
-        xaxis=dict(title="Purchase Time"),
-        yaxis=dict(title="Order Quantity"),
-        width=800,
-        height=500
-    )
-    st.plotly_chart(fig)
-
-    # Pengaruh Hari dalam Minggu Terhadap Penjualan
-    st.subheader("The Effect of the Day of the Week on Sales")
-    
-    # Mengambil hari dalam minggu
-    all_df['day_of_week'] = all_df['order_purchase_timestamp'].dt.day_name()
-    day_of_week_sales = all_df.groupby('day_of_week')['order_id'].count().reset_index()
-    
-    # Urutkan berdasarkan hari dalam minggu
-    day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    day_of_week_sales['day_of_week'] = pd.Categorical(day_of_week_sales['day_of_week'], categories=day_order, ordered=True)
-    day_of_week_sales = day_of_week_sales.sort_values('day_of_week')
-    
-    # Visualisasi pengaruh hari dalam minggu
-    fig = go.Figure(data=[go.Bar(
-        x=day_of_week_sales['day_of_week'],
-        y=day_of_week_sales['order_id'],
-        marker=dict(color='rgb(255, 99, 71)')
-    )])
-
-    fig.update_layout(
-        title="The Effect of the Day of the Week on Sales",
-        xaxis=dict(title="Day of Week"),
-        yaxis=dict(title="Order Quantity"),
-        width=800,
-        height=500
-    )
-    st.plotly_chart(fig)
-
-elif selected == "Sales and Product by City":
-    st.title("Total Sales and Product Sold by City")
-    
-    # Group by customer_city to calculate total sales and units sold for all years
-    city_sales_df = all_df.groupby('customer_city').agg({
-        'payment_value': 'sum',  # Total sales
-        'order_item_id': 'sum'   # Total units sold
-    }).reset_index()
-    
-    city_sales_df.columns = ['City', 'Total Sales', 'Product Sold']
-
-    # Sort the data by total sales
-    sorted_city_sales_df = city_sales_df.sort_values(by='Total Sales', ascending=False)
-
-    # Create a dual-axis chart with a bar chart for Total Sales and a line chart for Units Sold
-    fig = make_subplots(specs=[[{"secondary_y": True}]])
-
-    # Add trace for total sales (Primary y-axis) - Bar chart
-    fig.add_trace(go.Bar(
-        x=sorted_city_sales_df['City'],
-        y=sorted_city_sales_df['Total Sales'],
-        name="Total Sales",
-        marker=dict(color='rgb(102, 205, 170)'),
-    ), secondary_y=False)
-
-    # Add trace for units sold (Secondary y-axis) - Line chart
-    fig.add_trace(go.Scatter(
-        x=sorted_city_sales_df['City'],
-        y=sorted_city_sales_df['Product Sold'],
-        name="Product Sold",
-        mode='lines+markers',
-        marker=dict(color='rgb(255, 99, 71)'),
-    ), secondary_y=True)
-
-    # Update layout for the plot
-    fig.update_layout(
-        title="Total Sales and Product Sold by City",
-        xaxis=dict(title='City', tickangle=45),
-        barmode='group',  # Display bars side by side
-        width=800,
-        height=500,
-    )
-
-    # Update y-axes titles
-    fig.update_yaxes(title_text="Total Sales", secondary_y=False)
-    fig.update_yaxes(title_text="Product Sold", secondary_y=True)
-    
-    st.plotly_chart(fig)
+import datetime
+import json
+import math
+import os
+
+import streamlit as st
+from streamlit_option_menu import option_menu
+
+import instrument
+import views
+
+st.set_page_config(
+    page_title="E-Commerce Dashboard | Azegdita Vanaya Lerrick",
+    layout="wide",
+)
+
+# Load the data on a background thread (once per process) while the menu is drawn,
+# and rebuild it in the background when it changes (see refresh.py). A snapshot
+# needs neither, nor the data backends: those are only imported for live data.
+if not os.environ.get("DASHBOARD_SNAPSHOT"):
+    import analytics
+    import live_views
+    import refresh
+    import startup
+
+    startup.prewarm_in_background()
+    refresh.start()
+
+def global_filters(options):
+    """Sidebar widgets of the filters applied to every page; returns ``analytics.filter_dataset`` arguments."""
+    first, last = (date.date() for date in options["dates"])
+    dates = st.sidebar.date_input("Purchase dates", value=(first, last), min_value=first, max_value=last)
+    cities = sorted({city for state_cities in options["cities"].values() for city in state_cities})
+    return {
+        # The full range is no filter, so unfiltered results are reused
+        "start": dates[0] if dates and dates[0] > first else None,
+        "end": dates[1] + datetime.timedelta(days=1) if len(dates) == 2 and dates[1] < last else None,
+        "states": st.sidebar.multiselect("Customer states", options["states"]),
+        "cities": st.sidebar.multiselect("Customer cities", cities),
+        "categories": st.sidebar.multiselect("Product categories", options["categories"]),
+        "payment_types": st.sidebar.multiselect("Payment types", options["payment_types"]),
+    }
+
+
+# Sidebar Menu for Year Selection; ?page=<name> opens a page directly
+requested_page = st.query_params.get("page")
+with st.sidebar:
+    selected = option_menu(
+        menu_title="Olist Dashboard Analysis",
+        options=views.PAGES,
+        default_index=views.PAGES.index(requested_page) if requested_page in views.PAGES else 0,
+    )
+
+# Each render is timed stage by stage (see instrument.py); ?debug=1 shows it below the page
+render = instrument.begin(selected)
+
+# Every chart, table and value comes from a view source (see views.py): live,
+# computed by the analytics package and drawn by figures.py (see live_views.py),
+# or read from a static snapshot (see snapshot.py) when DASHBOARD_SNAPSHOT is
+# set. Modules only some pages need are imported by those pages.
+if os.environ.get("DASHBOARD_SNAPSHOT"):
+    import snapshot
+    source = snapshot.SnapshotViews(snapshot.resolve(os.environ["DASHBOARD_SNAPSHOT"]))
+else:
+    with instrument.stage("load", os.environ.get("DASHBOARD_BACKEND", "auto")):
+        dataset = analytics.open_dataset()
+    # Filters on every page, answered from mask indexes over the star schema (see filters.py)
+    if st.sidebar.toggle("Filter all pages", help="The map shows all customers and sellers"):
+        dataset = analytics.filter_dataset(dataset, **global_filters(analytics.filter_options(dataset)))
+    source = live_views.LiveViews(dataset)
+
+# Years in the data, taken from the time index (or the rollups built from it)
+year_options = source.value("years")
+
+# Filter Data for Selected Year
+if selected == "Monthly Orders Trend":
+    st.title("Monthly Orders Trend")
+    # Sidebar for Year Selection
+    year_selected = st.sidebar.selectbox("Select Year", year_options, index=0)
+
+    # Monthly Orders Trend Visualization
+    st.plotly_chart(source.figure("monthly_orders", year_selected).figure)
+
+elif selected == "Total Sales by Product Category":
+    st.title("Total Sales by Product Category")
+
+    # Nested option menu for "Top-selling" and "Worst-selling" categories
+    sales_category = option_menu(
+        menu_title="Sales Category",
+        options=["Top-selling Category", "Worst-selling Category"],
+        default_index=0,
+        orientation="horizontal"
+    )
+
+    if sales_category == "Top-selling Category":
+        st.subheader(f"Top-selling Categories Over {year_options[0]} - {year_options[-1]}")
+
+    elif sales_category == "Worst-selling Category":
+        st.subheader(f"Worst-selling Categories Over {year_options[0]} - {year_options[-1]}")
+
+    with st.container():
+        st.plotly_chart(source.figure("category_sales", sales_category).figure)
+
+elif selected == "Average Rating by Product Category":
+    st.title("Average Rating by Product Category")
+
+    # Nested option menu for "Top-rated" and "Worst-rated" categories
+    rating_category = option_menu(
+        menu_title="Rating Category",
+        options=["Top-rated Category", "Worst-rated Category"],
+        default_index=0,
+        orientation="horizontal"
+    )
+
+    if rating_category == "Top-rated Category":
+        st.subheader("Top-rated Product Categories")
+
+    elif rating_category == "Worst-rated Category":
+        st.subheader("Worst-rated Product Categories")
+
+    with st.container():
+        st.plotly_chart(source.figure("category_rating", rating_category).figure)
+
+    # Add Rating and Review Analysis
+    st.subheader("Rating and Review Analysis")
+
+    # Top 5 products by review score adjusted for their number of reviews (see ranking.py)
+    product_ranking = st.sidebar.selectbox("Products", views.PRODUCT_RANKINGS)
+    min_reviews = st.sidebar.selectbox("Minimum reviews", views.PRODUCT_MIN_REVIEWS)
+    top_rated_products = source.table("top_rated_products", product_ranking, min_reviews)
+    highest = product_ranking == "Highest-rated"
+    st.write(f"Top {views.PRODUCT_COUNT} Products with the {'Highest' if highest else 'Lowest'} Ratings:")
+    st.table(top_rated_products)
+    st.caption(f"Ranked by score: the mean rating with {views.PRIOR_REVIEWS} reviews at the overall mean added, "
+               "so products with few reviews do not top the list on one 5-star review")
+
+    with st.expander("Highest-rated product in each category"):
+        st.dataframe(source.table("top_rated_per_category", min_reviews), hide_index=True)
+
+    # Rating Distribution
+    st.plotly_chart(source.figure("rating_distribution").figure)
+
+
+elif selected == "Customer Distribution":
+    st.title("Customer Distribution")
+
+    # Dropdown for year selection
+    year_selected = st.sidebar.selectbox("Select Year", year_options, index=0)
+
+    # Top 5 and worst 5 customer cities
+    st.plotly_chart(source.figure("customer_cities", year_selected).figure)
+
+    # Segmentasi Pembelian Berdasarkan Metode Pembayaran
+    st.subheader(f"Purchase Segmentation Based on Payment Method ({year_selected})")
+    st.plotly_chart(source.figure("payment_segments", year_selected).figure)
+
+    # Rata-rata Pengeluaran per Pelanggan
+    avg_spending_per_customer = source.value("average_spend", year_selected)
+
+    st.subheader(f"Average Spend per Customer ({year_selected})")
+    st.write(f"Average Spend per Customer is: {avg_spending_per_customer:.2f}")
+
+
+    # # Analisis Rating dan Review
+    # avg_rating_df = year_df.groupby('product_id').agg({'review_score': 'mean'}).reset_index()
+    # top_rated_products = avg_rating_df.sort_values(by='review_score', ascending=False).head(5)
+
+    # st.subheader(f"Rating and Review Analysis ({year_selected})")
+    # st.write("Top 5 Products with the Highest Rating::")
+
+    # # Create a table or visualization for top-rated products
+    # st.write(top_rated_products[['product_id', 'review_score']])
+
+    # # Visualize the rating distribution
+    # rating_dist_df = year_df.groupby('review_score').agg({'order_id': 'nunique'}).reset_index()
+    # rating_dist_df.columns = ['Review Score', 'Order Count']
+
+    # rating_fig = go.Figure()
+
+    # rating_fig.add_trace(go.Bar(
+    #     x=rating_dist_df['Review Score'],
+    #     y=rating_dist_df['Order Count'],
+    #     marker=dict(color='rgb(102, 205, 170)'),
+    # ))
+
+    # st.plotly_chart(rating_fig)
+
+elif selected == "Customer Segments":
+    st.title("Customer Segments")
+
+    # Customers are customer_unique_id: Olist gives every order a new customer_id
+    st.subheader("Recency, Frequency and Monetary (RFM) Segments")
+    st.plotly_chart(source.figure("customer_segments").figure)
+    st.dataframe(source.table("customer_segments"), hide_index=True)
+    st.caption(
+        "Recency: days from a customer's last purchase to the latest purchase in the data. Orders: purchases per "
+        "customer. Spend: payments per customer. Segments follow recency and order count scores."
+    )
+
+    st.subheader("Monthly Cohort Retention")
+    st.plotly_chart(source.figure("cohort_retention").figure)
+    st.caption("Share of the customers first buying in each month who ordered again 1, 2, ... months later.")
+
+elif selected == "Time Analysis":
+    st.title("Time Based Sales Analysis")
+
+    # Rata-rata Waktu Pengiriman (Tepat Waktu vs Terlambat)
+    st.subheader("Average Delivery Time (On Time vs Late)")
+
+    # Jumlah pesanan tepat waktu vs terlambat
+    st.plotly_chart(source.figure("delivery_status").figure)
+
+    # Waktu Pembelian dan Rating Produk
+    st.subheader("Purchase Time and Product Ratings")
+
+    # Rata-rata rating berdasarkan jam pembelian
+    st.plotly_chart(source.figure("hour_rating").figure)
+
+    # Customer Purchase Time (Pagi, Siang, Malam)
+    st.subheader("Customer Purchase Time (Morning, Afternoon, Evening)")
+
+    # Kategori waktu pembelian: Malam (0-6), Pagi (6-12), Siang (12-18), Sore (18-24)
+    st.plotly_chart(source.figure("time_of_day").figure)
+
+    # Pengaruh Hari dalam Minggu Terhadap Penjualan
+    st.subheader("The Effect of the Day of the Week on Sales")
+
+    # Jumlah pesanan per hari dalam minggu, urut Senin - Minggu
+    st.plotly_chart(source.figure("weekday").figure)
+
+elif selected == "Sales and Product by City":
+    st.title("Total Sales and Product Sold by City")
+
+    # Only the top (or bottom) cities are charted, the rest are one "Other" bar
+    city_ranking = st.radio("Cities", views.CITY_RANKINGS, horizontal=True)
+    city_count = st.slider("Number of cities", min_value=views.CITY_COUNTS[0], max_value=views.CITY_COUNTS[-1],
+                           value=20, step=views.CITY_COUNTS[1] - views.CITY_COUNTS[0])
+
+    # Dual-axis chart: bars for Total Sales, a line for Units Sold
+    city_chart = source.figure("city_sales", city_ranking, city_count)
+    st.plotly_chart(city_chart.figure)
+    chart_bytes = len(city_chart.json)
+
+    # The long tail is browsed a page at a time instead of charted
+    st.subheader("All Cities")
+    search = st.text_input("Search city")
+    page_size = views.CITY_PAGE_SIZE
+    # The page asked for last run; past the last page of this search, the table gives the last page
+    page = st.session_state.get("city_page", 1) - 1
+    city_rows, matching = source.table("city_sales_page", search, page, page_size)
+    page_count = max(1, -(-matching // page_size))
+    st.session_state["city_page"] = min(page + 1, page_count)
+    st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, key="city_page")
+    st.dataframe(city_rows, hide_index=True)
+    with instrument.stage("serialize", "city_sales_page") as stage:
+        table_bytes = stage["bytes"] = len(json.dumps(city_rows))
+
+    st.caption(
+        f"Payload {chart_bytes / 1024:.1f} KB chart + {table_bytes / 1024:.1f} KB table "
+        f"({len(city_chart.figure['data'][0]['x'])} bars, {len(city_rows)} of {matching:,} matching cities)"
+    )
+
+elif selected == "Delivery Performance":
+    st.title("Delivery Performance")
+
+    # Per customer state, seller, product category, payment type or purchase month
+    group = st.sidebar.selectbox("Break down by", list(views.DELIVERY_GROUPS.values()))
+    by = next(name for name, label in views.DELIVERY_GROUPS.items() if label == group)
+
+    st.plotly_chart(source.figure("delivery_percentiles", by).figure)
+    if by != "month":
+        st.caption(f"The {views.DELIVERY_CHART_GROUPS} groups with the most orders")
+
+    st.subheader(f"Lead Time, Carrier Handoff and Lateness by {group}")
+    st.dataframe(source.table("delivery_stats", by), hide_index=True)
+    st.caption(
+        "Lead time: purchase to delivery to the customer. Handoff: approval to handing the order to the carrier. "
+        "Both in days, at the 50th, 90th and 99th percentiles. Late %: delivered orders that arrived after the "
+        "estimated date; Days late: how late those were on average. An order counts in every group it belongs to."
+    )
+
+    st.plotly_chart(source.figure("lead_time_histogram").figure)
+
+elif selected == "Customer and Seller Map":
+    import geo
+    import pydeck as pdk
+
+    st.title("Customers and Sellers by Location")
+
+    centers = source.value("map_centers")
+    if not centers:
+        st.info("The map index has not been built; run python dashboard/geo.py")
+    else:
+        # Only the grid cells of the chosen zoom level around the chosen center are sent
+        measures = {"Customers": "customers", "Sellers": "sellers", "Total Sales": "payment_value"}
+        measure = measures[st.radio("Measure", list(measures), horizontal=True)]
+        center = st.selectbox("Center on", ["Brazil"] + [row["state"] for row in centers])
+        zoom = st.slider("Zoom", min_value=geo.MAP_ZOOMS[0], max_value=geo.MAP_ZOOMS[-1], value=4)
+        lat, lng = geo.BRAZIL_CENTER if center == "Brazil" else next(
+            (row["lat"], row["lng"]) for row in centers if row["state"] == center)
+
+        cells = source.table("map_cells", zoom, lat, lng)
+        # Log scale, so a few dense cities do not wash out everything else
+        peak = math.log1p(max((cell[measure] for cell in cells), default=0)) or 1
+        cells = [dict(cell, weight=math.log1p(cell[measure]) / peak) for cell in cells if cell[measure] > 0]
+        layer = pdk.Layer(
+            "PolygonLayer",
+            cells,
+            get_polygon="polygon",
+            get_fill_color="[255, 99, 71, 40 + 215 * weight]",
+            stroked=False,
+            pickable=True,
+        )
+        st.pydeck_chart(pdk.Deck(
+            layers=[layer],
+            initial_view_state=pdk.ViewState(latitude=lat, longitude=lng, zoom=zoom),
+            tooltip={"text": "Customers: {customers}\nSellers: {sellers}\nTotal Sales: {payment_value}"},
+        ), height=geo.MAP_HEIGHT)
+        st.caption(f"{len(cells):,} cells at zoom {zoom}")
+
+instrument.finish(render)
+if st.query_params.get("debug"):
+    with st.expander(f"Render timings: {render['seconds'] * 1000:.0f} ms"):
+        st.dataframe(instrument.stage_rows(render), hide_index=True)
@@ -0,0 +1,325 @@
+"""Cached loading of the merged dashboard dataset.
+
+Streamlit re-executes ``dashboard.py`` on every widget interaction, so the
+merged data must not be parsed on every rerun. The dataset is read from the
+year/month partitioned Parquet dataset written by ``pipeline.py`` when it
+exists, and from the legacy ``main_data.csv`` otherwise. A CSV is parsed once
+with explicit dtypes and persisted as a typed Parquet sidecar next to it.
+
+Either way the resulting frame is kept in a process-wide cache keyed on the
+source's path, mtime and size, so later loads skip the parse entirely until
+the files change.
+"""
+import os
+import shutil
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+MAIN_DATA_CSV = os.path.join(DATA_DIR, "main_data.csv")
+MAIN_DATA_DIR = os.path.join(DATA_DIR, "main_data")
+
+DATETIME_COLUMNS = [
+    "order_purchase_timestamp",
+    "order_approved_at",
+    "order_delivered_carrier_date",
+    "order_delivered_customer_date",
+    "order_estimated_delivery_date",
+]
+
+# Explicit dtypes for the columns written by the notebook / pipeline, so the
+# CSV parse never has to guess (and never falls back to mixed object columns).
+COLUMN_DTYPES = {
+    "order_id": "object",
+    "customer_id": "object",
+    "customer_unique_id": "object",
+    "customer_city": "object",
+    "customer_state": "object",
+    "product_id": "object",
+    "product_category_name": "object",
+    "order_item_id": "float64",
+    "price": "float64",
+    "freight_value": "float64",
+    "payment_type": "object",
+    "payment_value": "float64",
+    "review_score": "float64",
+    "order_status": "object",
+}
+
+# Keys stored in the sidecar's schema metadata to tie it to its source CSV
+_SOURCE_MTIME_KEY = b"source_mtime_ns"
+_SOURCE_SIZE_KEY = b"source_size"
+
+_cache = {}
+_cache_lock = threading.Lock()
+# Key -> lock held while that key loads, so each version is loaded once
+_load_locks = {}
+
+
+def _dataset_files(root):
+    # Same rule as pyarrow's dataset discovery: skip "_" and "." prefixed entries
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(("_", ".")))
+        for filename in sorted(filenames):
+            if not filename.startswith(("_", ".")):
+                yield os.path.join(dirpath, filename)
+
+
+def source_key(path):
+    """Return the cache key (path, mtime, size) of a file or dataset directory."""
+    if os.path.isdir(path):
+        stats = [os.stat(file) for file in _dataset_files(path)]
+        return (
+            os.path.abspath(path),
+            max((stat.st_mtime_ns for stat in stats), default=0),
+            sum(stat.st_size for stat in stats),
+            len(stats),
+        )
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def source_signature(path=None):
+    """Return a copy-stable signature of the data at ``path``.
+
+    Unlike the cache key this ignores mtimes, so artifacts derived from the
+    data (e.g. rollups) stay valid when the tree is copied or checked out.
+    """
+    if path is None:
+        path = default_source()
+    if os.path.isdir(path):
+        return [[os.path.relpath(file, path), os.path.getsize(file)] for file in _dataset_files(path)]
+    return [[os.path.basename(path), os.path.getsize(path)]]
+
+
+def default_source():
+    """Return the partitioned dataset if it has been built, else the CSV."""
+    return MAIN_DATA_DIR if os.path.isdir(MAIN_DATA_DIR) else MAIN_DATA_CSV
+
+
+def replace_directory(root, write):
+    """Build a directory with ``write(tmp_root)`` and swap it in at ``root``.
+
+    The directory is written as a hidden version next to ``root``
+    (``.<name>.<time>.<pid>``) and ``root`` is a symbolic link to it, which
+    one rename replaces: readers see either the old or the new directory,
+    never a partial write and never no directory. The old version is removed
+    afterwards. A ``root`` that is a plain directory (written before versions
+    were linked, or where the platform has no symbolic links) is swapped with
+    two renames instead, between which it does not exist.
+    """
+    root = os.path.abspath(root)
+    parent, name = os.path.split(root)
+    tmp_root = f"{root}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_root, ignore_errors=True)
+    os.makedirs(tmp_root)
+    write(tmp_root)
+
+    version = os.path.join(parent, f".{name}.{time.time_ns()}.{os.getpid()}")
+    os.replace(tmp_root, version)
+    link = f"{root}.{os.getpid()}.link"
+    try:
+        os.symlink(os.path.basename(version), link, target_is_directory=True)
+    except (OSError, NotImplementedError):
+        link = version
+    old = _linked_version(root)
+    if os.path.isdir(root) and not os.path.islink(root):
+        # A rename cannot replace a directory that has files
+        old = f"{root}.{os.getpid()}.old"
+        os.replace(root, old)
+    os.replace(link, root)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def _linked_version(root):
+    """The version ``root`` links to if ``replace_directory`` made the link, else None."""
+    if not os.path.islink(root):
+        return None
+    target = os.readlink(root)
+    if os.path.dirname(target) or not target.startswith(f".{os.path.basename(root)}."):
+        return None
+    return os.path.join(os.path.dirname(os.path.abspath(root)), target)
+
+
+def remove_directory(root):
+    """Remove ``root``, as ``replace_directory`` wrote it, with the version it links to."""
+    version = _linked_version(root)
+    if os.path.islink(root):
+        os.remove(root)
+    else:
+        shutil.rmtree(root)
+    if version is not None:
+        shutil.rmtree(version, ignore_errors=True)
+
+
+def update_directory(root, update):
+    """Like ``replace_directory``, but the new directory starts as a copy of ``root``.
+
+    Files are hard-linked into the copy where the file system allows, so
+    ``update(tmp_root)`` only pays for what it changes. It must replace or
+    remove files, never modify one in place: a linked file is shared with
+    ``root``.
+    """
+    def write(tmp_root):
+        if os.path.isdir(root):
+            shutil.copytree(root, tmp_root, copy_function=_link_or_copy, dirs_exist_ok=True)
+        update(tmp_root)
+
+    replace_directory(root, write)
+
+
+def _link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def sidecar_path(path):
+    """Return the Parquet sidecar path that belongs to ``path``."""
+    return os.path.splitext(path)[0] + ".parquet"
+
+
+def _read_csv(path):
+    header = pd.read_csv(path, nrows=0).columns
+    dtypes = {column: dtype for column, dtype in COLUMN_DTYPES.items() if column in header}
+    return _parse_dates(pd.read_csv(path, dtype=dtypes, engine="pyarrow"))
+
+
+def _parse_dates(df):
+    for column in DATETIME_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column], format="ISO8601").astype("datetime64[ns]")
+    return df
+
+
+def _read_dataset(path, columns=None):
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    # year/month only exist to lay out the partitions
+    columns = [name for name in dataset.schema.names
+               if name not in ("year", "month") and (columns is None or name in columns)]
+    return dataset.to_table(columns=columns).to_pandas()
+
+
+def _read_sidecar(path, key, columns=None):
+    sidecar = sidecar_path(path)
+    if not os.path.exists(sidecar):
+        return None
+    schema = pq.read_schema(sidecar)
+    metadata = schema.metadata or {}
+    if (metadata.get(_SOURCE_MTIME_KEY) != str(key[1]).encode()
+            or metadata.get(_SOURCE_SIZE_KEY) != str(key[2]).encode()):
+        return None
+    if columns is not None:
+        columns = [name for name in schema.names if name in columns]
+    return pd.read_parquet(sidecar, columns=columns)
+
+
+def _write_sidecar(path, key, df):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[_SOURCE_MTIME_KEY] = str(key[1]).encode()
+    metadata[_SOURCE_SIZE_KEY] = str(key[2]).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    # Write to a temporary file first so a concurrent reader never sees a
+    # half-written sidecar.
+    sidecar = sidecar_path(path)
+    tmp_path = f"{sidecar}.{os.getpid()}.tmp"
+    try:
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, sidecar)
+    except OSError:
+        # A read-only deployment still works, it just re-parses per process
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def cached(key, load):
+    """Return the process-wide cached value for ``key``, calling ``load`` on a miss.
+
+    ``key[0]`` identifies the artifact (usually its path); when a new version
+    is loaded, older versions of the same artifact are evicted. ``load`` runs
+    under a lock of its own key only: callers of other keys, including the
+    cached ones, do not wait for it.
+    """
+    with _cache_lock:
+        if key in _cache:
+            return _cache[key]
+        lock = _load_locks.setdefault(key, threading.Lock())
+    with lock:
+        with _cache_lock:
+            if key in _cache:
+                return _cache[key]
+        try:
+            value = load()
+        except BaseException:
+            with _cache_lock:
+                _load_locks.pop(key, None)
+            raise
+        with _cache_lock:
+            for stale_key in [k for k in _cache if k[0] == key[0]]:
+                del _cache[stale_key]
+            _cache[key] = value
+            _load_locks.pop(key, None)
+        return value
+
+
+def read_main_data(path=None, columns=None):
+    """Read the merged dataset without caching it, keeping only ``columns``.
+
+    For callers that derive something smaller from the merged rows (such as
+    the star schema) and should not keep the full table alive.
+    """
+    if path is None:
+        path = default_source()
+    if os.path.isdir(path):
+        return _read_dataset(path, columns)
+    key = source_key(path)
+    df = _read_sidecar(path, key, columns)
+    if df is None:
+        df = _read_csv(path)
+        _write_sidecar(path, key, df)
+        if columns is not None:
+            df = df[[column for column in df.columns if column in columns]]
+    return df
+
+
+def iter_main_data(path=None, columns=None, chunk_rows=1_000_000):
+    """Yield the merged dataset in frames of at most ``chunk_rows`` rows.
+
+    Parquet files are read a record batch at a time and a CSV a chunk at a
+    time, in file order, so at most one chunk is in memory at once.
+    """
+    if path is None:
+        path = default_source()
+    if os.path.isdir(path):
+        for file in _dataset_files(path):
+            parquet = pq.ParquetFile(file)
+            names = [name for name in parquet.schema_arrow.names if columns is None or name in columns]
+            for batch in parquet.iter_batches(chunk_rows, columns=names):
+                yield batch.to_pandas()
+        return
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [column for column in header if columns is None or column in columns]
+    dtypes = {column: dtype for column, dtype in COLUMN_DTYPES.items() if column in usecols}
+    for chunk in pd.read_csv(path, usecols=usecols, dtype=dtypes, chunksize=chunk_rows):
+        yield _parse_dates(chunk)
+
+
+def load_main_data(path=None):
+    """Return the merged dataset, reading ``path`` at most once per version.
+
+    ``path`` may be a partitioned Parquet dataset directory or a CSV file and
+    defaults to ``default_source()``. The returned frame is shared by every
+    caller in the process and must be treated as read-only.
+    """
+    if path is None:
+        path = default_source()
+    return cached(source_key(path), lambda: read_main_data(path))
@@ -0,0 +1,274 @@
+"""Delivery lead times, carrier handoff and lateness per seller, state, category, payment type or month.
+
+Each order has three measures, in days:
+
+* lead time: purchase to delivery to the customer
+  (``order_delivered_customer_date - order_purchase_timestamp``);
+* carrier handoff: approval to handing the order to the carrier
+  (``order_delivered_carrier_date - order_approved_at``);
+* lateness: whether it was delivered after the estimated date, as in the
+  Time Analysis page's "On Time vs Late" chart (``features.delivery_status``).
+
+``delivery_stats`` groups orders by one of ``GROUPS`` and returns, per
+group, the order count, the p50/p90/p99 of lead time and handoff, the share
+of late deliveries and how late those were. An order counts once in each
+group it belongs to: once per seller and category of its items and per
+type of its payments, so an order with two sellers is in both.
+
+Percentiles are exact, computed for every group at once by
+``group_quantiles``: one sort of (group, value) pairs, then each group's
+quantiles are read off its run of the sorted values. This is one pass of
+vectorized work however many groups there are (thousands of sellers), so
+it stays fast on millions of orders without resorting to sketches.
+
+Like ``metrics.py``, functions take the star schema and a purchase year,
+``(start, end)`` range or global ``filters.Filters``.
+
+Percentiles do not add up across months like the rollups do, so the
+pipeline materializes what the Delivery Performance page shows for all
+years (``build_delivery``) to ``dashboard/delivery/``, tagged with the data
+it was built from like the segments. ``load_delivery`` returns None when
+the tables are missing or stale, and the analytics package then computes
+them from the star schema (as it does for a year or under global filters).
+
+Usage:
+    python dashboard/delivery.py [--by state] [--year 2018] [--top 20] [--write]
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from compact import dimension_codes
+from data_loader import DATA_DIR, cached, replace_directory, source_key, source_signature
+from metrics import fact_orders, period_slice, select
+from views import DELIVERY_GROUPS
+
+DELIVERY_DIR = os.path.join(DATA_DIR, "delivery")
+# Bumped whenever a table's layout or a measure's definition changes
+DELIVERY_VERSION = 1
+
+# Group -> label of its column; defined with the pages, which offer them without this module
+GROUPS = DELIVERY_GROUPS
+QUANTILES = [0.5, 0.9, 0.99]
+# Measure -> label prefix of its percentile columns
+MEASURES = {"lead": "Lead", "handoff": "Handoff"}
+
+_DAY = np.timedelta64(1, "D")
+_DAY_SECONDS = 86400
+
+
+def group_quantiles(codes, values, quantiles=QUANTILES, groups=None):
+    """Quantiles of ``values`` within each group, as a ``(groups, len(quantiles))`` float array.
+
+    ``codes`` are group numbers from 0 to ``groups - 1``; ``values`` are
+    integers or timedeltas (in their unit; NaT is ignored). Groups without
+    values get NaN. Quantiles interpolate linearly between the closest
+    values, like ``np.quantile`` and pandas.
+
+    Each (group, value) pair is packed into one int64, group in the high
+    bits, so a single sort orders every group's values at once.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    values = np.asarray(values)
+    if values.dtype.kind == "m":
+        valid = ~np.isnat(values)
+        codes, values = codes[valid], values[valid].view(np.int64)
+    if groups is None:
+        groups = int(codes.max()) + 1 if len(codes) else 0
+    counts = np.bincount(codes, minlength=groups)
+    result = np.full((groups, len(quantiles)), np.nan)
+    if not len(values):
+        return result
+
+    low_value = values.min()
+    bits = int(values.max() - low_value).bit_length()
+    if (groups - 1).bit_length() + bits < 63:
+        packed = np.sort((codes << bits) | (values - low_value))
+        values = (packed & ((1 << bits) - 1)) + low_value
+    else:
+        values = values[np.lexsort((values, codes))]
+
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    present = counts > 0
+    first, count = starts[present], counts[present]
+    for i, quantile in enumerate(quantiles):
+        position = first + quantile * (count - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, first + count - 1)
+        result[present, i] = values[low] + (values[high] - values[low]) * (position - low)
+    return result
+
+
+def _membership(star, by, period):
+    """``(positions, codes, groups)``: each (order, group) pair as the order's position in
+    the orders fact and the group's code in ``groups``."""
+    if by in ("state", "month"):
+        orders = select(star, "orders", period)
+        positions = fact_orders(star, "orders", period)
+        if by == "state":
+            codes, groups = dimension_codes(star, "customers", "customer_id", "customer_state",
+                                            orders["customer_id"].cat.codes.to_numpy())
+        else:
+            codes, groups = pd.factorize(orders["order_purchase_timestamp"].to_numpy().astype("datetime64[M]"),
+                                         sort=True)
+            groups = pd.DatetimeIndex(groups).strftime("%Y-%m")
+        return positions, codes, groups
+
+    if by == "payment_type":
+        fact = "payments"
+        keys = select(star, "payments", period)["payment_type"]
+        codes, groups = keys.cat.codes.to_numpy(), keys.cat.categories
+    else:
+        fact = "items"
+        items = select(star, "items", period)
+        if by == "seller":
+            codes, groups = items["seller_id"].cat.codes.to_numpy(), items["seller_id"].cat.categories
+        else:
+            codes, groups = dimension_codes(star, "products", "product_id", "product_category_name",
+                                            items["product_id"].cat.codes.to_numpy())
+    positions = fact_orders(star, fact, period)
+    # Each order once per group, however many of its items or payments are in it
+    keep = (positions >= 0) & (codes >= 0)
+    pairs = np.sort(positions[keep].astype(np.int64) * len(groups) + codes[keep])
+    pairs = pairs[np.diff(pairs, prepend=-1) != 0]
+    return pairs // len(groups), pairs % len(groups), groups
+
+
+def _delays(star, positions):
+    """Lead time and handoff to the second, delivery status codes (0 on time, 1 late, -1 unknown)
+    and days late."""
+    orders = star["orders"]
+
+    def column(name):
+        return orders[name].to_numpy()[positions]
+
+    lead = (column("order_delivered_customer_date") - column("order_purchase_timestamp")).astype("timedelta64[s]")
+    handoff = (column("order_delivered_carrier_date") - column("order_approved_at")).astype("timedelta64[s]")
+    late_days = (column("order_delivered_customer_date") - column("order_estimated_delivery_date")) / _DAY
+    status = star["order_features"]["delivery_status"].cat.codes.to_numpy()[positions]
+    return {"lead": lead, "handoff": handoff}, status, late_days
+
+
+def delivery_stats(star, by="state", year=None):
+    """Order count, lead time and handoff percentiles and lateness per group of ``by``.
+
+    Columns: the group (labelled as in ``GROUPS``), ``Orders``,
+    ``Delivered``, ``Lead p50/p90/p99`` and ``Handoff p50/p90/p99`` in days,
+    ``Late %`` of delivered orders with an estimate and ``Days late``, the
+    mean delay of the late ones. Months come in order, other groups with the
+    most orders first.
+    """
+    if by not in GROUPS:
+        raise ValueError(f"Unknown group {by!r}; expected one of {', '.join(GROUPS)}")
+    positions, codes, groups = _membership(star, by, period_slice(star, year))
+    # Orders outside any group (no category, say) are left out
+    codes, positions = codes[codes >= 0], positions[codes >= 0]
+    measures, status, late_days = _delays(star, positions)
+    count = len(groups)
+
+    stats = pd.DataFrame({GROUPS[by]: np.asarray(groups, dtype=object), "Orders": np.bincount(codes, minlength=count)})
+    stats["Delivered"] = np.bincount(codes, weights=~np.isnat(measures["lead"]), minlength=count).astype("int64")
+    for measure, label in MEASURES.items():
+        percentiles = group_quantiles(codes, measures[measure], QUANTILES, count) / _DAY_SECONDS
+        for i, quantile in enumerate(QUANTILES):
+            stats[f"{label} p{round(quantile * 100)}"] = percentiles[:, i].round(1)
+
+    rated = np.bincount(codes, weights=status >= 0, minlength=count)
+    late = np.bincount(codes, weights=status == 1, minlength=count)
+    days_late = np.bincount(codes, weights=np.where(status == 1, late_days, 0), minlength=count)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        stats["Late %"] = (100 * late / rated).round(1)
+        stats["Days late"] = (days_late / late).round(1)
+    # Categories no selected order has (sellers outside the period, say)
+    stats = stats[stats["Orders"] > 0]
+    if by != "month":
+        stats = stats.sort_values("Orders", ascending=False, kind="stable")
+    return stats.reset_index(drop=True)
+
+
+def lead_time_histogram(star, year=None):
+    """Delivered orders per whole day of lead time."""
+    positions = fact_orders(star, "orders", period_slice(star, year))
+    lead = _delays(star, positions)[0]["lead"]
+    days = (lead[~np.isnat(lead)] // _DAY).astype(np.int64)
+    counts = pd.Series(days).value_counts().sort_index()
+    return pd.DataFrame({"Lead time (days)": counts.index, "Orders": counts.to_numpy()})
+
+
+def build_delivery(star):
+    """The tables of the Delivery Performance page for all years.
+
+    ``by_<group>``: ``delivery_stats`` for every group of ``GROUPS``, and
+    ``lead_time_histogram``.
+    """
+    tables = {f"by_{by}": delivery_stats(star, by) for by in GROUPS}
+    tables["lead_time_histogram"] = lead_time_histogram(star)
+    return tables
+
+
+def write_delivery(tables, root=DELIVERY_DIR, source=None):
+    """Write the tables of ``build_delivery`` to ``root`` tagged with the signature of ``source``."""
+    def write(tmp_root):
+        for name, frame in tables.items():
+            frame.to_parquet(os.path.join(tmp_root, f"{name}.parquet"), index=False)
+        with open(os.path.join(tmp_root, "_source.json"), "w") as f:
+            json.dump(_built_from(source), f)
+
+    replace_directory(root, write)
+
+
+def _built_from(source):
+    # Imported here: rollups is only needed to find the star schema's source
+    from rollups import star_source
+    return {"version": DELIVERY_VERSION, "source": source_signature(source or star_source())}
+
+
+def _read_delivery(root):
+    names = [f"by_{by}" for by in GROUPS] + ["lead_time_histogram"]
+    return {name: pd.read_parquet(os.path.join(root, f"{name}.parquet")) for name in names}
+
+
+def load_delivery(root=DELIVERY_DIR, source=None):
+    """Return the materialized ``build_delivery`` tables, or None if missing or stale.
+
+    They are stale when the data they were built from no longer matches
+    ``source`` (defaults to the data ``load_star`` reads) or they were
+    written by an older ``DELIVERY_VERSION``.
+    """
+    try:
+        with open(os.path.join(root, "_source.json")) as f:
+            built_from = json.load(f)
+    except FileNotFoundError:
+        return None
+    if built_from != _built_from(source):
+        return None
+    return cached(source_key(root), lambda: _read_delivery(root))
+
+
+def main(argv=None):
+    from star_schema import load_star
+
+    parser = argparse.ArgumentParser(description="Delivery lead time, carrier handoff and lateness per group.")
+    parser.add_argument("--by", choices=list(GROUPS), default="state")
+    parser.add_argument("--year", type=int, help="purchase year (default: all)")
+    parser.add_argument("--top", type=int, default=20, help="groups shown")
+    parser.add_argument("--write", action="store_true", help=f"also materialize every group's table to {DELIVERY_DIR}")
+    args = parser.parse_args(argv)
+
+    star = load_star()
+    if args.write:
+        write_delivery(build_delivery(star))
+    start = time.perf_counter()
+    stats = delivery_stats(star, args.by, args.year)
+    elapsed = time.perf_counter() - start
+    with pd.option_context("display.width", 160, "display.max_columns", None):
+        print(stats.head(args.top).to_string(index=False))
+    print(f"{len(stats):,} groups in {elapsed * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
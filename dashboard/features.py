@@ -0,0 +1,43 @@
+"""Per-order features derived once from the orders fact.
+
+The Time Analysis metrics group orders by delivery status, purchase hour,
+time of day and weekday. ``order_features`` computes all four in one
+vectorized pass and keeps them as int8 codes and categoricals, row-aligned
+with the orders fact so the same period slice selects both.
+"""
+import numpy as np
+import pandas as pd
+
+DAY_ORDER = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+TIME_OF_DAY_LABELS = ['Malam', 'Pagi', 'Siang', 'Sore']
+DELIVERY_STATUSES = ['On time', 'Late']
+
+
+def delivery_status(orders):
+    """'On time' or 'Late' per order; missing when not delivered or no estimate."""
+    late_days = (orders['order_delivered_customer_date'] - orders['order_estimated_delivery_date']).dt.days
+    codes = np.select([late_days <= 0, late_days > 0], [0, 1], default=-1)
+    return pd.Categorical.from_codes(codes, DELIVERY_STATUSES)
+
+
+def time_of_day(hours):
+    """Malam (0-6), Pagi (6-12), Siang (12-18) or Sore (18-24); missing for hour -1."""
+    hours = np.asarray(hours)
+    return pd.Categorical.from_codes(np.where(hours >= 0, hours // 6, -1), TIME_OF_DAY_LABELS)
+
+
+def order_features(orders):
+    """Derived features, one row per row of ``orders``.
+
+    ``hour`` and ``weekday`` (Monday = 0) are int8 with -1 for a missing
+    purchase timestamp; ``time_of_day`` and ``delivery_status`` are
+    categoricals.
+    """
+    purchase = orders['order_purchase_timestamp']
+    hour = purchase.dt.hour.fillna(-1).to_numpy().astype("int8")
+    return pd.DataFrame({
+        "hour": hour,
+        "weekday": purchase.dt.weekday.fillna(-1).to_numpy().astype("int8"),
+        "time_of_day": time_of_day(hour),
+        "delivery_status": delivery_status(orders),
+    }, index=orders.index)
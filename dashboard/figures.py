@@ -0,0 +1,375 @@
+"""Plotly figures for the dashboard charts, built from analytics results.
+
+Each builder takes the result frame(s) of one chart (see ``analytics``) and
+returns a ``go.Figure``. Bar labels use the trace's ``text``/``texttemplate``
+instead of one layout annotation per bar, and the top/worst variants of a
+chart share one builder.
+
+``figure`` memoizes built figures and their serialized JSON on a hash of the
+result frames and options, so rerunning or returning to a page reuses them.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import plotly.graph_objects as go
+
+import instrument
+from views import CachedFigure
+
+_MAXSIZE = 128
+_cache = OrderedDict()
+_cache_lock = threading.RLock()
+
+
+def result_hash(*results):
+    """Content hash of result frames, series and scalars."""
+    digest = hashlib.sha1()
+    for result in results:
+        if isinstance(result, (pd.DataFrame, pd.Series)):
+            labels = list(result.columns) if isinstance(result, pd.DataFrame) else [result.name]
+            digest.update(repr((type(result).__name__, result.shape, labels, result.index.name)).encode())
+            digest.update(pd.util.hash_pandas_object(result, index=True).to_numpy().tobytes())
+        else:
+            digest.update(repr(result).encode())
+    return digest.hexdigest()
+
+
+def figure(builder, *results, **options):
+    """Return the ``CachedFigure`` of ``builder(*results, **options)``."""
+    key = (builder.__name__, result_hash(*results), repr(sorted(options.items())))
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    with instrument.stage("figure", builder.__name__):
+        fig = builder(*results, **options)
+    with instrument.stage("serialize") as stage:
+        entry = CachedFigure(fig, fig.to_json())
+        stage["bytes"] = len(entry.json)
+    with _cache_lock:
+        _cache[key] = entry
+        while len(_cache) > _MAXSIZE:
+            _cache.popitem(last=False)
+    return entry
+
+
+def monthly_orders(monthly_orders_df):
+    fig = go.Figure()
+
+    fig.add_trace(go.Scatter(
+        x=monthly_orders_df.index,
+        y=monthly_orders_df.values,
+        mode='lines+markers',
+        marker=dict(color='blue', size=8),
+        line=dict(width=3),
+    ))
+
+    fig.update_layout(
+        title="Monthly Orders Trend",
+        xaxis=dict(
+            title="Month",
+            titlefont=dict(size=14),
+            tickfont=dict(size=12),
+        ),
+        yaxis=dict(
+            title="Number of Orders",
+            titlefont=dict(size=14),
+            tickfont=dict(size=12),
+        ),
+        width=650,
+        height=400,
+    )
+    return fig
+
+
+def category_bars(df, value_column, title, yaxis_title, color, texttemplate, tickformat=None):
+    """Bar per product category, labelled with its value."""
+    fig = go.Figure()
+
+    fig.add_trace(go.Bar(
+        x=df['product_category_name'],
+        y=df[value_column],
+        marker=dict(color=color),
+        texttemplate=texttemplate,
+        textposition='outside',
+        textfont=dict(size=10, color='white'),
+    ))
+
+    fig.update_layout(
+        title=title,
+        xaxis=dict(
+            title='Product Category',
+            tickangle=45,
+            tickfont=dict(size=12),
+            automargin=True,
+        ),
+        yaxis=dict(
+            title=yaxis_title,
+            tickformat=tickformat,
+            tickfont=dict(size=12),
+        ),
+        width=800,
+        height=500,
+        showlegend=False,
+    )
+    return fig
+
+
+def category_sales(df, title):
+    return category_bars(df, 'payment_value', title, 'Total Sales', 'rgb(173, 216, 230)', '%{y:.2f}', 'plain')
+
+
+def category_rating(df, title, color):
+    return category_bars(df, 'review_score', title, 'Average Rating', color, '%{y:.2f}')
+
+
+def rating_distribution(rating_dist_df):
+    rating_fig = go.Figure()
+
+    rating_fig.add_trace(go.Bar(
+        x=rating_dist_df['Review Score'],
+        y=rating_dist_df['Order Count'],
+        name='Order Count',
+        marker=dict(color='rgb(102, 205, 170)'),
+    ))
+
+    rating_fig.update_layout(
+        title="Rating Distribution",
+        xaxis=dict(title='Review Score'),
+        yaxis=dict(title='Order Count'),
+        width=800,
+        height=500,
+    )
+    return rating_fig
+
+
+def customer_cities(top_customers, worst_customers, year):
+    fig = go.Figure()
+
+    # Top and worst cities side by side, each bar labelled with its count
+    for customers, name, color in [(top_customers, "Top Customers", 'rgb(102, 205, 170)'),
+                                   (worst_customers, "Worst Customers", 'rgb(255, 99, 71)')]:
+        fig.add_trace(go.Bar(
+            x=customers['City'],
+            y=customers['Customer Count'],
+            name=name,
+            marker=dict(color=color),
+            texttemplate='%{y}',
+            textposition='outside',
+            textfont=dict(size=12, color='white'),
+        ))
+
+    fig.update_layout(
+        title=f"Customer Distribution for {year}",
+        xaxis=dict(title='City', tickangle=45),
+        yaxis=dict(title='Customer Count'),
+        barmode='group',  # Display bars side by side
+        width=800,
+        height=500,
+    )
+    return fig
+
+
+def payment_segments(payment_method_df):
+    payment_fig = go.Figure()
+
+    payment_fig.add_trace(go.Pie(
+        labels=payment_method_df['Payment Type'],
+        values=payment_method_df['Purchase Count'],
+        hole=0.3,
+        marker=dict(colors=['rgb(102, 205, 170)', 'rgb(255, 99, 71)', 'rgb(255, 215, 0)', 'rgb(70, 130, 180)']),
+    ))
+    return payment_fig
+
+
+def delivery_status(delivery_status_count):
+    fig = go.Figure(data=[go.Bar(
+        x=delivery_status_count.index,
+        y=delivery_status_count.values,
+        marker=dict(color=['rgb(102, 205, 170)', 'rgb(255, 99, 71)'])
+    )])
+
+    fig.update_layout(
+        title="On Time vs Late Delivery",
+        xaxis=dict(title="Delivery Status"),
+        yaxis=dict(title="Order Quantity"),
+        width=800,
+        height=500
+    )
+    return fig
+
+
+def hour_rating(purchase_rating):
+    fig = go.Figure(data=[go.Scatter(
+        x=purchase_rating['hour_of_purchase'],
+        y=purchase_rating['review_score'],
+        mode='lines+markers',
+        marker=dict(color='rgb(255, 99, 71)')
+    )])
+
+    fig.update_layout(
+        title="Average Product Rating Based on Time of Purchase",
+        xaxis=dict(title="Purchase Time"),
+        yaxis=dict(title="Average Rating"),
+        width=800,
+        height=500
+    )
+    return fig
+
+
+def time_of_day(purchase_time_distribution):
+    fig = go.Figure(data=[go.Bar(
+        x=purchase_time_distribution.index,
+        y=purchase_time_distribution.values,
+        marker=dict(color='rgb(102, 205, 170)')
+    )])
+
+    fig.update_layout(
+        title="Purchase Time Distribution",
+        xaxis=dict(title="Purchase Time"),
+        yaxis=dict(title="Order Quantity"),
+        width=800,
+        height=500
+    )
+    return fig
+
+
+def weekday(day_of_week_sales):
+    fig = go.Figure(data=[go.Bar(
+        x=day_of_week_sales['day_of_week'],
+        y=day_of_week_sales['order_id'],
+        marker=dict(color='rgb(255, 99, 71)')
+    )])
+
+    fig.update_layout(
+        title="The Effect of the Day of the Week on Sales",
+        xaxis=dict(title="Day of Week"),
+        yaxis=dict(title="Order Quantity"),
+        width=800,
+        height=500
+    )
+    return fig
+
+
+def city_sales(sorted_city_sales_df):
+    # Create a dual-axis chart with a bar chart for Total Sales and a line chart for Units Sold
+    # Only this chart needs subplots; imported here to keep them off other pages
+    from plotly.subplots import make_subplots
+
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+
+    # Add trace for total sales (Primary y-axis) - Bar chart
+    fig.add_trace(go.Bar(
+        x=sorted_city_sales_df['City'],
+        y=sorted_city_sales_df['Total Sales'],
+        name="Total Sales",
+        marker=dict(color='rgb(102, 205, 170)'),
+    ), secondary_y=False)
+
+    # Add trace for units sold (Secondary y-axis) - Line chart
+    fig.add_trace(go.Scatter(
+        x=sorted_city_sales_df['City'],
+        y=sorted_city_sales_df['Product Sold'],
+        name="Product Sold",
+        mode='lines+markers',
+        marker=dict(color='rgb(255, 99, 71)'),
+    ), secondary_y=True)
+
+    # Update layout for the plot
+    fig.update_layout(
+        title="Total Sales and Product Sold by City",
+        xaxis=dict(title='City', tickangle=45),
+        barmode='group',  # Display bars side by side
+        width=800,
+        height=500,
+    )
+
+    # Update y-axes titles
+    fig.update_yaxes(title_text="Total Sales", secondary_y=False)
+    fig.update_yaxes(title_text="Product Sold", secondary_y=True)
+    return fig
+
+
+def delivery_percentiles(stats, group):
+    """Lead time p50/p90/p99 bars per group of ``stats`` (see ``delivery.delivery_stats``)."""
+    fig = go.Figure()
+
+    for column, color in [('Lead p50', 'rgb(102, 205, 170)'), ('Lead p90', 'rgb(255, 215, 0)'),
+                          ('Lead p99', 'rgb(255, 99, 71)')]:
+        fig.add_trace(go.Bar(
+            x=stats[group],
+            y=stats[column],
+            name=column[len('Lead '):],
+            marker=dict(color=color),
+        ))
+
+    fig.update_layout(
+        title=f"Delivery Lead Time by {group}",
+        xaxis=dict(title=group, type='category', tickangle=45, automargin=True),
+        yaxis=dict(title="Days from Purchase to Delivery"),
+        barmode='group',
+        width=800,
+        height=500,
+    )
+    return fig
+
+
+def lead_time_histogram(histogram):
+    fig = go.Figure(data=[go.Bar(
+        x=histogram['Lead time (days)'],
+        y=histogram['Orders'],
+        marker=dict(color='rgb(70, 130, 180)')
+    )])
+
+    fig.update_layout(
+        title="Delivery Lead Time Distribution",
+        xaxis=dict(title="Days from Purchase to Delivery"),
+        yaxis=dict(title="Delivered Orders"),
+        width=800,
+        height=500
+    )
+    return fig
+
+
+def customer_segments(segments_df):
+    fig = go.Figure(data=[go.Bar(
+        x=segments_df['Segment'],
+        y=segments_df['Customers'],
+        marker=dict(color='rgb(102, 205, 170)'),
+        texttemplate='%{y:,}',
+        textposition='outside',
+    )])
+
+    fig.update_layout(
+        title="Customers per RFM Segment",
+        xaxis=dict(title="Segment", tickangle=45),
+        yaxis=dict(title="Customers"),
+        width=800,
+        height=500
+    )
+    return fig
+
+
+def cohort_retention(retention):
+    """Heatmap of the share of each acquisition cohort (rows) active in each month since (columns)."""
+    # Month 0 is 100% by definition and would wash out the scale
+    later = retention.drop(columns=0, errors='ignore')
+    fig = go.Figure(data=[go.Heatmap(
+        z=later.to_numpy(),
+        x=[int(month) for month in later.columns],
+        y=list(later.index),
+        colorscale='Blues',
+        colorbar=dict(title='Active %'),
+        hovertemplate='Cohort %{y}, month %{x}: %{z:.1f}%<extra></extra>',
+    )])
+
+    fig.update_layout(
+        title="Monthly Cohort Retention",
+        xaxis=dict(title="Months Since First Purchase", dtick=1),
+        yaxis=dict(title="First Purchase Month", autorange='reversed', type='category'),
+        width=800,
+        height=600
+    )
+    return fig
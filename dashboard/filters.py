@@ -0,0 +1,260 @@
+"""Global filters over the star schema, answered with per-value mask indexes.
+
+``Filters`` holds a purchase date range and sets of customer states,
+customer cities, product categories and payment types; a dimension left
+empty does not filter. Dimensions combine with AND and the values of one
+dimension with OR.
+
+An order passes when it was purchased in the range, by a customer in one of
+the states and cities, and has an item in one of the categories and a
+payment of one of the types. Every fact keeps the rows of passing orders;
+items are further restricted to the selected categories and payments to
+the selected types.
+
+``FilterIndex`` stores, for each dimension and value, the sorted positions
+of the rows that have it: orders for every dimension, plus items for
+categories and payments for payment types. These posting lists are a
+compressed bitmap per value. The mask of a set of values is scattered from
+their positions and cached, so a combined filter is an AND of cached boolean
+masks and changing one filter rebuilds one mask. ``Selection`` is the result
+for one combination: the date range's slice of each fact (see
+``time_index.py``) and a mask within it.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from time_index import ORDER_FACTS
+
+Filters = namedtuple(
+    "Filters", ["start", "end", "states", "cities", "categories", "payment_types"], defaults=[None] * 6)
+
+# Dimension -> (fact whose rows carry the value, column); None is the orders' customer
+DIMENSIONS = {
+    "states": (None, "customer_state"),
+    "cities": (None, "customer_city"),
+    "categories": ("items", "product_category_name"),
+    "payment_types": ("payments", "payment_type"),
+}
+
+_MASKS = 64
+_SELECTIONS = 32
+
+
+def make_filters(start=None, end=None, states=(), cities=(), categories=(), payment_types=()):
+    """``Filters`` with each value set as a sorted tuple (None when empty); None if nothing filters.
+
+    ``start`` is inclusive and ``end`` exclusive; both are timestamps or None.
+    """
+    values = [tuple(sorted(set(dimension))) or None for dimension in [states, cities, categories, payment_types]]
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end)
+    if start is None and end is None and not any(values):
+        return None
+    return Filters(start, end, *values)
+
+
+def restrict(filters, year=None):
+    """``filters`` further restricted to a purchase year or ``(start, end)`` range."""
+    if year is None:
+        return filters
+    if isinstance(year, tuple):
+        start, end = (None if bound is None else pd.Timestamp(bound) for bound in year)
+    else:
+        start, end = pd.Timestamp(year=int(year), month=1, day=1), pd.Timestamp(year=int(year) + 1, month=1, day=1)
+    if filters.start is not None:
+        start = filters.start if start is None else max(start, filters.start)
+    if filters.end is not None:
+        end = filters.end if end is None else min(end, filters.end)
+    return filters._replace(start=start, end=end)
+
+
+def describe(filters):
+    """Short text of ``filters``, for labels."""
+    if filters is None:
+        return ""
+    parts = []
+    if filters.start is not None or filters.end is not None:
+        start = "" if filters.start is None else f"{filters.start:%Y-%m-%d}"
+        end = "" if filters.end is None else f"{filters.end:%Y-%m-%d}"
+        parts.append(f"{start}..{end}")
+    for dimension in DIMENSIONS:
+        values = getattr(filters, dimension)
+        if values:
+            parts.append(f"{dimension}={','.join(values)}")
+    return "; ".join(parts)
+
+
+def _postings(values):
+    """``{value: sorted int32 positions}`` of every value of ``values`` (missing values are left out)."""
+    codes, uniques = pd.factorize(values, sort=True)
+    order = np.argsort(codes, kind="stable").astype(np.int32)
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+    return {value: order[bounds[i]:bounds[i + 1]] for i, value in enumerate(uniques)}
+
+
+def _order_postings(postings, fact_positions):
+    """Postings of fact rows mapped to the orders that hold them, each order once."""
+    orders = {}
+    for value, positions in postings.items():
+        order_positions = fact_positions[positions]
+        orders[value] = np.unique(order_positions[order_positions >= 0]).astype(np.int32)
+    return orders
+
+
+class Selection:
+    """Rows of each fact selected by one ``Filters``: a slice of the fact and a mask over it."""
+
+    def __init__(self, index, orders, order_mask, fact_masks):
+        self.index = index
+        self.orders = orders
+        self.order_mask = order_mask
+        self.fact_masks = fact_masks
+        self._cache = {}
+
+    def rows(self, name, refine=True):
+        """``(slice, mask)`` of fact ``name`` (``orders``, ``order_features`` or an order fact).
+
+        With ``refine=False``, items and payments are not restricted to the
+        selected categories and payment types, only to the passing orders.
+        """
+        key = (name, refine)
+        if key not in self._cache:
+            if name not in ORDER_FACTS:
+                rows, mask = self.orders, self.order_mask[self.orders]
+            else:
+                rows = self.index.time_index.fact_slice(name, self.orders)
+                positions = self.index.time_index.fact_positions[name][rows]
+                mask = self.order_mask[positions]
+                own = self.fact_masks.get(name)
+                if refine and own is not None:
+                    mask &= own[rows]
+            self._cache[key] = (rows, mask)
+        return self._cache[key]
+
+    def refinement(self, name):
+        """Which rows of ``take(star, name, refine=False)`` the refined selection keeps."""
+        rows, mask = self.rows(name, refine=False)
+        own = self.fact_masks.get(name)
+        return np.ones(mask.sum(), dtype=bool) if own is None else own[rows][mask]
+
+    def take(self, star, name, refine=True):
+        rows, mask = self.rows(name, refine)
+        return star[name].iloc[rows][mask]
+
+    def positions(self, name):
+        """Position in the orders fact of each selected row of fact ``name`` (or of each selected order)."""
+        rows, mask = self.rows(name)
+        if name not in ORDER_FACTS:
+            return np.arange(self.index.order_count)[rows][mask]
+        return self.index.time_index.fact_positions[name][rows][mask]
+
+
+class FilterIndex:
+    """Posting lists of every filter value over a prepared star (see ``star_schema.load_star``)."""
+
+    def __init__(self, star):
+        self.time_index = star["time_index"]
+        self.order_count = len(star["orders"])
+        self.fact_sizes = {name: len(star[name]) for name in ORDER_FACTS}
+        # First and last purchase time (timestamps are sorted, missing ones last)
+        valid = self.time_index.timestamps[~np.isnat(self.time_index.timestamps)]
+        self.dates = (valid[0], valid[-1]) if len(valid) else (None, None)
+
+        customers = star["orders"][["customer_id"]].merge(
+            star["customers"][["customer_id", "customer_state", "customer_city"]], on="customer_id", how="left")
+        categories = star["items"][["product_id"]].merge(star["products"], on="product_id", how="left")
+        self.postings = {
+            "states": {"orders": _postings(customers["customer_state"])},
+            "cities": {"orders": _postings(customers["customer_city"])},
+            "categories": {"items": _postings(categories["product_category_name"])},
+            "payment_types": {"payments": _postings(star["payments"]["payment_type"])},
+        }
+        for dimension, (fact, _) in DIMENSIONS.items():
+            if fact is not None:
+                self.postings[dimension]["orders"] = _order_postings(
+                    self.postings[dimension][fact], self.time_index.fact_positions[fact])
+        self.cities = customers[["customer_state", "customer_city"]].dropna().drop_duplicates()
+
+        self._masks = OrderedDict()
+        self._selections = OrderedDict()
+        self._lock = threading.RLock()
+
+    def values(self, dimension):
+        return list(self.postings[dimension]["orders"])
+
+    def mask(self, dimension, level, values):
+        """Boolean mask over the rows of ``level`` that have one of ``values`` of ``dimension``."""
+        key = (dimension, level, values)
+        with self._lock:
+            if key in self._masks:
+                self._masks.move_to_end(key)
+                return self._masks[key]
+        size = self.order_count if level == "orders" else self.fact_sizes[level]
+        mask = np.zeros(size, dtype=bool)
+        postings = self.postings[dimension][level]
+        for value in values:
+            if value in postings:
+                mask[postings[value]] = True
+        mask.flags.writeable = False
+        with self._lock:
+            self._masks[key] = mask
+            while len(self._masks) > _MASKS:
+                self._masks.popitem(last=False)
+        return mask
+
+    def selection(self, filters):
+        """The ``Selection`` of ``filters``, cached per combination."""
+        with self._lock:
+            if filters in self._selections:
+                self._selections.move_to_end(filters)
+                return self._selections[filters]
+        if filters.start is None and filters.end is None:
+            orders = slice(0, self.order_count)
+        else:
+            orders = self.time_index.range_slice(filters.start, filters.end)
+
+        order_mask = np.ones(self.order_count, dtype=bool)
+        fact_masks = {}
+        for dimension, (fact, _) in DIMENSIONS.items():
+            values = getattr(filters, dimension)
+            if values:
+                order_mask &= self.mask(dimension, "orders", values)
+                if fact is not None:
+                    fact_masks[fact] = self.mask(dimension, fact, values)
+        selection = Selection(self, orders, order_mask, fact_masks)
+        with self._lock:
+            self._selections[filters] = selection
+            while len(self._selections) > _SELECTIONS:
+                self._selections.popitem(last=False)
+        return selection
+
+
+_index_lock = threading.Lock()
+_index = (None, None)
+
+
+def filter_index(star):
+    """The ``FilterIndex`` of ``star``, built on first use and kept for the current star."""
+    global _index
+    with _index_lock:
+        if _index[0] is not star:
+            _index = (star, FilterIndex(star))
+        return _index[1]
+
+
+def options(star):
+    """Values offered by each filter: ``dates`` (first, last purchase), ``states``,
+    ``cities`` (``{state: [cities]}``), ``categories`` and ``payment_types``."""
+    index = filter_index(star)
+    cities = index.cities.sort_values(["customer_state", "customer_city"])
+    return {
+        "dates": tuple(None if date is None else pd.Timestamp(date) for date in index.dates),
+        "states": index.values("states"),
+        "cities": {str(state): [str(city) for city in group["customer_city"]]
+                   for state, group in cities.groupby("customer_state", observed=True)},
+        "categories": index.values("categories"),
+        "payment_types": index.values("payment_types"),
+    }
@@ -0,0 +1,214 @@
+"""Spatial index behind the customer and seller map.
+
+Plotting every customer is far too slow, so locations are pre-aggregated
+once, when the dataset is built:
+
+1. ``zip_centroids``: the mean position of each zip code prefix in the
+   deduplicated geolocation table, ignoring the few points outside Brazil;
+2. ``build_geo_index``: customers, sellers and payments per zip code prefix,
+   placed at its centroid and summed into square grid cells, one grid per
+   map zoom level (``MAP_ZOOMS``). A cell of zoom ``z`` is a Web Mercator
+   tile ``CELL_PIXELS`` pixels wide on a map shown at zoom ``z``.
+
+The index keeps the zip centroids too, so ``update_geo_index`` can add the
+customers, sellers and payments of an incremental build to the cells
+without the geolocation table.
+
+``visible_cells`` picks the cells of one zoom level inside a viewport, so the
+map page ships at most ``(width / CELL_PIXELS) x (height / CELL_PIXELS)``
+cells whatever the size of the data.
+
+Usage:
+    python dashboard/geo.py [--data-dir data] [--output-dir dashboard/geo]
+"""
+import argparse
+import math
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_loader import DATA_DIR, cached, replace_directory, source_key
+
+GEO_DIR = os.path.join(DATA_DIR, "geo")
+
+MAP_ZOOMS = list(range(3, 12))
+CELL_PIXELS = 16
+# Size of the map on the page, in pixels
+MAP_WIDTH, MAP_HEIGHT = 1000, 500
+# deck.gl draws the world 512 pixels wide at zoom 0
+_WORLD_PIXELS = 512
+
+# Latitude/longitude bounds of Brazil; geolocation rows outside are errors
+BRAZIL_BOUNDS = ((-34.0, 5.5), (-74.0, -34.0))
+BRAZIL_CENTER = (-14.2, -51.9)
+
+MEASURES = ["customers", "sellers", "payment_value"]
+
+
+def _cell_zoom(zoom):
+    return zoom + int(math.log2(_WORLD_PIXELS // CELL_PIXELS))
+
+
+def tile_xy(lat, lng, tile_zoom):
+    """Fractional Web Mercator tile coordinates of points at ``tile_zoom``."""
+    n = 2.0 ** tile_zoom
+    lat = np.radians(np.asarray(lat, dtype=float))
+    x = (np.asarray(lng, dtype=float) + 180.0) / 360.0 * n
+    y = (1.0 - np.arcsinh(np.tan(lat)) / np.pi) / 2.0 * n
+    return x, y
+
+
+def tile_lat_lng(x, y, tile_zoom):
+    """Inverse of ``tile_xy``."""
+    n = 2.0 ** tile_zoom
+    lng = np.asarray(x, dtype=float) / n * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * np.asarray(y, dtype=float) / n))))
+    return lat, lng
+
+
+def zip_centroids(geolocation):
+    """Mean ``lat``/``lng`` and most common state per zip code prefix."""
+    (lat_min, lat_max), (lng_min, lng_max) = BRAZIL_BOUNDS
+    lat, lng = geolocation["geolocation_lat"], geolocation["geolocation_lng"]
+    inside = geolocation[lat.between(lat_min, lat_max) & lng.between(lng_min, lng_max)]
+    by_zip = inside.groupby("geolocation_zip_code_prefix")
+    centroids = by_zip[["geolocation_lat", "geolocation_lng"]].mean()
+    centroids.columns = ["lat", "lng"]
+    centroids["state"] = by_zip["geolocation_state"].agg(lambda states: states.mode().iat[0])
+    return centroids.rename_axis("zip_code_prefix")
+
+
+def zip_measures(customers, sellers, orders, payments, all_customers=None):
+    """Customers, sellers and customers' payments per zip code prefix.
+
+    Payments are placed by their order's customer, looked up in
+    ``all_customers`` (default: ``customers``).
+    """
+    all_customers = customers if all_customers is None else all_customers
+    customer_zips = all_customers.set_index("customer_id")["customer_zip_code_prefix"]
+    order_zips = orders.set_index("order_id")["customer_id"].map(customer_zips)
+    payment_zips = payments["order_id"].map(order_zips)
+    return pd.concat([
+        customers.groupby("customer_zip_code_prefix").size().rename("customers"),
+        sellers.groupby("seller_zip_code_prefix").size().rename("sellers"),
+        payments["payment_value"].groupby(payment_zips).sum().rename("payment_value"),
+    ], axis=1).fillna(0).rename_axis("zip_code_prefix")
+
+
+def _cells(measures, centroids):
+    """Sum zip-level ``measures`` into the grid cells of every zoom in ``MAP_ZOOMS``."""
+    located = measures.join(centroids, how="inner")
+    cells = []
+    for zoom in MAP_ZOOMS:
+        x, y = tile_xy(located["lat"], located["lng"], _cell_zoom(zoom))
+        grid = located[MEASURES].groupby([np.floor(x).astype(np.int32), np.floor(y).astype(np.int32)]).sum()
+        cells.append(grid.rename_axis(["x", "y"]).reset_index().assign(zoom=np.int8(zoom)))
+    cells = pd.concat(cells, ignore_index=True)[["zoom", "x", "y"] + MEASURES]
+    cells[["customers", "sellers"]] = cells[["customers", "sellers"]].astype("int64")
+    return cells
+
+
+def build_geo_index(tables):
+    """Build the map index from the pipeline's cleaned raw tables.
+
+    Returns ``{"cells": ..., "centers": ..., "zips": ...}``: grid cells for
+    every zoom in ``MAP_ZOOMS`` (``zoom``, tile ``x``/``y`` and the
+    measures), the centroid of each state, for centering the map, and the
+    centroid of each zip code prefix.
+    """
+    centroids = zip_centroids(tables["geolocation"])
+    measures = zip_measures(tables["customers"], tables["sellers"], tables["orders"], tables["order_payments"])
+    centers = centroids.groupby("state")[["lat", "lng"]].mean().reset_index()
+    return {"cells": _cells(measures, centroids), "centers": centers, "zips": centroids.reset_index()}
+
+
+def update_geo_index(delta, root=GEO_DIR):
+    """Add ``delta``, zip-level measures as ``zip_measures`` returns them, to the index at ``root``.
+
+    Removed customers, sellers or payments are negative. Returns False,
+    leaving the index as it is, when it was built without the zip centroids.
+    """
+    zips_path = os.path.join(root, "zips.parquet")
+    if not os.path.exists(zips_path):
+        return False
+    index = {name: pd.read_parquet(os.path.join(root, f"{name}.parquet")) for name in ["cells", "centers", "zips"]}
+    cells = pd.concat([index["cells"], _cells(delta, index["zips"].set_index("zip_code_prefix"))], ignore_index=True)
+    cells = cells.groupby(["zoom", "x", "y"], sort=False)[MEASURES].sum().reset_index()
+    # Every cell of a full build has a customer or a seller
+    index["cells"] = cells[(cells["customers"] != 0) | (cells["sellers"] != 0)].reset_index(drop=True)
+    write_geo_index(index, root)
+    return True
+
+
+def write_geo_index(index, root=GEO_DIR):
+    def write(tmp_root):
+        for name, frame in index.items():
+            frame.to_parquet(os.path.join(tmp_root, f"{name}.parquet"), index=False)
+
+    replace_directory(root, write)
+
+
+def _read_geo_index(root):
+    cells = pd.read_parquet(os.path.join(root, "cells.parquet"))
+    return {
+        "cells": {int(zoom): level.drop(columns="zoom").reset_index(drop=True) for zoom, level in cells.groupby("zoom")},
+        "centers": pd.read_parquet(os.path.join(root, "centers.parquet")),
+    }
+
+
+def load_geo_index(root=GEO_DIR):
+    """Return the map index with cells split per zoom level, or None if it has not been built."""
+    if not os.path.isdir(root):
+        return None
+    return cached(source_key(root), lambda: _read_geo_index(root))
+
+
+def viewport(zoom, lat, lng, width, height):
+    """Tile ``(x_min, x_max, y_min, y_max)`` of the cells on screen at ``zoom`` around (lat, lng)."""
+    x, y = tile_xy(lat, lng, _cell_zoom(zoom))
+    half_width, half_height = width / CELL_PIXELS / 2, height / CELL_PIXELS / 2
+    return (math.floor(x - half_width), math.floor(x + half_width),
+            math.floor(y - half_height), math.floor(y + half_height))
+
+
+def cell_polygon(x, y, zoom):
+    """Corner ``[lng, lat]`` pairs of cell (x, y) at map ``zoom``."""
+    lats, lngs = tile_lat_lng([x, x + 1, x + 1, x], [y, y, y + 1, y + 1], _cell_zoom(zoom))
+    return [[round(float(lng), 5), round(float(lat), 5)] for lat, lng in zip(lats, lngs)]
+
+
+def visible_cells(index, zoom, lat, lng, width=MAP_WIDTH, height=MAP_HEIGHT):
+    """Cells of ``zoom`` inside the viewport, each with its ``polygon``."""
+    level = index["cells"].get(zoom)
+    if level is None:
+        return pd.DataFrame(columns=["x", "y", "polygon"] + MEASURES)
+    x_min, x_max, y_min, y_max = viewport(zoom, lat, lng, width, height)
+    cells = level[level["x"].between(x_min, x_max) & level["y"].between(y_min, y_max)]
+    return cells[["x", "y"] + MEASURES].assign(
+        polygon=[cell_polygon(x, y, zoom) for x, y in zip(cells["x"], cells["y"])]
+    ).reset_index(drop=True)
+
+
+def main(argv=None):
+    # Only building the index reads CSVs; the dashboard imports this module without pyarrow.csv
+    import ingest
+
+    parser = argparse.ArgumentParser(description="Build the spatial index behind the dashboard map.")
+    parser.add_argument("--data-dir", default=ingest.DEFAULT_DATA_DIR, help="directory with the raw *_dataset.csv files")
+    parser.add_argument("--output-dir", default=GEO_DIR)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    tables = ingest.read_tables(["customers", "sellers", "orders", "order_payments", "geolocation"], args.data_dir)[0]
+    tables["geolocation"] = tables["geolocation"].drop_duplicates(ignore_index=True)
+    index = build_geo_index(tables)
+    write_geo_index(index, args.output_dir)
+    sizes = index["cells"].groupby("zoom").size()
+    print(f"Built the map index in {time.perf_counter() - start:.1f}s "
+          f"(cells per zoom: {', '.join(f'{zoom}={count:,}' for zoom, count in sizes.items())})")
+
+
+if __name__ == "__main__":
+    main()
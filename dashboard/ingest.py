@@ -0,0 +1,196 @@
+"""Read the raw Olist CSV tables with the pyarrow CSV engine.
+
+Every table is read with an explicit Arrow schema (``TABLES``), so nothing is
+type-inferred: IDs and zip code prefixes are strings (``"01310"`` keeps its
+leading zero), timestamps are parsed by Arrow and numbers get their final
+width. Columns missing from ``TABLES`` are never parsed.
+
+``read_tables`` reads several tables concurrently in a thread pool (Arrow
+parses and converts outside the GIL) and reports the wall time of each.
+``iter_table`` streams one table in record batches of about ``block_size``
+bytes instead, for tables larger than memory; ``convert_table`` uses it to
+write a table to Parquet one batch at a time.
+
+Usage:
+    python dashboard/ingest.py [--data-dir data] [--workers N] [--parquet-dir DIR] [--block-size MB]
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+DASHBOARD_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(DASHBOARD_DIR), "data")
+
+# Streaming batch size; also Arrow's unit of parallel parsing within a file
+DEFAULT_BLOCK_SIZE = 16 << 20
+
+_TIMESTAMP = pa.timestamp("ns")
+
+# File and schema of each raw table
+TABLES = {
+    "orders": ("orders_dataset.csv", pa.schema([
+        ("order_id", pa.string()),
+        ("customer_id", pa.string()),
+        ("order_status", pa.string()),
+        ("order_purchase_timestamp", _TIMESTAMP),
+        ("order_approved_at", _TIMESTAMP),
+        ("order_delivered_carrier_date", _TIMESTAMP),
+        ("order_delivered_customer_date", _TIMESTAMP),
+        ("order_estimated_delivery_date", _TIMESTAMP),
+    ])),
+    "customers": ("customers_dataset.csv", pa.schema([
+        ("customer_id", pa.string()),
+        ("customer_unique_id", pa.string()),
+        ("customer_zip_code_prefix", pa.string()),
+        ("customer_city", pa.string()),
+        ("customer_state", pa.string()),
+    ])),
+    "order_items": ("order_items_dataset.csv", pa.schema([
+        ("order_id", pa.string()),
+        ("order_item_id", pa.int32()),
+        ("product_id", pa.string()),
+        ("seller_id", pa.string()),
+        ("price", pa.float64()),
+        ("freight_value", pa.float64()),
+    ])),
+    "order_payments": ("order_payments_dataset.csv", pa.schema([
+        ("order_id", pa.string()),
+        ("payment_type", pa.string()),
+        ("payment_value", pa.float64()),
+    ])),
+    "order_reviews": ("order_reviews_dataset.csv", pa.schema([
+        ("order_id", pa.string()),
+        ("review_score", pa.int8()),
+    ])),
+    "products": ("products_dataset.csv", pa.schema([
+        ("product_id", pa.string()),
+        ("product_category_name", pa.string()),
+    ])),
+    "sellers": ("sellers_dataset.csv", pa.schema([
+        ("seller_id", pa.string()),
+        ("seller_zip_code_prefix", pa.string()),
+        ("seller_city", pa.string()),
+        ("seller_state", pa.string()),
+    ])),
+    "geolocation": ("geolocation_dataset.csv", pa.schema([
+        ("geolocation_zip_code_prefix", pa.string()),
+        ("geolocation_lat", pa.float64()),
+        ("geolocation_lng", pa.float64()),
+        ("geolocation_city", pa.string()),
+        ("geolocation_state", pa.string()),
+    ])),
+    "category_translation": ("product_category_name_translation.csv", pa.schema([
+        ("product_category_name", pa.string()),
+        ("product_category_name_english", pa.string()),
+    ])),
+}
+
+
+def table_path(name, data_dir=DEFAULT_DATA_DIR):
+    return os.path.join(data_dir, TABLES[name][0])
+
+
+def _options(name, block_size=None):
+    schema = TABLES[name][1]
+    read_options = pa_csv.ReadOptions(block_size=block_size) if block_size else pa_csv.ReadOptions()
+    # Empty fields are missing values for every type, as with pd.read_csv
+    convert_options = pa_csv.ConvertOptions(
+        column_types=schema,
+        include_columns=schema.names,
+        strings_can_be_null=True,
+    )
+    return {"read_options": read_options, "convert_options": convert_options}
+
+
+def read_table(name, data_dir=DEFAULT_DATA_DIR):
+    """Read one raw table into an Arrow table with its ``TABLES`` schema."""
+    return pa_csv.read_csv(table_path(name, data_dir), **_options(name))
+
+
+def iter_table(name, data_dir=DEFAULT_DATA_DIR, block_size=DEFAULT_BLOCK_SIZE):
+    """Yield one raw table as record batches of about ``block_size`` bytes of CSV."""
+    with pa_csv.open_csv(table_path(name, data_dir), **_options(name, block_size)) as reader:
+        yield from reader
+
+
+def convert_table(name, path, data_dir=DEFAULT_DATA_DIR, block_size=DEFAULT_BLOCK_SIZE):
+    """Stream one raw table into a Parquet file at ``path``; return its row count.
+
+    Only one batch is held in memory at a time, so this works for tables
+    larger than memory.
+    """
+    rows = 0
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with pq.ParquetWriter(tmp_path, TABLES[name][1]) as writer:
+        for batch in iter_table(name, data_dir, block_size):
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    os.replace(tmp_path, path)
+    return rows
+
+
+def read_tables(names, data_dir=DEFAULT_DATA_DIR, workers=None):
+    """Read ``names`` concurrently as DataFrames.
+
+    Returns ``(tables, timings)``; ``timings`` maps each name to
+    ``(rows, seconds)``, the wall time of reading and converting that table.
+    """
+    def read(name):
+        start = time.perf_counter()
+        df = read_table(name, data_dir).to_pandas()
+        return name, df, time.perf_counter() - start
+
+    tables, timings = {}, {}
+    with ThreadPoolExecutor(workers or len(names) or 1) as pool:
+        for name, df, seconds in pool.map(read, names):
+            tables[name] = df
+            timings[name] = (len(df), seconds)
+    return tables, timings
+
+
+def format_timings(timings, total=None):
+    """One line per table of ``timings`` as returned by ``read_tables``."""
+    lines = [f"{name:<22}{rows:>12,} rows {seconds:>8.2f}s" for name, (rows, seconds) in timings.items()]
+    if total is not None:
+        lines.append(f"{'total (wall)':<22}{sum(rows for rows, _ in timings.values()):>12,} rows {total:>8.2f}s")
+    return "\n".join(lines)
+
+
+def available(data_dir=DEFAULT_DATA_DIR):
+    """Names of the tables whose CSV exists in ``data_dir``."""
+    return [name for name in TABLES if os.path.exists(table_path(name, data_dir))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Read the raw Olist CSVs and report per-table ingest time.")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="directory with the raw *_dataset.csv files")
+    parser.add_argument("--workers", type=int, help="tables read at once (default: all)")
+    parser.add_argument("--parquet-dir", help="stream each table to <name>.parquet here instead of reading it")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE >> 20, help="streaming batch size in MB")
+    args = parser.parse_args(argv)
+
+    names = available(args.data_dir)
+    start = time.perf_counter()
+    if args.parquet_dir:
+        os.makedirs(args.parquet_dir, exist_ok=True)
+
+        def convert(name):
+            table_start = time.perf_counter()
+            rows = convert_table(name, os.path.join(args.parquet_dir, f"{name}.parquet"), args.data_dir,
+                                 args.block_size << 20)
+            return name, (rows, time.perf_counter() - table_start)
+
+        with ThreadPoolExecutor(args.workers or len(names) or 1) as pool:
+            timings = dict(pool.map(convert, names))
+    else:
+        timings = read_tables(names, args.data_dir, args.workers)[1]
+    print(format_timings(timings, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""Wall time, rows and memory of each stage of a dashboard render.
+
+A render is one run of a page (``begin``/``finish``). The page asks its view
+source for views (``view``), and each view goes through some of these stages
+(``stage``):
+
+* ``load``: opening the dataset, reading a snapshot file, the map index or
+  the delivery tables;
+* ``filter``: selecting the rows of a purchase period (``metrics.select``,
+  ``rollups._for_year``), the map cells in the viewport or a page of
+  cities; records ``rows_scanned``. The SQLite backend filters inside its
+  queries, so it has no separate filter stage;
+* ``aggregate``: an analytics query that missed the memoized results;
+  records ``result_rows``;
+* ``figure``: building a plotly figure;
+* ``serialize``: the JSON of a figure or a table's rows, or parsing a
+  snapshot's; records ``bytes``.
+
+Stage times exclude nested stages, so they add up to the time spent in
+stages. A view without stages was served from caches. ``peak_bytes``, the
+peak allocation during a stage over its allocations at the start, is
+recorded while tracemalloc is tracing (``PYTHONTRACEMALLOC=1`` or
+``python -X tracemalloc``); it is approximate when several sessions render
+at once.
+
+Finished renders are summed per page, view and stage, whatever the view's
+parameters: a city search, a table page or a map position would otherwise
+make a new series each. With ``DASHBOARD_RENDER_LOG`` set, each render is
+appended to that file as one JSON line; with ``DASHBOARD_METRICS_FILE`` set,
+the sums are rewritten there in the Prometheus text format after each render
+(for node_exporter's textfile collector). ``?debug=1`` shows the current
+render in the page.
+
+Usage:
+    python dashboard/instrument.py [--pages NAME ...] [--format table|json|prometheus]
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+RENDER_LOG = os.environ.get("DASHBOARD_RENDER_LOG")
+METRICS_FILE = os.environ.get("DASHBOARD_METRICS_FILE")
+
+# Measures summed per (page, view, stage)
+_TOTALS = ["count", "seconds", "rows_scanned", "result_rows", "bytes"]
+
+_local = threading.local()
+_lock = threading.Lock()
+_totals = {}
+_page_totals = {}
+_recent = deque(maxlen=200)
+
+
+def begin(page):
+    """Start recording a render of ``page`` in this thread; return its record."""
+    record = {"page": page, "time": time.time(), "seconds": None, "views": []}
+    _local.render = record
+    _local.start = time.perf_counter()
+    _local.stack = []
+    # Stages outside any view (loading the dataset) belong to the page itself
+    _local.view = {"view": "page", "params": [], "seconds": None, "stages": []}
+    record["views"].append(_local.view)
+    return record
+
+
+def finish(record):
+    """Stop recording ``record``, add it to the totals and export them."""
+    record["seconds"] = time.perf_counter() - _local.start
+    _local.render = _local.view = None
+    with _lock:
+        page = _page_totals.setdefault(record["page"], {"count": 0, "seconds": 0.0})
+        page["count"] += 1
+        page["seconds"] += record["seconds"]
+        for view_record in record["views"]:
+            for stage_record in view_record["stages"]:
+                key = (record["page"], view_record["view"], stage_record["stage"])
+                totals = _totals.setdefault(key, dict.fromkeys(_TOTALS, 0) | {"peak_bytes": None})
+                totals["count"] += 1
+                for name in _TOTALS[1:]:
+                    totals[name] += stage_record.get(name) or 0
+                if stage_record.get("peak_bytes") is not None:
+                    totals["peak_bytes"] = max(totals["peak_bytes"] or 0, stage_record["peak_bytes"])
+        _recent.append(record)
+    if RENDER_LOG:
+        with open(RENDER_LOG, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+    if METRICS_FILE:
+        metrics = prometheus()
+        tmp_path = f"{METRICS_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(metrics)
+        os.replace(tmp_path, METRICS_FILE)
+
+
+@contextmanager
+def view(kind, name, params):
+    """Record the stages of one view within the current render; yields its record."""
+    record = {"view": f"{kind} {name}", "params": list(params), "seconds": None, "stages": []}
+    render = getattr(_local, "render", None)
+    if render is None:
+        yield record
+        return
+    outer, _local.view = _local.view, record
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        _local.view = outer
+        render["views"].append(record)
+
+
+@contextmanager
+def stage(name, label=None):
+    """Time one stage of the current view; nothing is recorded outside a render.
+
+    The yielded dict takes the stage's ``rows_scanned``, ``result_rows`` or ``bytes``.
+    """
+    record = {"stage": name, "label": label, "seconds": None}
+    view_record = getattr(_local, "view", None)
+    if view_record is None:
+        yield record
+        return
+    stack = _local.stack
+    parent = stack[-1] if stack else None
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        if parent is not None and "_base" in parent:
+            # reset_peak() forgets the enclosing stage's peak so far
+            parent["_peak"] = max(parent["_peak"], peak - parent["_base"])
+        tracemalloc.reset_peak()
+        record.update(_base=current, _peak=0)
+    record["_nested"] = 0.0
+    stack.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        elapsed = time.perf_counter() - start
+        stack.pop()
+        record["seconds"] = elapsed - record.pop("_nested")
+        if parent is not None:
+            parent["_nested"] += elapsed
+        if tracing:
+            peak = tracemalloc.get_traced_memory()[1]
+            record["peak_bytes"] = max(record.pop("_peak"), peak - record.pop("_base"))
+            if parent is not None and "_base" in parent:
+                parent["_peak"] = max(parent["_peak"], peak - parent["_base"])
+        view_record["stages"].append(record)
+
+
+def _params(params):
+    return ", ".join(str(param) for param in params)
+
+
+def stage_rows(record):
+    """One row per stage of a render, for display; views served from caches get a ``cached`` row."""
+    rows = []
+    for view_record in record["views"]:
+        stages = view_record["stages"] or (
+            [{"stage": "cached", "seconds": view_record["seconds"]}] if view_record["view"] != "page" else [])
+        for stage_record in stages:
+            peak = stage_record.get("peak_bytes")
+            rows.append({
+                "View": view_record["view"],
+                "Filters": _params(view_record["params"]),
+                "Stage": stage_record["stage"],
+                "Detail": stage_record.get("label") or "",
+                "ms": round((stage_record.get("seconds") or 0) * 1000, 1),
+                "Rows scanned": stage_record.get("rows_scanned"),
+                "Result rows": stage_record.get("result_rows"),
+                "Bytes": stage_record.get("bytes"),
+                "Peak KB": None if peak is None else round(peak / 1024, 1),
+            })
+    return rows
+
+
+def _labels(**labels):
+    escaped = {name: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for name, value in labels.items()}
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped.items()) + "}"
+
+
+def prometheus():
+    """The totals of every finished render in the Prometheus text format."""
+    with _lock:
+        pages = sorted(_page_totals.items())
+        totals = sorted(_totals.items())
+    lines = [
+        "# HELP dashboard_render_seconds Wall time of page renders.",
+        "# TYPE dashboard_render_seconds summary",
+    ]
+    for page, page_totals in pages:
+        lines.append(f"dashboard_render_seconds_count{_labels(page=page)} {page_totals['count']}")
+        lines.append(f"dashboard_render_seconds_sum{_labels(page=page)} {page_totals['seconds']:.6f}")
+
+    series = [
+        ("dashboard_stage_seconds", "summary", "Wall time of render stages, excluding nested stages."),
+        ("dashboard_stage_rows_scanned_total", "counter", "Rows selected by filter stages."),
+        ("dashboard_stage_result_rows_total", "counter", "Rows returned by aggregate stages."),
+        ("dashboard_stage_bytes_total", "counter", "Bytes of serialized figures."),
+        ("dashboard_stage_peak_bytes", "gauge", "Largest peak allocation of a stage, from tracemalloc."),
+    ]
+    for metric, kind, description in series:
+        lines += [f"# HELP {metric} {description}", f"# TYPE {metric} {kind}"]
+        for (page, view_name, stage_name), stage_totals in totals:
+            labels = _labels(page=page, view=view_name, stage=stage_name)
+            if metric == "dashboard_stage_seconds":
+                lines.append(f"{metric}_count{labels} {stage_totals['count']}")
+                lines.append(f"{metric}_sum{labels} {stage_totals['seconds']:.6f}")
+            elif metric == "dashboard_stage_peak_bytes":
+                if stage_totals["peak_bytes"] is not None:
+                    lines.append(f"{metric}{labels} {stage_totals['peak_bytes']}")
+            else:
+                measure = metric[len("dashboard_stage_"):-len("_total")]
+                if stage_totals[measure]:
+                    lines.append(f"{metric}{labels} {stage_totals[measure]}")
+    return "\n".join(lines) + "\n"
+
+
+def format_table(records):
+    """The slowest stages of ``records``, one line each."""
+    rows = [dict(row, Page=record["page"]) for record in records for row in stage_rows(record)]
+    rows.sort(key=lambda row: -row["ms"])
+    lines = [f"{'ms':>9}  {'peak KB':>9}  {'rows':>10}  page / view (filters): stage [detail]"]
+    for row in rows:
+        rows_count = row["Rows scanned"] if row["Rows scanned"] is not None else row["Result rows"]
+        lines.append(
+            f"{row['ms']:>9.1f}  {'' if row['Peak KB'] is None else row['Peak KB']:>9}  "
+            f"{'' if rows_count is None else rows_count:>10}  "
+            f"{row['Page']} / {row['View']} ({row['Filters']}): {row['Stage']}"
+            + (f" [{row['Detail']}]" if row["Detail"] else "")
+        )
+    return "\n".join(lines)
+
+
+def render_pages(pages=None):
+    """Render each page, then again for each other option of its sidebar selectbox, headless.
+
+    Returns the records of those renders (and forgets earlier ones).
+    """
+    # Imported here: the analytics package imports this module
+    from streamlit.testing.v1 import AppTest
+
+    from startup import APP
+    from views import PAGES
+
+    _recent.clear()
+    for page in pages or PAGES:
+        app = AppTest.from_file(APP, default_timeout=600)
+        app.query_params["page"] = page
+        app.run()
+        for selectbox in app.sidebar.selectbox:
+            for option in selectbox.options[1:]:
+                selectbox.set_value(option)
+                app.run()
+    return list(_recent)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render dashboard pages headless and report where the time goes.")
+    parser.add_argument("--pages", nargs="+", help="pages to render (default: all)")
+    parser.add_argument("--format", choices=["table", "json", "prometheus"], default="table")
+    args = parser.parse_args(argv)
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    records = render_pages(args.pages)
+    if args.format == "table":
+        print(format_table(records))
+    elif args.format == "json":
+        print("\n".join(json.dumps(record, default=str) for record in records))
+    else:
+        print(prometheus(), end="")
+
+
+if __name__ == "__main__":
+    # Through the module the dashboard records into, not __main__
+    import instrument
+    instrument.main()
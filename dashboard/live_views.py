@@ -0,0 +1,191 @@
+"""Views computed on request from a dataset: the live counterpart of ``snapshot.SnapshotViews``.
+
+Each view of ``FIGURES``, ``TABLES`` and ``VALUES`` runs the analytics
+functions behind one figure, table or value (see ``views.py``) and draws
+figures with ``figures.py``; both memoize their results.
+"""
+import json
+
+import analytics
+import delivery
+import figures
+import filters
+import geo
+import instrument
+from views import (
+    CITY_COUNTS, CITY_RANKINGS, DELIVERY_CHART_GROUPS, PRODUCT_COUNT, PRODUCT_MIN_REVIEWS, PRODUCT_RANKINGS,
+)
+
+
+def records(df):
+    """Rows of ``df`` as JSON-ready dicts."""
+    with instrument.stage("serialize", "records") as stage:
+        payload = df.to_json(orient="records", date_format="iso")
+        stage["bytes"] = len(payload)
+        return json.loads(payload)
+
+
+def _category_sales(dataset, variant):
+    if variant == "Top-selling Category":
+        return figures.figure(figures.category_sales, analytics.top_selling_categories(dataset),
+                              title='Top-selling Product Categories')
+    return figures.figure(figures.category_sales, analytics.worst_selling_categories(dataset),
+                          title='Worst-selling Product Categories')
+
+
+def _category_rating(dataset, variant):
+    # Green for top-rated categories, red for worst-rated
+    if variant == "Top-rated Category":
+        return figures.figure(figures.category_rating, analytics.top_rated_categories(dataset),
+                              title='Top-rated Product Categories', color='rgb(0, 128, 0)')
+    return figures.figure(figures.category_rating, analytics.worst_rated_categories(dataset),
+                          title='Worst-rated Product Categories', color='rgb(255, 0, 0)')
+
+
+def _delivery_percentiles(dataset, by):
+    stats = analytics.delivery_stats(dataset, by)
+    # Every month, in order; of other groups only those with the most orders
+    if by != "month":
+        stats = stats.head(DELIVERY_CHART_GROUPS)
+    return figures.figure(figures.delivery_percentiles, stats, group=delivery.GROUPS[by])
+
+
+FIGURES = {
+    "monthly_orders": lambda dataset, year: figures.figure(
+        figures.monthly_orders, analytics.monthly_orders(dataset, year)),
+    "category_sales": _category_sales,
+    "category_rating": _category_rating,
+    "rating_distribution": lambda dataset: figures.figure(
+        figures.rating_distribution, analytics.rating_distribution(dataset)),
+    "customer_cities": lambda dataset, year: figures.figure(
+        figures.customer_cities, analytics.top_customer_cities(dataset, year),
+        analytics.worst_customer_cities(dataset, year), year),
+    "payment_segments": lambda dataset, year: figures.figure(
+        figures.payment_segments, analytics.payment_segments(dataset, year)),
+    "delivery_status": lambda dataset: figures.figure(
+        figures.delivery_status, analytics.delivery_status_counts(dataset)),
+    "hour_rating": lambda dataset: figures.figure(figures.hour_rating, analytics.hour_rating(dataset)),
+    "time_of_day": lambda dataset: figures.figure(figures.time_of_day, analytics.time_of_day_counts(dataset)),
+    "weekday": lambda dataset: figures.figure(figures.weekday, analytics.weekday_counts(dataset)),
+    "city_sales": lambda dataset, ranking, count: figures.figure(
+        figures.city_sales, analytics.city_sales_ranking(dataset, count, ranking == "Worst-selling")),
+    "customer_segments": lambda dataset: figures.figure(
+        figures.customer_segments, analytics.customer_segments(dataset)),
+    "cohort_retention": lambda dataset: figures.figure(figures.cohort_retention, analytics.cohort_retention(dataset)),
+    "delivery_percentiles": _delivery_percentiles,
+    "lead_time_histogram": lambda dataset: figures.figure(
+        figures.lead_time_histogram, analytics.lead_time_histogram(dataset)),
+}
+
+
+def _city_sales_page(dataset, search, page, page_size):
+    rows, matching = analytics.city_sales_page(dataset, search, page, page_size)
+    return records(rows), matching
+
+
+def _geo_index():
+    with instrument.stage("load", "geo"):
+        return geo.load_geo_index()
+
+
+def _map_cells(dataset, zoom, lat, lng):
+    index = _geo_index()
+    if index is None:
+        return []
+    with instrument.stage("filter", "visible_cells") as stage:
+        stage["rows_scanned"] = len(index["cells"].get(zoom, ()))
+        cells = geo.visible_cells(index, zoom, lat, lng)
+    return records(cells)
+
+
+def _map_level(dataset, zoom):
+    index = _geo_index()
+    return [] if index is None or zoom not in index["cells"] else records(index["cells"][zoom])
+
+
+def _map_centers(dataset):
+    index = _geo_index()
+    return [] if index is None else records(index["centers"])
+
+
+TABLES = {
+    "top_rated_products": lambda dataset, ranking, min_reviews: records(analytics.top_rated_products(
+        dataset, PRODUCT_COUNT, min_reviews, None, ranking == "Lowest-rated")),
+    "top_rated_per_category": lambda dataset, min_reviews: records(
+        analytics.top_rated_per_category(dataset, min_reviews)),
+    # Every city with its rank, for snapshots to page through
+    "city_sales": lambda dataset: _city_sales_page(dataset, "", 0, max(1, len(analytics.city_sales(dataset))))[0],
+    "city_sales_page": _city_sales_page,
+    "delivery_stats": lambda dataset, by: records(analytics.delivery_stats(dataset, by)),
+    "customer_segments": lambda dataset: records(analytics.customer_segments(dataset)),
+    # Map cells in one viewport, and every cell of a zoom level for snapshots
+    "map_cells": _map_cells,
+    "map_level": _map_level,
+}
+
+VALUES = {
+    "years": lambda dataset: [int(year) for year in analytics.years(dataset)],
+    "average_spend": lambda dataset, year: float(analytics.average_spend(dataset, year)),
+    "map_centers": _map_centers,
+}
+
+
+def view_keys(years):
+    """Every ``(kind, name, params)`` the dashboard can ask for, given the year options.
+
+    ``city_sales_page`` and ``map_cells`` are left out: snapshots answer them
+    from ``city_sales`` and ``map_level``.
+    """
+    keys = [("value", "years", ()), ("value", "map_centers", ())]
+    for year in years:
+        keys += [
+            ("figure", "monthly_orders", (year,)),
+            ("figure", "customer_cities", (year,)),
+            ("figure", "payment_segments", (year,)),
+            ("value", "average_spend", (year,)),
+        ]
+    keys += [("figure", "category_sales", (variant,)) for variant in ["Top-selling Category", "Worst-selling Category"]]
+    keys += [("figure", "category_rating", (variant,)) for variant in ["Top-rated Category", "Worst-rated Category"]]
+    keys += [("figure", name, ()) for name in ["rating_distribution", "delivery_status", "hour_rating", "time_of_day",
+                                               "weekday", "lead_time_histogram", "customer_segments",
+                                               "cohort_retention"]]
+    keys += [("figure", "city_sales", (ranking, count)) for ranking in CITY_RANKINGS for count in CITY_COUNTS]
+    keys += [("table", "top_rated_products", (ranking, min_reviews))
+             for ranking in PRODUCT_RANKINGS for min_reviews in PRODUCT_MIN_REVIEWS]
+    keys += [("table", "top_rated_per_category", (min_reviews,)) for min_reviews in PRODUCT_MIN_REVIEWS]
+    keys += [("table", "city_sales", ()), ("table", "customer_segments", ())]
+    for by in delivery.GROUPS:
+        keys += [("figure", "delivery_percentiles", (by,)), ("table", "delivery_stats", (by,))]
+    keys += [("table", "map_level", (zoom,)) for zoom in geo.MAP_ZOOMS]
+    return keys
+
+
+class LiveViews:
+    """Views computed on request from ``dataset`` (memoized by analytics and figures).
+
+    Global filters set on the dataset (see ``analytics.filter_dataset``)
+    apply to every view.
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        # Recorded with each view's own parameters
+        self._filters = () if dataset.filters is None else (filters.describe(dataset.filters),)
+
+    def figure(self, name, *params):
+        with instrument.view("figure", name, params + self._filters):
+            return FIGURES[name](self.dataset, *params)
+
+    def table(self, name, *params):
+        with instrument.view("table", name, params + self._filters):
+            return TABLES[name](self.dataset, *params)
+
+    def value(self, name, *params):
+        with instrument.view("value", name, params + self._filters):
+            return VALUES[name](self.dataset, *params)
+
+    def render(self, kind, name, params):
+        """JSON text of one view, as stored in a snapshot."""
+        if kind == "figure":
+            return self.figure(name, *params).json
+        return json.dumps(getattr(self, kind)(name, *params))
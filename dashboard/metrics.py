@@ -0,0 +1,275 @@
+"""Dashboard metrics computed at the grain of the facts they measure.
+
+Every function takes the star schema from ``star_schema.load_star`` and an
+optional purchase year (or date range, see ``period_slice``), joins only the
+columns it needs and returns the frame its chart plots.
+Counts of orders come from the orders fact, payment totals
+from the payments fact and ratings from reviews, so nothing is inflated by
+the order x item x payment x review fan-out of the merged table.
+
+The period may also be a set of global filters (``filters.Filters``), which
+restricts every fact to the orders that pass them.
+
+``rollups.py`` exposes the same functions over its pre-aggregates and
+``sql_backend.py`` as SQL over an embedded database; ``compare`` checks
+either against these.
+"""
+import numpy as np
+import pandas as pd
+
+import instrument
+from features import DAY_ORDER
+from filters import Filters, Selection, filter_index
+from time_index import ORDER_FACTS
+
+
+def period_slice(star, year=None):
+    """Positional slice of the time-sorted orders fact for a purchase period.
+
+    ``year`` is a purchase year, a ``(start, end)`` pair of timestamps
+    (end exclusive, either may be None) or None for every order. The slice is
+    found by binary search on the star's ``time_index``. For ``Filters``, the
+    result is a ``filters.Selection`` instead, which ``select`` and
+    ``fact_orders`` take like a slice.
+    """
+    if year is None:
+        return slice(None)
+    if isinstance(year, Filters):
+        return filter_index(star).selection(year)
+    index = star["time_index"]
+    if isinstance(year, tuple):
+        return index.range_slice(*year)
+    return index.year_slice(year)
+
+
+def select(star, name, period=slice(None), refine=True):
+    """Rows of fact ``name`` for the orders in ``period``, without copying a slice.
+
+    ``refine`` applies to a ``Selection`` (see ``Selection.rows``).
+    """
+    with instrument.stage("filter", name) as stage:
+        if isinstance(period, Selection):
+            rows = period.take(star, name, refine)
+        elif period == slice(None):
+            rows = star[name]
+        else:
+            if name in ORDER_FACTS:
+                period = star["time_index"].fact_slice(name, period)
+            rows = star[name].iloc[period]
+        stage["rows_scanned"] = len(rows)
+    return rows
+
+
+def fact_orders(star, name, period=slice(None)):
+    """Position in the orders fact of each row of fact ``name`` in ``period`` (-1 if none).
+
+    ``name`` may also be ``orders``, for the positions of the orders themselves.
+    """
+    if isinstance(period, Selection):
+        return period.positions(name)
+    index = star["time_index"]
+    if name not in ORDER_FACTS:
+        return np.arange(len(star["orders"]))[period]
+    positions = index.fact_positions[name]
+    return positions if period == slice(None) else positions[index.fact_slice(name, period)]
+
+
+def orders_for_year(star, year=None):
+    return select(star, "orders", period_slice(star, year))
+
+
+def item_sales(star, period=slice(None)):
+    """Items of the orders in ``period`` with the order's payments allocated to each item.
+
+    Payments are recorded per order, so each item gets the share of the order's
+    payment total proportional to its price plus freight. Summing the result
+    over any item attribute (category, product) adds up to the payments.
+    Shares are taken over all items of an order, also when filtering on
+    categories drops some of them.
+    """
+    items = select(star, "items", period, refine=False)[["order_id", "product_id", "price", "freight_value"]]
+    payments = select(star, "payments", period)
+    order_payments = payments.groupby("order_id", observed=True)["payment_value"].sum()
+
+    item_value = items["price"] + items["freight_value"]
+    share = item_value / item_value.groupby(items["order_id"], observed=True).transform("sum")
+    items = items.assign(payment_value=share.to_numpy() * order_payments.reindex(items["order_id"]).to_numpy())
+    if isinstance(period, Selection):
+        items = items[period.refinement("items")]
+    return items.merge(star["products"], on="product_id", how="left")
+
+
+def item_reviews(star, period=slice(None)):
+    """One row per (item, review) of the orders in ``period``, with the product category."""
+    items = select(star, "items", period)[["order_id", "product_id"]]
+    reviews = select(star, "reviews", period)
+    return items.merge(reviews, on="order_id").merge(star["products"], on="product_id", how="left")
+
+
+def order_customers(star, orders):
+    return orders[["order_id", "customer_id"]].merge(
+        star["customers"][["customer_id", "customer_city"]], on="customer_id", how="left")
+
+
+def years(star):
+    """Purchase years present in the data, for the year filter."""
+    return star["time_index"].years
+
+
+def monthly_orders(star, year=None):
+    """Number of orders per month, indexed by month end."""
+    orders = orders_for_year(star, year)
+    if orders.empty:
+        # resample() fails on no rows, which filters can select
+        return pd.Series([], index=pd.DatetimeIndex([], name="order_purchase_timestamp"), dtype="int64")
+    return orders.resample('ME', on='order_purchase_timestamp').size()
+
+
+def category_sales(star, year=None):
+    sales = item_sales(star, period_slice(star, year))
+    return (
+        sales.groupby("product_category_name", observed=True)["payment_value"].sum().reset_index()
+        .sort_values(by="payment_value", ascending=False)
+    )
+
+
+def category_rating(star, year=None):
+    reviews = item_reviews(star, period_slice(star, year))
+    return (
+        reviews.groupby('product_category_name', observed=True)['review_score'].mean().reset_index()
+        .sort_values(by='review_score', ascending=False)
+    )
+
+
+def product_rating(star, year=None):
+    """Mean review score and number of scored reviews (one per reviewed item) per product."""
+    reviews = item_reviews(star, period_slice(star, year))
+    return reviews.groupby(['product_id', 'product_category_name'], observed=True).agg(
+        review_score=('review_score', 'mean'), review_count=('review_score', 'count')).reset_index()
+
+
+def rating_distribution(star, year=None):
+    reviews = select(star, "reviews", period_slice(star, year))
+    rating_dist_df = reviews.groupby('review_score', observed=True)['order_id'].nunique().reset_index()
+    rating_dist_df.columns = ['Review Score', 'Order Count']
+    return rating_dist_df
+
+
+def city_customers(star, year=None):
+    customers = order_customers(star, orders_for_year(star, year))
+    city_df = customers.groupby('customer_city', observed=True)['customer_id'].nunique().reset_index()
+    city_df.columns = ['City', 'Customer Count']
+    return city_df.sort_values(by='Customer Count', ascending=False)
+
+
+def payment_segments(star, year=None):
+    payments = select(star, "payments", period_slice(star, year))
+    payment_method_df = payments.groupby('payment_type', observed=True)['order_id'].nunique().reset_index()
+    payment_method_df.columns = ['Payment Type', 'Purchase Count']
+    return payment_method_df
+
+
+def average_spend(star, year=None):
+    """Mean total payments per customer; customers without payments count as 0."""
+    period = period_slice(star, year)
+    customers = select(star, "orders", period)["customer_id"].nunique()
+    if not customers:
+        return np.nan
+    return select(star, "payments", period)["payment_value"].sum() / customers
+
+
+def delivery_status_counts(star, year=None):
+    """Delivered orders per status; orders not yet delivered have no status."""
+    statuses = select(star, "order_features", period_slice(star, year))["delivery_status"]
+    counts = statuses.value_counts()
+    return counts[counts > 0].rename_axis("delivery_status")
+
+
+def hour_rating(star, year=None):
+    period = period_slice(star, year)
+    positions = fact_orders(star, "reviews", period)
+    hours = np.where(positions >= 0, star["order_features"]["hour"].to_numpy()[positions], -1)
+    scores = select(star, "reviews", period)["review_score"].to_numpy()
+    rating = pd.Series(scores[hours >= 0]).groupby(hours[hours >= 0]).mean()
+    return rating.rename("review_score").rename_axis("hour_of_purchase").dropna().reset_index()
+
+
+def time_of_day_counts(star, year=None):
+    counts = select(star, "order_features", period_slice(star, year))["time_of_day"].value_counts()
+    return counts[counts > 0].rename_axis("purchase_time_of_day")
+
+
+def weekday_counts(star, year=None):
+    weekdays = select(star, "order_features", period_slice(star, year))["weekday"].to_numpy()
+    counts = np.bincount(weekdays[weekdays >= 0], minlength=len(DAY_ORDER))
+    days = np.flatnonzero(counts)
+    return pd.DataFrame({
+        "day_of_week": pd.Categorical(np.take(DAY_ORDER, days), categories=DAY_ORDER, ordered=True),
+        "order_id": counts[days],
+    })
+
+
+def city_sales(star, year=None):
+    """Payments and number of items sold per customer city."""
+    period = period_slice(star, year)
+    cities = order_customers(star, select(star, "orders", period))[["order_id", "customer_city"]]
+    payments = select(star, "payments", period)[["order_id", "payment_value"]].merge(cities, on="order_id")
+    items = select(star, "items", period)[["order_id"]].merge(cities, on="order_id")
+
+    city_sales_df = pd.concat([
+        payments.groupby('customer_city', observed=True)['payment_value'].sum().rename('Total Sales'),
+        items.groupby('customer_city', observed=True).size().rename('Product Sold'),
+    ], axis=1).fillna(0).rename_axis('City').reset_index()
+    city_sales_df['Product Sold'] = city_sales_df['Product Sold'].astype('int64')
+    return city_sales_df.sort_values(by='Total Sales', ascending=False)
+
+
+# Queries that take a year filter; product_rating is all-time only
+YEAR_QUERIES = [
+    "monthly_orders", "category_sales", "category_rating", "rating_distribution", "city_customers",
+    "payment_segments", "average_spend", "delivery_status_counts", "hour_rating", "time_of_day_counts",
+    "weekday_counts", "city_sales",
+]
+
+
+def _normalize(result):
+    # Ties may come out in either order, so compare results sorted by content
+    if isinstance(result, pd.Series):
+        if isinstance(result.index, pd.DatetimeIndex):
+            return result.sort_index()
+        result = result.rename_axis("key").reset_index(name="value")
+    if isinstance(result, pd.DataFrame):
+        result = result.astype({column: str for column in result.columns if result[column].dtype.name == "category"})
+        return result.sort_values(list(result.columns)).reset_index(drop=True)
+    return result
+
+
+def _check(expected, actual):
+    expected, actual = _normalize(expected), _normalize(actual)
+    if isinstance(expected, pd.Series):
+        pd.testing.assert_series_equal(actual, expected, check_names=False, check_freq=False, check_dtype=False)
+    elif isinstance(expected, pd.DataFrame):
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False, check_names=False)
+    elif not np.isclose(actual, expected, equal_nan=True):
+        raise AssertionError(f"{actual} != {expected}")
+
+
+def compare(star, answer, years=None):
+    """Check another backend's answers against the metric of the same name.
+
+    ``answer(name, *args)`` returns that backend's result of query ``name``.
+    Every query is checked for all years and for each year in ``years``
+    (default: every year in ``star``). Returns a list of ``(query, year)``
+    pairs that did not match.
+    """
+    if years is None:
+        years = [None] + star["time_index"].years
+    checks = [("product_rating", None)] + [(name, year) for name in YEAR_QUERIES for year in years]
+    mismatches = []
+    for name, year in checks:
+        args = () if year is None else (year,)
+        try:
+            _check(globals()[name](star, *args), answer(name, *args))
+        except AssertionError:
+            mismatches.append((name, year))
+    return mismatches
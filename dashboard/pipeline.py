@@ -0,0 +1,466 @@
+"""Rebuild the dashboard dataset from the raw Olist tables.
+
+This is the cleaning and merge chain from ``notebook.ipynb`` as a repeatable
+build: geolocation dedup, timestamp parsing, the product ``fillna(0)`` and
+the orders -> customers -> order items -> payments -> reviews -> products ->
+sellers joins. The raw tables are read concurrently by ``ingest.py``, only
+the columns the dashboard needs and with explicit schemas, and the joins run
+on integer-coded keys instead of 32-character hex strings.
+
+The merged table is written as a Parquet dataset partitioned by purchase
+year/month (``dashboard/main_data/``), which is what the dashboard loads, and
+optionally as the legacy ``dashboard/main_data.csv``. The star schema the
+dashboard queries (``star_schema.py``), the chart rollups built from it
+(``rollups.py``), the customer segments (``segments.py``) and the delivery
+tables (``delivery.py``) are written next to it, to ``dashboard/star/``,
+``dashboard/rollups/``, ``dashboard/segments/`` and ``dashboard/delivery/``,
+and the spatial index behind the map (``geo.py``) to ``dashboard/geo/`` when
+the geolocation table is present.
+
+With ``--incremental`` only orders that are new or changed since the last
+build are merged and written into their year/month partitions, and only
+their months of the star tables, rollups and map index are recomputed; see
+``build_incremental``.
+
+Usage:
+    python dashboard/pipeline.py [--data-dir data] [--output-dir dashboard] [--no-csv] [--incremental]
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import delivery
+import geo
+import ingest
+import rollups
+import segments
+from data_loader import remove_directory, replace_directory, update_directory
+from ingest import DASHBOARD_DIR, DEFAULT_DATA_DIR
+from star_schema import (
+    STAR_TABLES, prepare_star, read_star_months, star_from_tables, star_keys, update_star, write_star,
+)
+
+# Raw tables the merge reads; their schemas are in ``ingest.TABLES``
+MERGE_TABLES = ["orders", "customers", "order_items", "order_payments", "order_reviews", "products", "sellers"]
+
+# Columns of the merged table, in the order the notebook wrote main_data.csv,
+# followed by the seller and carrier columns the notebook's export dropped.
+MAIN_DATA_COLUMNS = [
+    "order_id", "customer_id", "customer_unique_id", "customer_city", "customer_state",
+    "product_id", "product_category_name", "order_item_id", "price", "freight_value",
+    "payment_type", "payment_value", "review_score", "order_status", "order_purchase_timestamp",
+    "order_approved_at", "order_delivered_customer_date", "order_estimated_delivery_date",
+    "order_delivered_carrier_date", "seller_id", "seller_city", "seller_state",
+]
+
+PARTITION_COLUMNS = ["year", "month"]
+
+# Tables whose rows belong to a single order; they make up an order's fingerprint
+ORDER_TABLES = ["orders", "order_items", "order_payments", "order_reviews"]
+
+# Incremental build state lives inside the dataset; pyarrow skips "_" entries
+STATE_DIR = "_state"
+
+
+def read_raw_table(name, data_dir=DEFAULT_DATA_DIR):
+    """Read one raw Olist table with its ``ingest.TABLES`` schema."""
+    return ingest.read_table(name, data_dir).to_pandas()
+
+
+def clean_products(products):
+    # The notebook's fillna(0) also fills missing categories, so uncategorised
+    # products end up under the "0" category in main_data.csv.
+    return products.fillna({"product_category_name": "0"}).fillna(0)
+
+
+def clean_geolocation(geolocation):
+    return geolocation.drop_duplicates(ignore_index=True)
+
+
+def _encode(values, uniques):
+    """Map ``values`` onto integer positions in ``uniques`` (-1 if absent)."""
+    return uniques.get_indexer(values).astype(np.int32)
+
+
+def _decode(codes, uniques):
+    """Inverse of ``_encode``; -1 codes become missing values."""
+    return pd.Categorical.from_codes(codes, categories=uniques).astype(object)
+
+
+def merge_tables(tables):
+    """Join the cleaned tables into the order x item x payment x review table.
+
+    Every join is a left join from orders, as in the notebook's export cell.
+    String IDs are replaced by int32 codes before joining and decoded once at
+    the end, so the hash joins never touch the hex strings.
+    """
+    orders = tables["orders"]
+    customers = tables["customers"]
+    items = tables["order_items"]
+    payments = tables["order_payments"]
+    reviews = tables["order_reviews"]
+    products = tables["products"]
+    sellers = tables["sellers"]
+
+    order_ids = pd.Index(orders["order_id"])
+    customer_ids = pd.Index(customers["customer_id"])
+    product_codes, product_ids = pd.factorize(items["product_id"])
+    seller_codes, seller_ids = pd.factorize(items["seller_id"])
+    product_ids = pd.Index(product_ids)
+    seller_ids = pd.Index(seller_ids)
+
+    merged = pd.DataFrame({"order_key": np.arange(len(orders), dtype=np.int32)})
+    merged["customer_key"] = _encode(orders["customer_id"], customer_ids)
+    merged = merged.join(orders.drop(columns=["order_id", "customer_id"]))
+
+    customers = customers.drop(columns="customer_id")
+    customers["customer_key"] = np.arange(len(customers), dtype=np.int32)
+    merged = merged.merge(customers, on="customer_key", how="left")
+
+    items = items.drop(columns=["order_id", "product_id", "seller_id"]).assign(
+        order_key=_encode(tables["order_items"]["order_id"], order_ids),
+        product_key=product_codes.astype(np.int32),
+        seller_key=seller_codes.astype(np.int32),
+    )
+    merged = merged.merge(items, on="order_key", how="left")
+
+    payments = payments.drop(columns="order_id").assign(
+        order_key=_encode(tables["order_payments"]["order_id"], order_ids))
+    merged = merged.merge(payments, on="order_key", how="left")
+
+    reviews = reviews.drop(columns="order_id").assign(
+        order_key=_encode(tables["order_reviews"]["order_id"], order_ids))
+    merged = merged.merge(reviews, on="order_key", how="left")
+
+    products = products.assign(product_key=_encode(products["product_id"], product_ids))
+    products = products[products["product_key"] >= 0].drop(columns="product_id")
+    merged = merged.merge(products, on="product_key", how="left")
+
+    sellers = sellers.assign(seller_key=_encode(sellers["seller_id"], seller_ids))
+    sellers = sellers[sellers["seller_key"] >= 0].drop(columns="seller_id")
+    merged = merged.merge(sellers, on="seller_key", how="left")
+
+    # Every row comes from an order; missing item keys come back as NaN floats
+    order_keys = merged["order_key"].to_numpy()
+    merged["order_id"] = orders["order_id"].to_numpy()[order_keys]
+    merged["customer_id"] = orders["customer_id"].to_numpy()[order_keys]
+    merged["product_id"] = _decode(merged["product_key"].fillna(-1).to_numpy(np.int32), product_ids)
+    merged["seller_id"] = _decode(merged["seller_key"].fillna(-1).to_numpy(np.int32), seller_ids)
+    return merged[MAIN_DATA_COLUMNS]
+
+
+def load_tables(data_dir=DEFAULT_DATA_DIR, names=MERGE_TABLES):
+    """Read every raw table in ``names`` concurrently and clean them.
+
+    Prints the ingest wall time of each table.
+    """
+    start = time.perf_counter()
+    tables, timings = ingest.read_tables(names, data_dir)
+    print(ingest.format_timings(timings, time.perf_counter() - start))
+    tables["products"] = clean_products(tables["products"])
+    return tables
+
+
+def with_partition_columns(df):
+    purchase = df["order_purchase_timestamp"]
+    return df.assign(year=purchase.dt.year.astype(np.int16), month=purchase.dt.month.astype(np.int8))
+
+
+def order_fingerprints(tables):
+    """Return a uint64 content hash per order, indexed by ``order_id``.
+
+    The hash covers the order row and all of its items, payments and reviews,
+    so a late-arriving review or payment changes the fingerprint of its order.
+    Row hashes are combined with a wrapping sum, which ignores row order.
+    """
+    order_ids = pd.Index(tables["orders"]["order_id"])
+    fingerprints = np.zeros(len(order_ids), dtype=np.uint64)
+    for name in ORDER_TABLES:
+        table = tables[name]
+        codes = _encode(table["order_id"], order_ids)
+        hashes = pd.util.hash_pandas_object(table.drop(columns="order_id"), index=False).to_numpy()
+        found = codes >= 0
+        np.add.at(fingerprints, codes[found], hashes[found])
+    return pd.Series(fingerprints, index=order_ids, name="fingerprint")
+
+
+def make_state(orders, fingerprints):
+    """Build the per-order build state: fingerprint plus the partition it lives in."""
+    state = with_partition_columns(orders[["order_id", "order_purchase_timestamp"]])
+    state["fingerprint"] = fingerprints.to_numpy()
+    return state.drop(columns="order_purchase_timestamp").reset_index(drop=True)
+
+
+def read_state(root):
+    """Return ``(state, high_water_mark)`` for the dataset at ``root``, or None."""
+    state_dir = os.path.join(root, STATE_DIR)
+    try:
+        with open(os.path.join(state_dir, "state.json")) as f:
+            meta = json.load(f)
+        state = pd.read_parquet(os.path.join(state_dir, "orders.parquet"))
+    except FileNotFoundError:
+        return None
+    return state, pd.Timestamp(meta["high_water_mark"])
+
+
+def write_state(root, state, high_water_mark):
+    state_dir = os.path.join(root, STATE_DIR)
+    os.makedirs(state_dir, exist_ok=True)
+    _replace_file(os.path.join(state_dir, "orders.parquet"),
+                  lambda path: state.to_parquet(path, index=False))
+    meta = {"high_water_mark": high_water_mark.isoformat(), "orders": len(state)}
+
+    def write_meta(path):
+        with open(path, "w") as f:
+            json.dump(meta, f, indent=2)
+
+    _replace_file(os.path.join(state_dir, "state.json"), write_meta)
+
+
+def _replace_file(path, write):
+    # Write next to the target and rename, so readers see old or new, never half
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _partition_dir(root, year, month):
+    return os.path.join(root, f"year={year}", f"month={month}")
+
+
+def write_dataset(df, root, state=None):
+    """Write ``df`` as a year/month partitioned Parquet dataset at ``root``.
+
+    The dataset is written next to ``root`` and swapped in with a rename, so
+    readers never observe a partially written build.
+    """
+    table = pa.Table.from_pandas(with_partition_columns(df), preserve_index=False)
+
+    def write(tmp_root):
+        pq.write_to_dataset(
+            table,
+            tmp_root,
+            partition_cols=PARTITION_COLUMNS,
+            basename_template="part-{i}.parquet",
+        )
+        if state is not None:
+            write_state(tmp_root, state, df["order_purchase_timestamp"].max())
+
+    replace_directory(root, write)
+
+
+def update_dataset(root, rows, replaced_order_ids, replaced_partitions, state, high_water_mark):
+    """Apply an incremental batch to the partitioned dataset at ``root``.
+
+    ``rows`` are merged rows for new and changed orders. Partitions listed in
+    ``replaced_partitions`` held older rows for ``replaced_order_ids``; those
+    partitions are rewritten without them. Every other partition only gets a
+    new part file, so untouched history is never read or rewritten.
+
+    The batch and the new build ``state`` are staged in a hard-linked copy of
+    the dataset and swapped in at once (see ``data_loader.update_directory``),
+    so readers and a crash see the dataset before or after the batch.
+    """
+    schema = ds.dataset(root, format="parquet", partitioning="hive").schema
+    schema = pa.schema([field for field in schema if field.name not in PARTITION_COLUMNS])
+    batch_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+
+    rows = with_partition_columns(rows)
+    groups = dict(list(rows.groupby(PARTITION_COLUMNS)))
+
+    def update(tmp_root):
+        for year, month in set(groups) | set(replaced_partitions):
+            part_dir = _partition_dir(tmp_root, year, month)
+            os.makedirs(part_dir, exist_ok=True)
+            new_rows = groups.get((year, month), rows.iloc[:0]).drop(columns=PARTITION_COLUMNS)
+
+            if (year, month) in replaced_partitions:
+                old_files = [os.path.join(part_dir, name) for name in os.listdir(part_dir) if name.endswith(".parquet")]
+                kept = [pq.read_table(file, schema=schema).to_pandas() for file in old_files]
+                kept = [df[~df["order_id"].isin(replaced_order_ids)] for df in kept]
+                new_rows = pd.concat(kept + [new_rows], ignore_index=True)
+                # Unlinks the staged copies only; the live dataset keeps its files until the swap
+                for file in old_files:
+                    os.remove(file)
+
+            if len(new_rows):
+                table = pa.Table.from_pandas(new_rows, schema=schema, preserve_index=False)
+                pq.write_table(table, os.path.join(part_dir, f"part-{batch_id}.parquet"))
+        write_state(tmp_root, state, high_water_mark)
+
+    update_directory(root, update)
+
+
+def write_star_and_rollups(tables, output_dir=DASHBOARD_DIR):
+    star = star_from_tables(tables)
+    star_root = os.path.join(output_dir, "star")
+    write_star(star, star_root)
+    rollups.write_rollups(rollups.build_rollups(star), os.path.join(output_dir, "rollups"), source=star_root)
+    prepared = prepare_star(star)
+    segments.write_segments(segments.build_segments(prepared), os.path.join(output_dir, "segments"), source=star_root)
+    delivery.write_delivery(delivery.build_delivery(prepared), os.path.join(output_dir, "delivery"), source=star_root)
+
+
+def update_star_and_rollups(tables, batch, replaced, months, output_dir=DASHBOARD_DIR):
+    """Bring the star tables, rollups and map index up to date with an incremental ``batch``.
+
+    Only the purchase ``months`` the batch touches are recomputed: their star
+    partitions and rollup rows are rebuilt from the orders of those months in
+    ``tables``, and the star dimensions only gain the rows they lack. The map
+    index gets the customers, sellers and payments the batch adds and loses
+    the payments of the ``replaced`` orders (their rows of the build state).
+
+    The customer segments depend on all of a customer's orders and the
+    delivery percentiles on all orders of a group, so both are left stale:
+    the dashboard computes them from the star schema until a full build or
+    ``refresh.py --rebuild`` writes them again.
+    """
+    star_root, rollups_root, geo_root = (os.path.join(output_dir, name) for name in ["star", "rollups", "geo"])
+    if not os.path.isdir(os.path.join(star_root, "orders")):
+        write_star_and_rollups(tables, output_dir)
+        return
+    # Only rollups of the star as it is now can be updated
+    current = rollups.load_rollups(rollups_root, source=star_root)
+    old_payments = read_star_months("payments", set(zip(replaced["year"], replaced["month"])), star_root)
+
+    orders = tables["orders"]
+    purchase = orders["order_purchase_timestamp"]
+    month_orders = orders[pd.MultiIndex.from_arrays([purchase.dt.year, purchase.dt.month]).isin(list(months))]
+    month_tables = dict(tables, orders=month_orders)
+    for name in ("order_items", "order_payments", "order_reviews"):
+        table = tables[name]
+        month_tables[name] = table[table["order_id"].isin(month_orders["order_id"])]
+    new_dims = {}
+    for name in ("customers", "products", "sellers"):
+        table = tables[name]
+        new_dims[name] = table[~table[STAR_TABLES[name][0][0]].isin(star_keys(name, star_root))]
+
+    update_star(star_from_tables(dict(month_tables, **new_dims)), months, star_root)
+    if current is not None:
+        rollups.update_rollups(current, months, rollups.build_rollups(star_from_tables(month_tables)),
+                               rollups_root, source=star_root)
+    else:
+        rollups.write_rollups(rollups.build_rollups(star_from_tables(tables)), rollups_root, source=star_root)
+
+    if not os.path.isdir(geo_root):
+        return
+    old_payments = old_payments[old_payments["order_id"].isin(replaced["order_id"])]
+    customers, sellers = tables["customers"], tables["sellers"]
+    added = geo.zip_measures(new_dims["customers"], new_dims["sellers"], orders, batch["order_payments"], customers)
+    removed = geo.zip_measures(customers.iloc[:0], sellers.iloc[:0], orders, old_payments, customers)
+    delta = added.sub(removed, fill_value=0)
+    if geo.update_geo_index(delta, geo_root):
+        return
+    # Built without the zip centroids: rebuild from the geolocation table a full build kept, or drop the stale index
+    geolocation = os.path.join(output_dir, "geolocation.parquet")
+    if os.path.exists(geolocation):
+        geo.write_geo_index(geo.build_geo_index(dict(tables, geolocation=pd.read_parquet(geolocation))), geo_root)
+    else:
+        remove_directory(geo_root)
+
+
+def build(data_dir=DEFAULT_DATA_DIR, output_dir=DASHBOARD_DIR, write_csv=True):
+    """Run the full rebuild and return the merged frame."""
+    # The geolocation table is read alongside the others when it is present
+    with_geolocation = os.path.exists(ingest.table_path("geolocation", data_dir))
+    tables = load_tables(data_dir, MERGE_TABLES + ["geolocation"] * with_geolocation)
+    state = make_state(tables["orders"], order_fingerprints(tables))
+    merged = merge_tables(tables)
+
+    root = os.path.join(output_dir, "main_data")
+    write_dataset(merged, root, state)
+    write_star_and_rollups(tables, output_dir)
+    if write_csv:
+        merged.to_csv(os.path.join(output_dir, "main_data.csv"), index=False)
+
+    if with_geolocation:
+        tables["geolocation"] = clean_geolocation(tables["geolocation"])
+        tables["geolocation"].to_parquet(os.path.join(output_dir, "geolocation.parquet"), index=False)
+        geo.write_geo_index(geo.build_geo_index(tables), os.path.join(output_dir, "geo"))
+    return merged
+
+
+def build_incremental(data_dir=DEFAULT_DATA_DIR, output_dir=DASHBOARD_DIR):
+    """Merge only new or changed orders into the existing dataset.
+
+    Orders purchased after the stored high-water mark are new by definition;
+    older orders are new if their ``order_id`` was never processed and changed
+    if their fingerprint differs (status updates, late reviews or payments).
+    Only those orders are joined against the dimension tables, and only the
+    purchase months they fall in are recomputed in the star tables, rollups
+    and map index (see ``update_star_and_rollups``). Changes to the dimension
+    tables themselves (e.g. a product re-categorised) still need a full
+    rebuild. Returns the merged rows that were written.
+    """
+    root = os.path.join(output_dir, "main_data")
+    previous = read_state(root)
+    if previous is None:
+        return build(data_dir, output_dir, write_csv=False)
+    state, high_water_mark = previous
+
+    tables = load_tables(data_dir)
+    orders = tables["orders"]
+    fingerprints = order_fingerprints(tables)
+
+    after_mark = (orders["order_purchase_timestamp"] > high_water_mark).to_numpy()
+    positions = pd.Index(state["order_id"]).get_indexer(orders["order_id"])
+    positions[after_mark] = -1
+    known = positions >= 0
+    changed = np.zeros(len(orders), dtype=bool)
+    changed[known] = state["fingerprint"].to_numpy()[positions[known]] != fingerprints.to_numpy()[known]
+    dirty = ~known | changed
+
+    if not dirty.any():
+        return merge_tables({**tables, "orders": orders.iloc[:0]})
+
+    dirty_ids = orders["order_id"][dirty]
+    batch = dict(tables, orders=orders[dirty].reset_index(drop=True))
+    for name in ("order_items", "order_payments", "order_reviews"):
+        table = tables[name]
+        batch[name] = table[table["order_id"].isin(dirty_ids)].reset_index(drop=True)
+    rows = merge_tables(batch)
+
+    replaced = state.iloc[positions[changed]]
+    replaced_partitions = set(zip(replaced["year"], replaced["month"]))
+    batch_state = make_state(batch["orders"], fingerprints[dirty])
+    update_dataset(
+        root,
+        rows,
+        replaced_order_ids=set(replaced["order_id"]),
+        replaced_partitions=replaced_partitions,
+        state=pd.concat([state[~state["order_id"].isin(dirty_ids)], batch_state], ignore_index=True),
+        high_water_mark=max(high_water_mark, orders["order_purchase_timestamp"].max()),
+    )
+    months = set(zip(batch_state["year"], batch_state["month"])) | replaced_partitions
+    update_star_and_rollups(tables, batch, replaced, months, output_dir)
+    print(f"{int((~known).sum()):,} new orders ({int(after_mark.sum()):,} after the high-water mark), "
+          f"{int(changed.sum()):,} changed")
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the dashboard dataset from the raw Olist CSVs.")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="directory with the raw *_dataset.csv files")
+    parser.add_argument("--output-dir", default=DASHBOARD_DIR, help="where main_data/ and main_data.csv are written")
+    parser.add_argument("--no-csv", action="store_true", help="skip writing the legacy main_data.csv")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only merge new or changed orders into the existing main_data/ dataset")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.incremental:
+        merged = build_incremental(args.data_dir, args.output_dir)
+    else:
+        merged = build(args.data_dir, args.output_dir, write_csv=not args.no_csv)
+    print(f"Built {len(merged):,} rows in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
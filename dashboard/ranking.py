@@ -0,0 +1,132 @@
+"""Product ranking index: the best- and worst-rated products, overall or per category.
+
+Ranked by their mean review score, the top products are a few of the
+thousands with a single 5-star review, picked arbitrarily among the ties.
+``ProductRanking`` ranks by a Bayesian average instead: a product's scores
+plus ``PRIOR_REVIEWS`` reviews at the mean score of all products,
+
+    score = (PRIOR_REVIEWS * overall mean + sum of scores) / (PRIOR_REVIEWS + reviews)
+
+so ranking high takes many good reviews and one bad review does not sink a
+product to the bottom. Ties go to the product with more reviews, then to the
+lower product ID, so the order is stable.
+
+The statistics come from ``product_rating`` (review count and mean per
+product), which every backend answers. The index sorts the products by
+score once, overall and by category with each category's bounds, so
+``top`` reads the first (or last) ``k`` positions of a range: O(k). With a
+minimum number of reviews, the index of the products that have them is
+built on first use of that threshold and cached.
+
+Usage:
+    python dashboard/ranking.py [--category NAME] [--min-reviews N] [--bottom] [--top K]
+"""
+import argparse
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from views import PRIOR_REVIEWS
+
+COLUMNS = ["product_id", "product_category_name", "review_count", "review_score", "score"]
+
+_THRESHOLDS = 16
+
+
+def product_stats(rating):
+    """``rating`` (as ``product_rating`` returns it) with each product's ``score``; unreviewed products are left out."""
+    rating = rating[rating["review_count"] > 0].reset_index(drop=True)
+    counts = rating["review_count"].to_numpy(dtype=np.float64)
+    sums = rating["review_score"].to_numpy(dtype=np.float64) * counts
+    prior = sums.sum() / counts.sum() if len(rating) else 0.0
+    score = (PRIOR_REVIEWS * prior + sums) / (PRIOR_REVIEWS + counts)
+    # Rounded so that backends which sum in another order rank ties alike
+    return rating.assign(score=score.round(9))[COLUMNS]
+
+
+class ProductRanking:
+    """Products of a ``product_stats`` table sorted by score, overall and within each category."""
+
+    def __init__(self, stats):
+        self.stats = stats
+        self._counts = stats["review_count"].to_numpy()
+        # By name: a categorical column's own order depends on the backend
+        self._codes, categories = pd.factorize(stats["product_category_name"].astype(str), sort=True)
+        self.categories = list(categories)
+        self._category_codes = {category: code for code, category in enumerate(self.categories)}
+
+        # Best first: score, then review count, then product ID
+        ids = pd.factorize(stats["product_id"].astype(str), sort=True)[0]
+        keys = (ids, -self._counts, -stats["score"].to_numpy())
+        self._overall = np.lexsort(keys)
+        self._by_category = np.lexsort(keys + (self._codes,))
+
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.stats)
+
+    def _index(self, min_reviews):
+        """``(overall, by_category, bounds)`` positions of the products with at least ``min_reviews`` reviews."""
+        with self._lock:
+            if min_reviews in self._indexes:
+                self._indexes.move_to_end(min_reviews)
+                return self._indexes[min_reviews]
+        overall, by_category = self._overall, self._by_category
+        if min_reviews > 1:
+            overall = overall[self._counts[overall] >= min_reviews]
+            by_category = by_category[self._counts[by_category] >= min_reviews]
+        bounds = np.searchsorted(self._codes[by_category], np.arange(len(self.categories) + 1))
+        index = (overall, by_category, bounds)
+        with self._lock:
+            self._indexes[min_reviews] = index
+            while len(self._indexes) > _THRESHOLDS:
+                self._indexes.popitem(last=False)
+        return index
+
+    def _ranked(self, category, min_reviews):
+        overall, by_category, bounds = self._index(min_reviews)
+        if category is None:
+            return overall
+        code = self._category_codes.get(category)
+        if code is None:
+            return overall[:0]
+        return by_category[bounds[code]:bounds[code + 1]]
+
+    def top(self, k=5, category=None, min_reviews=1, bottom=False):
+        """The ``k`` best-scored products of ``category`` (all when None) with at least ``min_reviews`` reviews.
+
+        With ``bottom``, the ``k`` worst-scored, worst first.
+        """
+        ranked = self._ranked(category, min_reviews)
+        positions = ranked[::-1][:k] if bottom else ranked[:k]
+        return self.stats.iloc[positions].reset_index(drop=True)
+
+    def top_per_category(self, k=1, min_reviews=1, bottom=False):
+        """``top`` of every category, categories in name order; those without a qualifying product are left out."""
+        tops = [self.top(k, category, min_reviews, bottom) for category in self.categories]
+        return pd.concat(tops, ignore_index=True) if tops else self.stats.iloc[:0]
+
+
+def main(argv=None):
+    import metrics
+    from star_schema import load_star
+
+    parser = argparse.ArgumentParser(description="Rank products by their Bayesian-adjusted review score.")
+    parser.add_argument("--category", help="product category (default: all)")
+    parser.add_argument("--min-reviews", type=int, default=1)
+    parser.add_argument("--bottom", action="store_true", help="worst-rated first")
+    parser.add_argument("--top", type=int, default=10, help="products shown")
+    args = parser.parse_args(argv)
+
+    ranking = ProductRanking(product_stats(metrics.product_rating(load_star())))
+    with pd.option_context("display.width", 160):
+        print(ranking.top(args.top, args.category, args.min_reviews, args.bottom).to_string(index=False))
+    print(f"{len(ranking):,} reviewed products in {len(ranking.categories)} categories")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Rebuild derived data in the background when the data changes, and swap it in without blocking.
+
+Replacing ``main_data.csv``, the ``main_data/`` dataset or the ``star/``
+tables (as ``pipeline.py`` does) used to stall the first render after it:
+that render re-read the data and rebuilt the shared star export in the
+server process while its user waited. ``start`` runs a refresher thread
+instead, which
+
+1. watches the data directory with watchdog, and waits until writes to the
+   sources have settled (``DEBOUNCE`` seconds without one);
+2. rebuilds what has gone stale in a separate process (``rebuild``, run as
+   ``python dashboard/refresh.py --rebuild``): the shared star export (see
+   ``shared.py``) and, where they have been built before, the rollups,
+   customer segments, delivery tables and SQLite database. The server keeps
+   its GIL and memory to itself while this runs;
+3. opens the new version, which only memory-maps the export and reads the
+   small rollups, and pins it with ``analytics.dataset.pin`` in one
+   assignment.
+
+While datasets are pinned, ``open_dataset`` returns them without checking
+the files. A render keeps the dataset it opened, so renders in flight
+finish on the old version and the next ones get the new version; none waits
+for a rebuild. A failed rebuild is reported on stderr and the old version
+stays pinned until the next change. Set ``DASHBOARD_REFRESH=0`` to turn the
+refresher off: every render then checks the files, as before.
+
+Usage:
+    python dashboard/refresh.py [--rebuild]
+
+Without ``--rebuild`` it watches in the foreground and rebuilds on every
+change, for deployments that start a process per request.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+import analytics
+import delivery
+import rollups
+import segments
+import sql_backend
+from analytics.dataset import pin
+from data_loader import DATA_DIR, MAIN_DATA_CSV, MAIN_DATA_DIR
+from shared import version_dir
+from star_schema import STAR_DIR, load_star, star_key
+
+# Paths whose changes trigger a rebuild (directories with everything under them)
+SOURCES = [MAIN_DATA_CSV, MAIN_DATA_DIR, STAR_DIR]
+# Seconds without a change to the sources before rebuilding
+DEBOUNCE = 2.0
+
+# Reads cause these, the rebuild's own included
+_READ_EVENTS = {"opened", "closed_no_write"}
+
+_start_lock = threading.Lock()
+_refresher = None
+
+
+def is_source(path):
+    """Whether ``path`` is one of ``SOURCES`` or inside one."""
+    path = os.path.abspath(os.fsdecode(path))
+    return any(path == source or path.startswith(source + os.sep) for source in SOURCES)
+
+
+def rebuild():
+    """Bring the derived data up to date with the sources; return the names of what was rebuilt.
+
+    The rollups, segments, delivery tables and database are only rebuilt
+    where they exist, so a deployment that never built them does not start
+    doing so.
+    """
+    built = []
+    if not os.path.isdir(version_dir(star_key())):
+        built.append("star")
+    star = load_star()
+    if os.path.isdir(rollups.ROLLUPS_DIR) and rollups.load_rollups() is None:
+        rollups.write_rollups(rollups.build_rollups(star), source=rollups.star_source())
+        built.append("rollups")
+    if os.path.isdir(segments.SEGMENTS_DIR) and segments.load_segments() is None:
+        segments.write_segments(segments.build_segments(star))
+        built.append("segments")
+    if os.path.isdir(delivery.DELIVERY_DIR) and delivery.load_delivery() is None:
+        delivery.write_delivery(delivery.build_delivery(star))
+        built.append("delivery")
+    if os.path.exists(sql_backend.DB_PATH) and sql_backend.load_database() is None:
+        sql_backend.build_database()
+        built.append("sqlite")
+    return built
+
+
+class _SourceChanges(FileSystemEventHandler):
+    """Sets ``changed`` on every write to the sources."""
+
+    def __init__(self, changed):
+        self.changed = changed
+
+    def on_any_event(self, event):
+        if event.event_type in _READ_EVENTS:
+            return
+        if any(path and is_source(path) for path in [event.src_path, getattr(event, "dest_path", "")]):
+            self.changed.set()
+
+
+class Refresher:
+    """Keeps the datasets of ``backends`` pinned to the current data; see the module docstring."""
+
+    def __init__(self, backends):
+        self.backends = backends
+        self.versions = None
+        self.changed = threading.Event()
+        self.observer = None
+        # (seconds, names rebuilt) of each swap, and the stderr of the last failed rebuild
+        self.swaps = []
+        self.error = None
+
+    def pin_current(self):
+        """Open the datasets from the files and pin them; return whether a version changed."""
+        datasets = {}
+        for backend in self.backends:
+            try:
+                datasets[backend] = analytics.open_dataset(backend, pinned=False)
+            except FileNotFoundError:
+                # Not built for this data (yet): left to open_dataset to report
+                pass
+        versions = {backend: dataset.version for backend, dataset in datasets.items()}
+        if versions == self.versions:
+            return False
+        pin(datasets)
+        self.versions = versions
+        return True
+
+    def watch(self):
+        """Start watching the sources; return False (and unpin) if the platform cannot."""
+        self.observer = Observer()
+        self.observer.schedule(_SourceChanges(self.changed), DATA_DIR, recursive=True)
+        self.observer.daemon = True
+        try:
+            self.observer.start()
+        except OSError:
+            # Out of inotify watches, say: without events the pinned data would go stale
+            pin({})
+            return False
+        return True
+
+    def wait_for_change(self):
+        """Block until the sources change and then go ``DEBOUNCE`` seconds without a change."""
+        self.changed.wait()
+        while self.changed.wait(DEBOUNCE):
+            self.changed.clear()
+        self.changed.clear()
+
+    def refresh(self):
+        """Rebuild in a separate process and pin the result; return whether a version changed."""
+        start = time.perf_counter()
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                                        os.environ.get("PYTHONPATH")])))
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), "--rebuild"],
+                                capture_output=True, text=True, env=env)
+        if result.returncode:
+            self.error = result.stderr
+            print(f"Data refresh failed; still serving the previous version:\n{result.stderr}", file=sys.stderr)
+            return False
+        self.error = None
+        if not self.pin_current():
+            return False
+        built = result.stdout.strip().splitlines()[-1].split() if result.stdout.strip() else []
+        self.swaps.append((time.perf_counter() - start, built))
+        return True
+
+    def run(self):
+        self.pin_current()
+        if not self.watch():
+            return
+        while True:
+            self.wait_for_change()
+            self.refresh()
+
+
+def start(backends=None):
+    """Start the refresher on a daemon thread unless this process already did; return it.
+
+    Pins the ``DASHBOARD_BACKEND`` dataset by default, and the star schema
+    that global filters and the star-only charts open whatever the backend
+    (see ``analytics.charts``), so no render opens either from the files.
+    Returns None when ``DASHBOARD_REFRESH=0``.
+    """
+    global _refresher
+    if os.environ.get("DASHBOARD_REFRESH", "1") == "0":
+        return None
+    with _start_lock:
+        if _refresher is None:
+            backends = backends or list(dict.fromkeys([os.environ.get("DASHBOARD_BACKEND", "auto"), "star"]))
+            _refresher = Refresher(backends)
+            threading.Thread(target=_refresher.run, name="dashboard-refresh", daemon=True).start()
+    return _refresher
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the dashboard's derived data when its sources change.")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild what is stale once and exit")
+    args = parser.parse_args(argv)
+
+    if args.rebuild:
+        # The last line lists what was rebuilt, for the refresher that started this process
+        print(" ".join(rebuild()))
+        return
+
+    # In the foreground: rebuild here, for processes that start later to find
+    refresher = Refresher([])
+    if not refresher.watch():
+        sys.exit("Cannot watch the data directory")
+    print(f"Watching {', '.join(SOURCES)}")
+    while True:
+        refresher.wait_for_change()
+        start = time.perf_counter()
+        built = rebuild()
+        print(f"Rebuilt {', '.join(built) or 'nothing'} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+"""Pre-aggregated rollups that answer every dashboard chart.
+
+Instead of aggregating the star schema on every render, the pipeline
+materializes small additive aggregates once per dataset version:
+
+* measure rollups: order counts, payment and item totals and ``review_score``
+  sum and count, grouped by (year, month) plus one chart dimension: category,
+  city, product, payment type, review score, purchase hour, weekday or
+  delivery status. Each measure is taken from the fact at its own grain (see
+  ``metrics.py``). Distinct orders per payment type or review score are
+  measures too: an order belongs to a single month, so its distinct counts
+  per month add up to those of any year;
+* the distinct customer set: deduplicated (year, month, city, customer)
+  tuples, since a customer can order in several months and distinct customer
+  counts must stay exact for any year selection. It has a row per customer
+  and month, the one rollup that grows with the data rather than with the
+  number of chart values.
+
+Each query function below has the same name and result as its counterpart in
+``metrics.py``; ``verify`` checks that.
+
+Both kinds of rollup merge exactly: measures (including the sum and count
+behind every mean) add up and distinct sets union. ``write_rollups_chunked``
+uses that to build the rollups of a merged dataset larger than memory, one
+chunk of whole orders at a time, instead of loading the star schema.
+Every rollup is keyed by purchase month, so ``update_rollups`` can replace
+the months an incremental build touched with rollups of just their orders.
+
+Usage:
+    python dashboard/rollups.py [--verify] [--chunked [--chunk-rows N]]
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import instrument
+import metrics
+from features import DAY_ORDER, order_features, time_of_day
+from data_loader import (
+    DATA_DIR, cached, default_source, iter_main_data, read_main_data, replace_directory, source_key,
+    source_signature,
+)
+from star_schema import STAR_DIR, load_star, prepare_star, star_columns, star_from_merged
+
+ROLLUPS_DIR = os.path.join(DATA_DIR, "rollups")
+# Bumped whenever the rollup layout or a measure's definition changes
+ROLLUPS_VERSION = 4
+
+# Measure rollups: name -> grouping columns
+ROLLUPS = {
+    "by_month": ["year", "month"],
+    "by_category": ["year", "month", "product_category_name"],
+    "by_city": ["year", "month", "customer_city"],
+    "by_product": ["year", "month", "product_id", "product_category_name"],
+    "by_payment_type": ["year", "month", "payment_type"],
+    "by_review_score": ["year", "month", "review_score"],
+    "by_hour": ["year", "month", "hour"],
+    "by_weekday": ["year", "month", "weekday"],
+    "by_delivery_status": ["year", "month", "delivery_status"],
+}
+
+# Distinct sets: name -> columns whose unique combinations are kept
+DISTINCT_SETS = {
+    # Customers without a city are kept, for the overall customer count
+    "customers": ["year", "month", "customer_city", "customer_id"],
+}
+
+ORDERS = {"orders": ("order_id", "size")}
+DISTINCT_ORDERS = {"orders": ("order_id", "nunique")}
+PAYMENTS = {"payment_value": ("payment_value", "sum")}
+REVIEWS = {"review_score_sum": ("review_score", "sum"), "review_score_count": ("review_score", "count")}
+
+
+def _order_dimensions(star):
+    orders = star["orders"]
+    purchase = orders["order_purchase_timestamp"]
+    features = order_features(orders)
+    return pd.DataFrame({
+        "order_id": orders["order_id"],
+        "customer_id": orders["customer_id"],
+        "customer_city": metrics.order_customers(star, orders)["customer_city"].to_numpy(),
+        "year": purchase.dt.year,
+        "month": purchase.dt.month,
+        "hour": features["hour"],
+        "weekday": features["weekday"],
+        "delivery_status": features["delivery_status"],
+    })
+
+
+def _rollup(keys, *parts):
+    """Outer-join the ``(frame, measures)`` aggregates of ``parts`` on ``keys``."""
+    aggregates = [frame.groupby(keys, observed=True).agg(**measures) for frame, measures in parts]
+    return pd.concat(aggregates, axis=1).fillna(0).reset_index()
+
+
+def build_rollups(star):
+    """Aggregate the star schema into a dict of rollup frames."""
+    dims = _order_dimensions(star)
+    with_dims = lambda fact: fact.merge(dims, on="order_id")
+    payments = with_dims(star["payments"])
+    items = with_dims(star["items"][["order_id"]])
+    reviews = with_dims(star["reviews"])
+    sales = with_dims(metrics.item_sales(star)[["order_id", "product_category_name", "payment_value"]])
+    item_reviews = with_dims(metrics.item_reviews(star))
+
+    rollups = {
+        "by_month": _rollup(ROLLUPS["by_month"], (dims, ORDERS), (payments, PAYMENTS)),
+        "by_category": _rollup(ROLLUPS["by_category"], (sales, PAYMENTS), (item_reviews, REVIEWS)),
+        "by_city": _rollup(ROLLUPS["by_city"], (payments, PAYMENTS), (items, {"items": ("order_id", "size")})),
+        "by_product": _rollup(ROLLUPS["by_product"], (item_reviews, REVIEWS)),
+        "by_payment_type": _rollup(ROLLUPS["by_payment_type"], (payments, DISTINCT_ORDERS)),
+        "by_review_score": _rollup(ROLLUPS["by_review_score"], (reviews, DISTINCT_ORDERS)),
+        "by_hour": _rollup(ROLLUPS["by_hour"], (dims, ORDERS), (reviews, REVIEWS)),
+        "by_weekday": _rollup(ROLLUPS["by_weekday"], (dims, ORDERS)),
+        "by_delivery_status": _rollup(ROLLUPS["by_delivery_status"], (dims, ORDERS)),
+    }
+    for name, columns in DISTINCT_SETS.items():
+        rollups[name] = _distinct(dims[columns])
+    return rollups
+
+
+def _distinct(frame):
+    # Missing values are only allowed in the middle columns (a customer's city)
+    return frame.dropna(subset=[frame.columns[0], frame.columns[1], frame.columns[-1]]).drop_duplicates(
+        ignore_index=True)
+
+
+def merge_rollups(parts):
+    """Combine rollups built from disjoint sets of orders into the rollups of all of them."""
+    merged = _merge_measures(parts)
+    for name in DISTINCT_SETS:
+        merged[name] = pd.concat([part[name] for part in parts], ignore_index=True).drop_duplicates(ignore_index=True)
+    return merged
+
+
+def _merge_measures(parts):
+    merged = {}
+    for name, keys in ROLLUPS.items():
+        frame = pd.concat([part[name] for part in parts], ignore_index=True)
+        merged[name] = frame.groupby(keys, observed=True, sort=False).sum().reset_index()
+    return merged
+
+
+def _order_chunks(frames):
+    """Regroup ``frames`` so that no order is split between two chunks.
+
+    The merged table holds each order's rows next to each other (the merge
+    left-joins everything onto the orders), so only the last order of a
+    frame can continue in the next one; its rows are carried over.
+    """
+    carry = None
+    for frame in frames:
+        if carry is not None:
+            frame = pd.concat([carry, frame], ignore_index=True)
+        order_ids = frame["order_id"].to_numpy()
+        others = np.flatnonzero(order_ids != order_ids[-1]) if len(frame) else []
+        end = others[-1] + 1 if len(others) else 0
+        if end:
+            yield frame.iloc[:end]
+        carry = frame.iloc[end:]
+    if carry is not None and len(carry):
+        yield carry
+
+
+def _set_schema(name):
+    return pa.schema([(column, pa.int32() if column in ("year", "month") else pa.string())
+                      for column in DISTINCT_SETS[name]])
+
+
+def _spill(frame, root, chunk):
+    """Append one chunk's distinct set to the spill at ``root``, partitioned by month."""
+    frame = frame.astype({"year": "int32", "month": "int32"})
+    table = pa.Table.from_pandas(frame, schema=_set_schema(os.path.basename(root)), preserve_index=False)
+    pq.write_to_dataset(table, root, partition_cols=["year", "month"], basename_template=f"chunk-{chunk}-{{i}}.parquet")
+
+
+def _spilled(root):
+    """The distinct set spilled at ``root``, deduplicated and yielded one month at a time."""
+    columns = DISTINCT_SETS[os.path.basename(root)]
+    if not os.path.isdir(root):
+        return
+    for year_dir in sorted(os.listdir(root)):
+        for month_dir in sorted(os.listdir(os.path.join(root, year_dir))):
+            frame = pq.read_table(os.path.join(root, year_dir, month_dir)).to_pandas()
+            frame = frame.assign(year=int(year_dir.split("=")[1]), month=int(month_dir.split("=")[1]))
+            yield frame[columns].drop_duplicates(ignore_index=True)
+
+
+def write_rollups_chunked(source=None, root=ROLLUPS_DIR, chunk_rows=1_000_000, merge_every=8):
+    """Build the rollups of the merged dataset at ``source`` in bounded memory and write them to ``root``.
+
+    The data is read ``chunk_rows`` rows at a time; each chunk of whole orders
+    is turned into a star schema and rolled up. The measure rollups are small
+    and merged in memory every ``merge_every`` chunks. The distinct customer
+    set is as large as the data, so each chunk's part of it is spilled next
+    to ``root`` partitioned by month, then deduplicated and written one month
+    at a time (a (year, month, ...) tuple can only repeat within its month).
+    Memory holds one chunk, the measure rollups and one month of the customer
+    set. The result equals ``build_rollups`` of the whole star.
+    """
+    source = source or default_source()
+    spill_root = f"{root}.{os.getpid()}.spill"
+    shutil.rmtree(spill_root, ignore_errors=True)
+    try:
+        parts = []
+        for chunk, frame in enumerate(_order_chunks(iter_main_data(source, star_columns(), chunk_rows))):
+            rollups = build_rollups(star_from_merged(frame))
+            for name in DISTINCT_SETS:
+                _spill(rollups.pop(name), os.path.join(spill_root, name), chunk)
+            parts.append(rollups)
+            if len(parts) > merge_every:
+                parts = [_merge_measures(parts)]
+        rollups = _merge_measures(parts)
+        rollups.update({name: _spilled(os.path.join(spill_root, name)) for name in DISTINCT_SETS})
+        write_rollups(rollups, root, source)
+    finally:
+        shutil.rmtree(spill_root, ignore_errors=True)
+
+
+def write_rollups(rollups, root=ROLLUPS_DIR, source=STAR_DIR):
+    """Write ``rollups`` to ``root`` tagged with the signature of ``source``.
+
+    A distinct set may also be given as an iterable of frames, which are
+    written one after another.
+    """
+    def write(tmp_root):
+        for name, frame in rollups.items():
+            path = os.path.join(tmp_root, f"{name}.parquet")
+            if isinstance(frame, pd.DataFrame):
+                frame.to_parquet(path, index=False)
+                continue
+            schema = _set_schema(name)
+            with pq.ParquetWriter(path, schema) as writer:
+                for part in frame:
+                    writer.write_table(pa.Table.from_pandas(part, schema=schema, preserve_index=False))
+        with open(os.path.join(tmp_root, "_source.json"), "w") as f:
+            json.dump(_built_from(source), f)
+
+    replace_directory(root, write)
+
+
+def update_rollups(rollups, months, replacement, root=ROLLUPS_DIR, source=STAR_DIR):
+    """Write ``rollups`` with the rows of ``months`` replaced by those of ``replacement``.
+
+    ``months`` are (year, month) pairs and ``replacement`` holds the rollups
+    of every order purchased in them (and of no other order), so the result
+    equals the rollups of the updated data.
+    """
+    months = pd.MultiIndex.from_tuples([(int(year), int(month)) for year, month in months], names=["year", "month"])
+    updated = {}
+    for name, frame in rollups.items():
+        kept = frame[~pd.MultiIndex.from_frame(frame[["year", "month"]]).isin(months)]
+        updated[name] = pd.concat([kept, replacement[name]], ignore_index=True)
+    write_rollups(updated, root, source)
+
+
+def _built_from(source):
+    return {"version": ROLLUPS_VERSION, "source": source_signature(source)}
+
+
+def star_source():
+    """Return what ``load_star`` reads: the star tables, or the merged dataset."""
+    return STAR_DIR if os.path.isdir(STAR_DIR) else default_source()
+
+
+def _read_rollups(root):
+    return {name: pd.read_parquet(os.path.join(root, f"{name}.parquet")) for name in list(ROLLUPS) + list(DISTINCT_SETS)}
+
+
+def load_rollups(root=ROLLUPS_DIR, source=None):
+    """Return the materialized rollups, or None if missing or stale.
+
+    Rollups are stale when the data they were built from no longer matches
+    ``source`` or they were written by an older ``ROLLUPS_VERSION``. By
+    default ``source`` is the data ``load_star`` reads, or the merged dataset
+    for rollups built from it in chunks (``write_rollups_chunked``).
+    """
+    try:
+        with open(os.path.join(root, "_source.json")) as f:
+            built_from = json.load(f)
+    except FileNotFoundError:
+        return None
+    sources = [source] if source else dict.fromkeys([star_source(), default_source()])
+    if all(built_from != _built_from(path) for path in sources):
+        return None
+    return cached(source_key(root), lambda: _read_rollups(root))
+
+
+def _for_year(frame, year):
+    with instrument.stage("filter") as stage:
+        stage["rows_scanned"] = len(frame)
+        return frame if year is None else frame[frame["year"] == int(year)]
+
+
+def years(rollups):
+    """Purchase years present in the data, for the year filter."""
+    return sorted(int(year) for year in rollups["by_month"].loc[rollups["by_month"]["orders"] > 0, "year"].unique())
+
+
+def _mean(frame, key, name):
+    sums = frame.groupby(key, observed=True)[["review_score_sum", "review_score_count"]].sum()
+    sums = sums[sums["review_score_count"] > 0]
+    return (sums["review_score_sum"] / sums["review_score_count"]).rename(name)
+
+
+def monthly_orders(rollups, year=None):
+    """Number of orders per month, indexed by month end like ``resample('ME')``."""
+    by_month = _for_year(rollups["by_month"], year)
+    by_month = by_month[by_month["orders"] > 0]
+    counts = pd.Series(
+        by_month["orders"].to_numpy(),
+        index=pd.to_datetime(dict(year=by_month["year"], month=by_month["month"], day=1)) + pd.offsets.MonthEnd(0),
+    ).sort_index()
+    if counts.empty:
+        return counts.astype("int64")
+    months = pd.date_range(counts.index[0], counts.index[-1], freq="ME")
+    return counts.reindex(months, fill_value=0).astype("int64")
+
+
+def category_sales(rollups, year=None):
+    by_category = _for_year(rollups["by_category"], year)
+    return (
+        by_category.groupby("product_category_name", observed=True)["payment_value"].sum().reset_index()
+        .sort_values(by="payment_value", ascending=False)
+    )
+
+
+def category_rating(rollups, year=None):
+    rating = _mean(_for_year(rollups["by_category"], year), "product_category_name", "review_score")
+    return rating.reset_index().sort_values(by="review_score", ascending=False)
+
+
+def product_rating(rollups):
+    by_product = rollups["by_product"].groupby(["product_id", "product_category_name"], observed=True)[
+        ["review_score_sum", "review_score_count"]].sum().reset_index()
+    by_product = by_product[by_product["review_score_count"] > 0]
+    return by_product[["product_id", "product_category_name"]].assign(
+        review_score=by_product["review_score_sum"] / by_product["review_score_count"],
+        review_count=by_product["review_score_count"],
+    )
+
+
+def rating_distribution(rollups, year=None):
+    orders = _for_year(rollups["by_review_score"], year)
+    rating_dist_df = orders.groupby("review_score", observed=True)["orders"].sum().reset_index()
+    rating_dist_df.columns = ['Review Score', 'Order Count']
+    return rating_dist_df
+
+
+def city_customers(rollups, year=None):
+    customers = _for_year(rollups["customers"], year)
+    city_df = customers.groupby("customer_city", observed=True)["customer_id"].nunique().reset_index()
+    city_df.columns = ['City', 'Customer Count']
+    return city_df.sort_values(by='Customer Count', ascending=False)
+
+
+def payment_segments(rollups, year=None):
+    orders = _for_year(rollups["by_payment_type"], year)
+    payment_method_df = orders.groupby("payment_type", observed=True)["orders"].sum().reset_index()
+    payment_method_df.columns = ['Payment Type', 'Purchase Count']
+    return payment_method_df
+
+
+def average_spend(rollups, year=None):
+    """Mean total payments per customer; customers without payments count as 0."""
+    total = _for_year(rollups["by_month"], year)["payment_value"].sum()
+    customers = _for_year(rollups["customers"], year)["customer_id"].nunique()
+    return total / customers if customers else np.nan
+
+
+def delivery_status_counts(rollups, year=None):
+    by_status = _for_year(rollups["by_delivery_status"], year)
+    counts = by_status.groupby("delivery_status", observed=True)["orders"].sum()
+    return counts[counts > 0].astype("int64").sort_values(ascending=False).rename("count")
+
+
+def hour_rating(rollups, year=None):
+    rating = _mean(_for_year(rollups["by_hour"], year), "hour", "review_score")
+    return rating.rename_axis("hour_of_purchase").reset_index()
+
+
+def time_of_day_counts(rollups, year=None):
+    by_hour = _for_year(rollups["by_hour"], year)
+    counts = by_hour.groupby(time_of_day(by_hour["hour"]), observed=True)["orders"].sum()
+    counts = counts[counts > 0].astype("int64").sort_values(ascending=False)
+    return counts.rename("count").rename_axis("purchase_time_of_day")
+
+
+def weekday_counts(rollups, year=None):
+    by_weekday = _for_year(rollups["by_weekday"], year)
+    counts = by_weekday.groupby("weekday")["orders"].sum()
+    counts = counts[counts > 0]
+    day_of_week_sales = pd.DataFrame({
+        "day_of_week": pd.Categorical([DAY_ORDER[day] for day in counts.index],
+                                      categories=DAY_ORDER, ordered=True),
+        "order_id": counts.to_numpy().astype("int64"),
+    })
+    return day_of_week_sales.sort_values('day_of_week')
+
+
+def city_sales(rollups, year=None):
+    by_city = _for_year(rollups["by_city"], year)
+    city_sales_df = by_city.groupby("customer_city", observed=True)[["payment_value", "items"]].sum().reset_index()
+    city_sales_df.columns = ['City', 'Total Sales', 'Product Sold']
+    city_sales_df['Product Sold'] = city_sales_df['Product Sold'].astype('int64')
+    return city_sales_df.sort_values(by='Total Sales', ascending=False)
+
+
+def verify(star, rollups, years=None):
+    """Check every rollup query against the star-schema metric of the same name.
+
+    Returns a list of ``(query, year)`` pairs that did not match.
+    """
+    return metrics.compare(star, lambda name, *args: globals()[name](rollups, *args), years)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Materialize the dashboard rollups from the star schema.")
+    parser.add_argument("--output-dir", default=ROLLUPS_DIR)
+    parser.add_argument("--verify", action="store_true", help="check every rollup query against metrics.py")
+    parser.add_argument("--chunked", action="store_true",
+                        help="build from the merged dataset in chunks, for data larger than memory")
+    parser.add_argument("--chunk-rows", type=int, default=1_000_000, help="rows read per chunk with --chunked")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.chunked:
+        write_rollups_chunked(default_source(), args.output_dir, args.chunk_rows)
+        rollups = _read_rollups(args.output_dir)
+        built_from = f"{default_source()} in chunks of {args.chunk_rows:,} rows"
+    else:
+        star = load_star()
+        rollups = build_rollups(star)
+        write_rollups(rollups, args.output_dir, star_source())
+        built_from = f"{len(star['orders']):,} orders"
+    sizes = ", ".join(f"{name}={len(frame):,}" for name, frame in rollups.items())
+    print(f"Built rollups from {built_from} in {time.perf_counter() - start:.1f}s ({sizes})")
+
+    if args.verify:
+        if args.chunked:
+            # The in-memory path over the same merged data
+            star = prepare_star(star_from_merged(read_main_data(default_source(), star_columns())))
+        mismatches = verify(star, rollups)
+        for name, year in mismatches:
+            print(f"MISMATCH {name} year={year}")
+        if mismatches:
+            raise SystemExit(1)
+        print("All rollup queries match metrics.py")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Customer segments: RFM scores and monthly acquisition cohorts.
+
+Olist issues a new ``customer_id`` with every order, so counting on it makes
+every customer a one-time buyer. Here a customer is a
+``customer_unique_id``.
+
+``build_segments`` works in one pass over the orders:
+
+1. each order gets its customer (an array lookup on the shared ID codes,
+   see ``compact.dimension_codes``) and its value, the sum of its payments;
+2. one stable sort of the orders by customer. The orders fact is in purchase
+   order already, so each customer's orders come out as one contiguous run,
+   oldest first;
+3. segmented reductions over the runs: the first and last order of a run
+   are the customer's first and last purchase, its length their frequency,
+   its ``np.add.reduceat`` sum their spend. The distinct months a customer
+   ordered in are the run's month changes, counted per (acquisition month,
+   months since) cohort cell with one ``np.bincount``.
+
+Recency counts days from a customer's last purchase to the last purchase in
+the data. R and M scores are quintiles (5 is the most recent or the highest
+spend; equal values share a score). F is the number of orders capped at 5:
+most customers order once, so frequency quintiles would collapse. Segments
+follow the usual R x F grid (``SEGMENT_GRID``).
+
+The pipeline materializes the results to ``dashboard/segments/`` tagged
+with the data they were built from, like the rollups; ``load_segments``
+returns None when they are missing or stale, and the analytics package then
+computes them from the star schema (as it always does under global filters).
+
+Usage:
+    python dashboard/segments.py [--output-dir DIR] [--verify]
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from compact import dimension_codes
+from data_loader import DATA_DIR, cached, replace_directory, source_key, source_signature
+from metrics import fact_orders, period_slice, select
+
+SEGMENTS_DIR = os.path.join(DATA_DIR, "segments")
+# Bumped whenever a table's layout or a score's definition changes
+SEGMENTS_VERSION = 1
+
+SEGMENTS = ["Champions", "Loyal customers", "Potential loyalists", "New customers", "Promising", "Need attention",
+            "About to sleep", "At risk", "Can't lose", "Hibernating"]
+# Segment (index into SEGMENTS) of each R score (rows, 1-5) and F score (columns, 1-5)
+SEGMENT_GRID = np.array([
+    [9, 9, 7, 7, 8],
+    [9, 9, 7, 7, 8],
+    [6, 6, 5, 1, 1],
+    [4, 2, 2, 1, 1],
+    [3, 2, 2, 0, 0],
+])
+
+# Tables the dashboard reads; ``customers`` (one row per customer) is written for export
+TABLES = ["segments", "cohorts"]
+
+_DAY = np.timedelta64(1, "D")
+
+
+def _quintiles(values):
+    """Score 1-5 of each value by percentile rank; equal values share a score."""
+    if not len(values):
+        return np.zeros(0, dtype=np.int8)
+    ranks = pd.Series(values).rank(method="average", pct=True).to_numpy()
+    return np.clip(np.ceil(ranks * 5), 1, 5).astype(np.int8)
+
+
+def customer_runs(star, period=slice(None)):
+    """Orders of ``period`` sorted by customer, then purchase time.
+
+    Returns ``(customers, starts, purchases, values)``: the customer (index
+    into the ``customer_unique_id`` categories) of each run, where each run
+    starts, and the purchase time and value of each sorted order.
+    """
+    positions = fact_orders(star, "orders", period)
+    purchases = star["orders"]["order_purchase_timestamp"].to_numpy()[positions]
+    customers, _ = dimension_codes(star, "customers", "customer_id", "customer_unique_id",
+                                   star["orders"]["customer_id"].cat.codes.to_numpy()[positions])
+
+    # Order values over the whole orders fact, indexed by position
+    payment_positions = fact_orders(star, "payments", period)
+    payment_values = select(star, "payments", period)["payment_value"].to_numpy()
+    valid = payment_positions >= 0
+    order_values = np.bincount(payment_positions[valid], weights=payment_values[valid],
+                               minlength=len(star["orders"]))[positions]
+
+    keep = (customers >= 0) & ~np.isnat(purchases)
+    customers, purchases, order_values = customers[keep], purchases[keep], order_values[keep]
+    # Stable, so each customer's orders stay in purchase order
+    order = np.argsort(customers, kind="stable")
+    customers, purchases, order_values = customers[order], purchases[order], order_values[order]
+    starts = np.flatnonzero(np.diff(customers, prepend=-1) != 0)
+    return customers[starts], starts, purchases, order_values
+
+
+def build_segments(star, year=None):
+    """RFM scores and segments of every customer, their summary per segment, and the cohorts.
+
+    Returns ``{"customers", "segments", "cohorts"}``: one row per customer
+    (``customer_unique_id``, recency in days, frequency, monetary, the R, F
+    and M scores, segment and cohort month), one row per segment with its
+    customers, share and mean recency, frequency and monetary, and the
+    active customers per (``cohort``, ``months_since``) acquisition cohort
+    cell. ``year`` is a purchase year, date range or ``filters.Filters``.
+    """
+    customers, starts, purchases, order_values = customer_runs(star, period_slice(star, year))
+    # Without orders (a filter that matches none, say) every table is empty
+    ends = np.append(starts[1:], len(purchases)) if len(starts) else starts
+    frequency = ends - starts
+    first, last = purchases[starts], purchases[ends - 1]
+    monetary = np.add.reduceat(order_values, starts) if len(starts) else np.zeros(0)
+    recency = (purchases.max() - last) / _DAY if len(purchases) else np.zeros(0)
+
+    r_score = _quintiles(-recency)
+    f_score = np.minimum(frequency, 5).astype(np.int8)
+    m_score = _quintiles(monetary)
+    segment = SEGMENT_GRID[r_score - 1, f_score - 1] if len(starts) else np.zeros(0, dtype=np.int64)
+    unique_ids = star["customers"]["customer_unique_id"].cat.categories
+    table = pd.DataFrame({
+        "customer_unique_id": unique_ids[customers],
+        "recency": recency,
+        "frequency": frequency,
+        "monetary": monetary,
+        "r_score": r_score,
+        "f_score": f_score,
+        "m_score": m_score,
+        "segment": pd.Categorical.from_codes(segment, SEGMENTS),
+        "cohort": first.astype("datetime64[M]").astype("datetime64[ns]"),
+    })
+
+    count = len(SEGMENTS)
+    per_segment = np.bincount(segment, minlength=count)
+    # Float even without customers, when bincount gives integers
+    revenue = np.bincount(segment, weights=monetary, minlength=count).astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        summary = pd.DataFrame({
+            "Segment": SEGMENTS,
+            "Customers": per_segment,
+            "Share %": (100 * per_segment / max(len(starts), 1)).round(1),
+            "Recency (days)": (np.bincount(segment, weights=recency, minlength=count) / per_segment).round(1),
+            "Orders": (np.bincount(segment, weights=frequency, minlength=count) / per_segment).round(2),
+            "Spend": (revenue / per_segment).round(2),
+            "Revenue": revenue.round(2),
+        })
+    return {"customers": table, "segments": summary[summary["Customers"] > 0].reset_index(drop=True),
+            "cohorts": _cohorts(purchases, starts, frequency)}
+
+
+def _cohorts(purchases, starts, frequency):
+    """Distinct active customers per (acquisition month, months since) from the sorted runs."""
+    months = purchases.astype("datetime64[M]").astype(np.int64)
+    if not len(months):
+        return pd.DataFrame({"cohort": pd.DatetimeIndex([]), "months_since": np.zeros(0, dtype=np.int64),
+                             "customers": np.zeros(0, dtype=np.int64)})
+    cohort = np.repeat(months[starts], frequency)
+    # One entry per customer and month: the first order of a run, or a new month within it
+    new_month = np.diff(months, prepend=months[0] - 1) != 0
+    new_month[starts] = True
+    cohort, since = cohort[new_month] - months.min(), (months - cohort)[new_month]
+    span = int(since.max()) + 1
+    counts = np.bincount(cohort * span + since)
+    cells = np.flatnonzero(counts)
+    return pd.DataFrame({
+        "cohort": (cells // span + months.min()).astype("datetime64[M]").astype("datetime64[ns]"),
+        "months_since": cells % span,
+        "customers": counts[cells],
+    })
+
+
+def retention_matrix(cohorts):
+    """Share of each cohort (rows, by acquisition month) active each month since (columns), in %."""
+    matrix = cohorts.pivot(index="cohort", columns="months_since", values="customers").sort_index()
+    if matrix.empty:
+        return matrix
+    matrix = 100 * matrix.div(matrix[0], axis=0)
+    matrix.index = matrix.index.strftime("%Y-%m")
+    return matrix.round(1)
+
+
+def write_segments(segments, root=SEGMENTS_DIR, source=None):
+    """Write the tables of ``build_segments`` to ``root`` tagged with the signature of ``source``."""
+    def write(tmp_root):
+        for name, frame in segments.items():
+            frame.to_parquet(os.path.join(tmp_root, f"{name}.parquet"), index=False)
+        with open(os.path.join(tmp_root, "_source.json"), "w") as f:
+            json.dump(_built_from(source), f)
+
+    replace_directory(root, write)
+
+
+def _built_from(source):
+    # Imported here: rollups is only needed to find the star schema's source
+    from rollups import star_source
+    return {"version": SEGMENTS_VERSION, "source": source_signature(source or star_source())}
+
+
+def _read_segments(root):
+    return {name: pd.read_parquet(os.path.join(root, f"{name}.parquet")) for name in TABLES}
+
+
+def load_segments(root=SEGMENTS_DIR, source=None):
+    """Return the materialized ``segments`` and ``cohorts`` tables, or None if missing or stale.
+
+    They are stale when the data they were built from no longer matches
+    ``source`` (defaults to the data ``load_star`` reads) or they were
+    written by an older ``SEGMENTS_VERSION``.
+    """
+    try:
+        with open(os.path.join(root, "_source.json")) as f:
+            built_from = json.load(f)
+    except FileNotFoundError:
+        return None
+    if built_from != _built_from(source):
+        return None
+    return cached(source_key(root), lambda: _read_segments(root))
+
+
+def verify(star, segments):
+    """Check that a filter selecting no orders gives the tables of ``segments``, empty.
+
+    Returns the names of the tables whose rows or columns did not match.
+    """
+    from filters import make_filters
+
+    first = star["orders"]["order_purchase_timestamp"].min()
+    empty = build_segments(star, make_filters(end=first))
+    return [name for name, frame in segments.items()
+            if len(empty[name]) or not empty[name].dtypes.equals(frame.dtypes)]
+
+
+def main(argv=None):
+    from star_schema import load_star
+
+    parser = argparse.ArgumentParser(description="Materialize customer RFM segments and acquisition cohorts.")
+    parser.add_argument("--output-dir", default=SEGMENTS_DIR)
+    parser.add_argument("--verify", action="store_true", help="check the tables of a filter that selects no orders")
+    args = parser.parse_args(argv)
+
+    star = load_star()
+    start = time.perf_counter()
+    segments = build_segments(star)
+    built = time.perf_counter() - start
+    write_segments(segments, args.output_dir)
+    customers = segments["customers"]
+    print(f"Built segments of {len(customers):,} customers from {len(star['orders']):,} orders in {built:.2f}s "
+          f"({(customers['frequency'] > 1).mean():.1%} ordered more than once)")
+    print(segments["segments"].to_string(index=False))
+
+    if args.verify:
+        mismatches = verify(star, segments)
+        for name in mismatches:
+            print(f"MISMATCH {name} with no orders")
+        if mismatches:
+            raise SystemExit(1)
+        print("Every table is empty, with the same columns, when no order is selected")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Read-only star schema shared by every session and worker process.
+
+Streamlit runs every session of a server process against the same module
+state, and ``load_star`` caches the prepared star once per process, so
+sessions only add their filters and small results. A box that runs several
+server processes would still hold one copy of the data per process.
+
+``load_shared`` therefore exports the prepared star (compacted, time-sorted,
+with order features and fact positions) once per data version as
+uncompressed Arrow IPC files, and every process memory-maps them. Numeric,
+timestamp and category-code columns come back as zero-copy views of the
+mapping, backed by the OS page cache that all processes share, and are
+read-only: a stray in-place write raises instead of corrupting other
+sessions' data.
+
+A process holds a shared lock on a version's lease file (``<version>.lease``)
+for as long as it maps that version. A new export prunes only the versions
+older than itself that nobody holds a lease on; exports still being written
+are left to the process writing them.
+"""
+import hashlib
+import os
+import weakref
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: a mapped file cannot be deleted there, so versions in use survive pruning anyway
+    fcntl = None
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from compact import ID_COLUMNS
+from data_loader import DATA_DIR, remove_directory, replace_directory
+from time_index import TimeIndex
+
+SHARED_DIR = os.path.join(DATA_DIR, "shared")
+# Bumped whenever the prepared star's layout changes
+SHARED_VERSION = 1
+
+
+def version_dir(key, root=SHARED_DIR):
+    """Directory holding the export of the data version identified by ``key``."""
+    digest = hashlib.sha1(repr((SHARED_VERSION,) + tuple(key)).encode()).hexdigest()[:16]
+    return os.path.join(root, digest)
+
+
+def _write_table(path, table):
+    with ipc.new_file(path, table.schema) as writer:
+        writer.write_table(table)
+
+
+def _read_table(path):
+    return ipc.open_file(pa.memory_map(path)).read_all()
+
+
+def export_star(star, path):
+    """Write the prepared ``star`` (see ``star_schema.load_star``) to ``path``."""
+    def write(tmp_root):
+        for name, table in star.items():
+            if isinstance(table, pd.DataFrame):
+                _write_table(os.path.join(tmp_root, f"{name}.arrow"), pa.Table.from_pandas(table, preserve_index=False))
+        for name, positions in star["time_index"].fact_positions.items():
+            _write_table(os.path.join(tmp_root, f"_positions.{name}.arrow"), pa.table({"position": positions}))
+
+    replace_directory(path, write)
+
+
+def map_star(path):
+    """Memory-map a star exported by ``export_star``."""
+    star, positions = {}, {}
+    for filename in sorted(os.listdir(path)):
+        name = filename[:-len(".arrow")]
+        table = _read_table(os.path.join(path, filename))
+        if name.startswith("_positions."):
+            positions[name[len("_positions."):]] = table.column("position").to_numpy()
+        else:
+            star[name] = table.to_pandas(split_blocks=True)
+
+    # Each table's dictionary was decoded separately; point every ID column
+    # back at one shared dtype so joins compare codes, without copying them.
+    for column in ID_COLUMNS:
+        holders = [table for table in star.values() if column in table.columns]
+        if holders:
+            dtype = holders[0][column].dtype
+            for table in holders:
+                codes = table[column].cat.codes.to_numpy()
+                table[column] = pd.Categorical.from_codes(codes, dtype=dtype, validate=False)
+
+    star["time_index"] = TimeIndex(star["orders"]["order_purchase_timestamp"].to_numpy(), positions)
+    return star
+
+
+def _lease(path):
+    """Take a shared lock on the lease of version ``path``; return its descriptor, or None if it cannot be created."""
+    try:
+        fd = os.open(f"{path}.lease", os.O_RDWR | os.O_CREAT)
+    except OSError:
+        return None
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_SH)
+    return fd
+
+
+def _unused(path):
+    """An exclusive lock on the lease of version ``path`` if no process holds one: its descriptor, else None."""
+    try:
+        fd = os.open(f"{path}.lease", os.O_RDWR | os.O_CREAT)
+    except OSError:
+        return None
+    if fcntl is not None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+    return fd
+
+
+def _prune(root, keep):
+    """Remove the versions in ``root`` older than ``keep`` that no process has leased."""
+    keep_mtime = os.stat(keep).st_mtime
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        # Hidden: the directories behind the links; ``*.tmp``/``*.link``/``*.old``: another
+        # process's ``replace_directory`` in progress
+        if (path == keep or not os.path.isdir(path) or name.startswith(".")
+                or name.endswith((".tmp", ".link", ".old"))):
+            continue
+        if os.stat(path).st_mtime >= keep_mtime:
+            continue
+        fd = _unused(path)
+        if fd is None:
+            continue
+        try:
+            remove_directory(path)
+            os.remove(f"{path}.lease")
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def load_shared(key, build, root=SHARED_DIR):
+    """Return the shared star for data version ``key``, exporting ``build()`` on a miss.
+
+    The returned star holds a lease on its version until it is garbage
+    collected. Falls back to the in-process ``build()`` result when ``root``
+    is not writable.
+    """
+    path = version_dir(key, root)
+    while True:
+        if not os.path.isdir(path):
+            star = build()
+            try:
+                os.makedirs(root, exist_ok=True)
+                export_star(star, path)
+                _prune(root, path)
+            except OSError:
+                return star
+        lease = _lease(path)
+        if os.path.isdir(path):
+            break
+        # Pruned between the check and the lease
+        if lease is not None:
+            os.close(lease)
+
+    star = map_star(path)
+    if lease is not None:
+        weakref.finalize(star["time_index"], os.close, lease)
+    return star
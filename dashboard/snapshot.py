@@ -0,0 +1,156 @@
+"""Static snapshots of every dashboard view.
+
+``export`` renders every figure, table and value the dashboard can show
+(see ``live_views.view_keys``), for every year option, in a pool of worker
+processes. Each view is written as one JSON file to
+``snapshots/<version>/``, where ``<version>`` identifies the data it was
+rendered from, and ``snapshots/LATEST`` names the newest snapshot.
+
+The dashboard serves a snapshot instead of live data when the
+``DASHBOARD_SNAPSHOT`` environment variable is set to a snapshot directory
+or to ``latest``; no pandas work happens at request time then. Serving a
+snapshot only needs this module and ``views``: the data backends are
+imported by ``export``.
+
+Usage:
+    python dashboard/snapshot.py [--output-dir DIR] [--workers N]
+"""
+import argparse
+import functools
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import instrument
+import views
+from views import CachedFigure
+
+# In ``data_loader.DATA_DIR``, which is not imported from there: data_loader loads pyarrow
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshots")
+LATEST = "LATEST"
+
+_worker_views = None
+
+
+def _filename(kind, name, params):
+    parts = [kind, name] + [str(param).replace(" ", "_") for param in params]
+    return ".".join(parts) + ".json"
+
+
+def _init_worker():
+    global _worker_views
+    import analytics
+    import live_views
+    _worker_views = live_views.LiveViews(analytics.open_dataset())
+
+
+def _render(key):
+    kind, name, params = key
+    return _filename(kind, name, params), _worker_views.render(kind, name, params)
+
+
+def export(root=SNAPSHOT_DIR, workers=None):
+    """Render every view of the current dataset into a new snapshot; return its path."""
+    import analytics
+    import live_views
+    from data_loader import replace_directory
+
+    dataset = analytics.open_dataset()
+    version = hashlib.sha1(repr(dataset.version).encode()).hexdigest()[:16]
+    keys = live_views.view_keys(analytics.years(dataset))
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+        rendered = list(pool.map(_render, keys))
+
+    def write(tmp_root):
+        for filename, payload in rendered:
+            with open(os.path.join(tmp_root, filename), "w") as f:
+                f.write(payload)
+        with open(os.path.join(tmp_root, "_manifest.json"), "w") as f:
+            json.dump({"dataset": [str(part) for part in dataset.version], "views": len(rendered),
+                       "created": time.strftime("%Y-%m-%dT%H:%M:%S%z")}, f)
+
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, version)
+    replace_directory(path, write)
+
+    tmp_latest = os.path.join(root, f"{LATEST}.{os.getpid()}.tmp")
+    with open(tmp_latest, "w") as f:
+        f.write(version)
+    os.replace(tmp_latest, os.path.join(root, LATEST))
+    return path
+
+
+def resolve(snapshot, root=SNAPSHOT_DIR):
+    """Path of ``snapshot``: a snapshot directory, or ``latest``."""
+    if snapshot != "latest":
+        return snapshot
+    with open(os.path.join(root, LATEST)) as f:
+        return os.path.join(root, f.read().strip())
+
+
+# A snapshot directory holds the views of one data version, so its files are read once
+@functools.lru_cache(maxsize=None)
+def _load(path):
+    with instrument.stage("load", os.path.basename(path)) as stage:
+        with open(path) as f:
+            payload = f.read()
+        stage["bytes"] = len(payload)
+    return payload
+
+
+def _parse(payload):
+    with instrument.stage("serialize", "parse") as stage:
+        stage["bytes"] = len(payload)
+        return json.loads(payload)
+
+
+class SnapshotViews:
+    """Views read from an exported snapshot, with the same interface as ``live_views.LiveViews``."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _read(self, kind, name, params):
+        return _load(os.path.join(self.path, _filename(kind, name, params)))
+
+    def figure(self, name, *params):
+        with instrument.view("figure", name, params):
+            payload = self._read("figure", name, params)
+            return CachedFigure(_parse(payload), payload)
+
+    def table(self, name, *params):
+        with instrument.view("table", name, params):
+            if name == "city_sales_page":
+                rows = self.table("city_sales")
+                with instrument.stage("filter", name) as stage:
+                    stage["rows_scanned"] = len(rows)
+                    return views.city_sales_page(rows, *params)
+            if name == "map_cells":
+                zoom, lat, lng = params
+                rows = self.table("map_level", zoom)
+                with instrument.stage("filter", name) as stage:
+                    stage["rows_scanned"] = len(rows)
+                    return views.map_cells(rows, zoom, lat, lng)
+            return _parse(self._read("table", name, params))
+
+    def value(self, name, *params):
+        with instrument.view("value", name, params):
+            return _parse(self._read("value", name, params))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export every dashboard view to a static snapshot.")
+    parser.add_argument("--output-dir", default=SNAPSHOT_DIR)
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    path = export(args.output_dir, args.workers)
+    print(f"Exported {len(os.listdir(path)) - 1} views to {path} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
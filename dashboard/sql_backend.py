@@ -0,0 +1,396 @@
+"""Embedded SQLite backend for the dashboard queries.
+
+``build_database`` copies the star schema (see ``star_schema.py``) into one
+SQLite file, ``dashboard/olist.sqlite``, indexed on the purchase timestamp,
+``customer_city``, ``product_category_name`` and the order key of every fact.
+Each query function below has the same name and result as its counterpart in
+``metrics.py`` but runs as SQL: only the columns a chart needs are read, and a
+year filter is a range condition on the indexed purchase timestamp, so only
+that period's orders and their facts are visited. Nothing is loaded up front
+and memory does not grow with the data (SQLite's page cache is bounded).
+
+Timestamps are stored as ISO 8601 text (``YYYY-MM-DD HH:MM:SS``), which sorts
+chronologically.
+
+Usage:
+    python dashboard/sql_backend.py [--output PATH] [--verify]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from data_loader import DATA_DIR, DATETIME_COLUMNS, default_source, read_main_data, source_signature
+from features import DAY_ORDER, TIME_OF_DAY_LABELS
+from rollups import star_source
+from star_schema import STAR_DIR, STAR_TABLES, load_star, star_columns, star_dataset, star_from_merged
+
+DB_PATH = os.path.join(DATA_DIR, "olist.sqlite")
+# Bumped whenever the table layout changes
+DB_VERSION = 1
+
+_COLUMN_TYPES = {
+    "order_item_id": "INTEGER",
+    "price": "REAL",
+    "freight_value": "REAL",
+    "payment_value": "REAL",
+    "review_score": "INTEGER",
+}
+
+INDEXES = {
+    "orders": ["order_id", "order_purchase_timestamp"],
+    "items": ["order_id"],
+    "payments": ["order_id"],
+    "reviews": ["order_id"],
+    "customers": ["customer_id", "customer_city"],
+    "products": ["product_id", "product_category_name"],
+    "sellers": ["seller_id"],
+}
+
+_BATCH_ROWS = 100_000
+
+
+def _rows(frame):
+    """Rows of ``frame`` as Python tuples, with timestamps as text and missing values as NULL."""
+    frame = frame.copy()
+    for column in frame.columns:
+        if column in DATETIME_COLUMNS:
+            frame[column] = frame[column].dt.strftime("%Y-%m-%d %H:%M:%S")
+    return frame.astype(object).where(frame.notna(), None).to_numpy().tolist()
+
+
+def _batches(name, star):
+    """Frames of star table ``name``: streamed from ``star/`` when it exists."""
+    if star is not None:
+        table = star[name]
+        for start in range(0, len(table), _BATCH_ROWS):
+            yield table.iloc[start:start + _BATCH_ROWS]
+        return
+    for batch in star_dataset(name).to_batches(batch_size=_BATCH_ROWS):
+        yield batch.to_pandas()
+
+
+def _built_from(source):
+    return json.dumps({"version": DB_VERSION, "source": source_signature(source)})
+
+
+def build_database(path=DB_PATH):
+    """Write the star schema to a new SQLite file at ``path``.
+
+    The star tables are copied a batch at a time; without them the merged
+    dataset is de-duplicated into a star schema in memory first.
+    """
+    star = None if os.path.isdir(STAR_DIR) else star_from_merged(read_main_data(default_source(), star_columns()))
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    with closing(sqlite3.connect(tmp_path)) as db:
+        for name, (columns, _) in STAR_TABLES.items():
+            definitions = ", ".join(f"{column} {_COLUMN_TYPES.get(column, 'TEXT')}" for column in columns)
+            db.execute(f"CREATE TABLE {name} ({definitions})")
+            insert = f"INSERT INTO {name} VALUES ({', '.join('?' * len(columns))})"
+            for frame in _batches(name, star):
+                db.executemany(insert, _rows(frame.reindex(columns=columns)))
+        for name, columns in INDEXES.items():
+            for column in columns:
+                db.execute(f"CREATE INDEX {name}_{column} ON {name} ({column})")
+        db.execute("CREATE TABLE _meta (built_from TEXT)")
+        db.execute("INSERT INTO _meta VALUES (?)", (_built_from(star_source()),))
+        db.commit()
+        # Table statistics for the query planner
+        db.execute("ANALYZE")
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_database(path=DB_PATH, source=None):
+    """Return ``path`` if it holds a database built from the current data, else None."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with closing(_connect(path)) as db:
+            built_from = db.execute("SELECT built_from FROM _meta").fetchone()[0]
+    except sqlite3.Error:
+        return None
+    return path if built_from == _built_from(source or star_source()) else None
+
+
+def _connect(db):
+    # One read-only connection per query, so any thread can run queries
+    return sqlite3.connect(f"file:{db}?mode=ro", uri=True)
+
+
+def _query(db, sql, params=()):
+    with closing(_connect(db)) as connection:
+        return pd.read_sql_query(sql, connection, params=params)
+
+
+def _scalar(db, sql, params=()):
+    with closing(_connect(db)) as connection:
+        return connection.execute(sql, params).fetchone()[0]
+
+
+def _timestamp(value):
+    return pd.Timestamp(value).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _period(year):
+    """Condition on orders ``o`` selecting a purchase period (see ``metrics.period_slice``), and its parameters."""
+    if year is None:
+        return "1", []
+    if isinstance(year, tuple):
+        start, end = year
+        conditions, params = ["o.order_purchase_timestamp IS NOT NULL"], []
+        if start is not None:
+            conditions.append("o.order_purchase_timestamp >= ?")
+            params.append(_timestamp(start))
+        if end is not None:
+            conditions.append("o.order_purchase_timestamp < ?")
+            params.append(_timestamp(end))
+        return " AND ".join(conditions), params
+    year = int(year)
+    return "o.order_purchase_timestamp >= ? AND o.order_purchase_timestamp < ?", [f"{year}-01-01", f"{year + 1}-01-01"]
+
+
+def _fact(name, year):
+    """``FROM`` and ``WHERE`` clauses selecting the rows ``f`` of fact ``name`` in a period.
+
+    Like ``metrics.select``, all rows are selected without a period, including
+    any whose order is unknown.
+    """
+    if year is None:
+        return f"{name} f", "1", []
+    condition, params = _period(year)
+    return f"{name} f JOIN orders o ON o.order_id = f.order_id", condition, params
+
+
+def years(db):
+    """Purchase years present in the data, for the year filter."""
+    found = _query(db, """
+        SELECT DISTINCT CAST(substr(order_purchase_timestamp, 1, 4) AS INTEGER) AS year
+        FROM orders WHERE order_purchase_timestamp IS NOT NULL ORDER BY year
+    """)
+    return found["year"].tolist()
+
+
+def monthly_orders(db, year=None):
+    """Number of orders per month, indexed by month end like ``resample('ME')``."""
+    condition, params = _period(year)
+    by_month = _query(db, f"""
+        SELECT substr(o.order_purchase_timestamp, 1, 7) AS month, COUNT(*) AS orders
+        FROM orders o WHERE {condition} AND o.order_purchase_timestamp IS NOT NULL
+        GROUP BY month
+    """, params)
+    counts = pd.Series(
+        by_month["orders"].to_numpy(),
+        index=pd.to_datetime(by_month["month"] + "-01") + pd.offsets.MonthEnd(0),
+    ).sort_index()
+    if counts.empty:
+        return counts.astype("int64")
+    months = pd.date_range(counts.index[0], counts.index[-1], freq="ME")
+    return counts.reindex(months, fill_value=0).astype("int64")
+
+
+def category_sales(db, year=None):
+    # Each item gets the share of its order's payments proportional to its
+    # price plus freight, as in ``metrics.item_sales``
+    items, item_condition, params = _fact("items", year)
+    payments, payment_condition, payment_params = _fact("payments", year)
+    return _query(db, f"""
+        WITH item_values AS (
+            SELECT f.order_id, f.product_id, f.price + f.freight_value AS value
+            FROM {items} WHERE {item_condition}
+        ), order_values AS (
+            SELECT order_id, SUM(value) AS value FROM item_values GROUP BY order_id
+        ), order_payments AS (
+            SELECT f.order_id, SUM(f.payment_value) AS payment_value
+            FROM {payments} WHERE {payment_condition} GROUP BY f.order_id
+        )
+        SELECT p.product_category_name, TOTAL(i.value / v.value * op.payment_value) AS payment_value
+        FROM item_values i
+        JOIN order_values v ON v.order_id = i.order_id
+        LEFT JOIN order_payments op ON op.order_id = i.order_id
+        JOIN products p ON p.product_id = i.product_id
+        WHERE p.product_category_name IS NOT NULL
+        GROUP BY p.product_category_name ORDER BY payment_value DESC
+    """, params + payment_params)
+
+
+def category_rating(db, year=None):
+    items, condition, params = _fact("items", year)
+    return _query(db, f"""
+        SELECT p.product_category_name, AVG(r.review_score) AS review_score
+        FROM {items}
+        JOIN reviews r ON r.order_id = f.order_id
+        JOIN products p ON p.product_id = f.product_id
+        WHERE {condition} AND p.product_category_name IS NOT NULL
+        GROUP BY p.product_category_name ORDER BY review_score DESC
+    """, params)
+
+
+def product_rating(db):
+    return _query(db, """
+        SELECT f.product_id, p.product_category_name, AVG(r.review_score) AS review_score,
+               COUNT(r.review_score) AS review_count
+        FROM items f
+        JOIN reviews r ON r.order_id = f.order_id
+        JOIN products p ON p.product_id = f.product_id
+        WHERE f.product_id IS NOT NULL AND p.product_category_name IS NOT NULL
+        GROUP BY f.product_id, p.product_category_name
+    """)
+
+
+def rating_distribution(db, year=None):
+    reviews, condition, params = _fact("reviews", year)
+    return _query(db, f"""
+        SELECT f.review_score AS "Review Score", COUNT(DISTINCT f.order_id) AS "Order Count"
+        FROM {reviews} WHERE {condition} AND f.review_score IS NOT NULL
+        GROUP BY f.review_score ORDER BY f.review_score
+    """, params)
+
+
+def city_customers(db, year=None):
+    condition, params = _period(year)
+    return _query(db, f"""
+        SELECT c.customer_city AS City, COUNT(DISTINCT o.customer_id) AS "Customer Count"
+        FROM orders o JOIN customers c ON c.customer_id = o.customer_id
+        WHERE {condition} AND c.customer_city IS NOT NULL
+        GROUP BY c.customer_city ORDER BY "Customer Count" DESC
+    """, params)
+
+
+def payment_segments(db, year=None):
+    payments, condition, params = _fact("payments", year)
+    return _query(db, f"""
+        SELECT f.payment_type AS "Payment Type", COUNT(DISTINCT f.order_id) AS "Purchase Count"
+        FROM {payments} WHERE {condition} AND f.payment_type IS NOT NULL
+        GROUP BY f.payment_type ORDER BY f.payment_type
+    """, params)
+
+
+def average_spend(db, year=None):
+    """Mean total payments per customer; customers without payments count as 0."""
+    condition, params = _period(year)
+    customers = _scalar(db, f"SELECT COUNT(DISTINCT o.customer_id) FROM orders o WHERE {condition}", params)
+    if not customers:
+        return np.nan
+    payments, condition, params = _fact("payments", year)
+    return _scalar(db, f"SELECT TOTAL(f.payment_value) FROM {payments} WHERE {condition}", params) / customers
+
+
+def delivery_status_counts(db, year=None):
+    """Delivered orders per status; orders not yet delivered have no status."""
+    # Late once delivery is a whole day or more past the estimate, as in features.delivery_status
+    condition, params = _period(year)
+    counts = _query(db, f"""
+        SELECT CASE
+                   WHEN strftime('%s', o.order_delivered_customer_date)
+                        - strftime('%s', o.order_estimated_delivery_date) < 86400 THEN 'On time'
+                   ELSE 'Late'
+               END AS delivery_status,
+               COUNT(*) AS count
+        FROM orders o
+        WHERE {condition} AND o.order_delivered_customer_date IS NOT NULL
+              AND o.order_estimated_delivery_date IS NOT NULL
+        GROUP BY delivery_status ORDER BY count DESC
+    """, params)
+    return counts.set_index("delivery_status")["count"]
+
+
+def hour_rating(db, year=None):
+    condition, params = _period(year)
+    return _query(db, f"""
+        SELECT CAST(substr(o.order_purchase_timestamp, 12, 2) AS INTEGER) AS hour_of_purchase,
+               AVG(f.review_score) AS review_score
+        FROM reviews f JOIN orders o ON o.order_id = f.order_id
+        WHERE {condition} AND o.order_purchase_timestamp IS NOT NULL
+        GROUP BY hour_of_purchase HAVING review_score IS NOT NULL ORDER BY hour_of_purchase
+    """, params)
+
+
+def time_of_day_counts(db, year=None):
+    condition, params = _period(year)
+    counts = _query(db, f"""
+        SELECT CAST(substr(o.order_purchase_timestamp, 12, 2) AS INTEGER) / 6 AS part, COUNT(*) AS count
+        FROM orders o WHERE {condition} AND o.order_purchase_timestamp IS NOT NULL
+        GROUP BY part ORDER BY count DESC
+    """, params)
+    return pd.Series(
+        counts["count"].to_numpy(),
+        index=pd.CategoricalIndex(np.take(TIME_OF_DAY_LABELS, counts["part"]), categories=TIME_OF_DAY_LABELS,
+                                  name="purchase_time_of_day"),
+        name="count",
+    )
+
+
+def weekday_counts(db, year=None):
+    # strftime('%w') counts from Sunday = 0; DAY_ORDER starts on Monday
+    condition, params = _period(year)
+    counts = _query(db, f"""
+        SELECT (CAST(strftime('%w', o.order_purchase_timestamp) AS INTEGER) + 6) % 7 AS weekday,
+               COUNT(*) AS order_id
+        FROM orders o WHERE {condition} AND o.order_purchase_timestamp IS NOT NULL
+        GROUP BY weekday ORDER BY weekday
+    """, params)
+    return pd.DataFrame({
+        "day_of_week": pd.Categorical(np.take(DAY_ORDER, counts["weekday"]), categories=DAY_ORDER, ordered=True),
+        "order_id": counts["order_id"].to_numpy(),
+    })
+
+
+def city_sales(db, year=None):
+    """Payments and number of items sold per customer city."""
+    condition, params = _period(year)
+    per_city = {}
+    for fact, measure, name in [("payments", "TOTAL(f.payment_value)", "Total Sales"),
+                                ("items", "COUNT(*)", "Product Sold")]:
+        per_city[name] = _query(db, f"""
+            SELECT c.customer_city AS City, {measure} AS value
+            FROM {fact} f
+            JOIN orders o ON o.order_id = f.order_id
+            JOIN customers c ON c.customer_id = o.customer_id
+            WHERE {condition} AND c.customer_city IS NOT NULL
+            GROUP BY c.customer_city
+        """, params).set_index("City")["value"].rename(name)
+
+    city_sales_df = pd.concat(per_city.values(), axis=1).fillna(0).rename_axis('City').reset_index()
+    city_sales_df['Product Sold'] = city_sales_df['Product Sold'].astype('int64')
+    return city_sales_df.sort_values(by='Total Sales', ascending=False)
+
+
+def verify(star, db, years=None):
+    """Check every SQL query against the star-schema metric of the same name.
+
+    Returns a list of ``(query, year)`` pairs that did not match.
+    """
+    return metrics.compare(star, lambda name, *args: globals()[name](db, *args), years)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the SQLite database the dashboard can query.")
+    parser.add_argument("--output", default=DB_PATH)
+    parser.add_argument("--verify", action="store_true", help="check every SQL query against metrics.py")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    build_database(args.output)
+    print(f"Built {args.output} ({os.path.getsize(args.output) / 2**20:.1f} MB) "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    if args.verify:
+        mismatches = verify(load_star(), args.output)
+        for name, year in mismatches:
+            print(f"MISMATCH {name} year={year}")
+        if mismatches:
+            raise SystemExit(1)
+        print("All SQL queries match metrics.py")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Star schema backing the dashboard.
+
+The merged ``main_data`` table has one row per order x item x payment x
+review, so any sum over it counts an order's payments once per item and
+review. The star schema keeps every fact at its own grain instead:
+
+* ``orders``: one row per order (status and timestamps)
+* ``items``: one row per order item
+* ``payments``: one row per payment
+* ``reviews``: one row per review
+
+plus the ``customers``, ``products`` and ``sellers`` dimensions. The pipeline
+writes these tables to ``dashboard/star/``, one directory of Parquet files
+per table. The facts are partitioned by their order's purchase year/month,
+so an incremental build rewrites only the months it touches (see
+``update_star``). When only the merged data exists, ``star_from_merged``
+recovers the facts by de-duplicating it.
+"""
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from compact import compact_star, memory_report
+from data_loader import (
+    DATA_DIR, cached, default_source, read_main_data, replace_directory, source_key, update_directory,
+)
+from features import order_features
+from shared import load_shared
+from time_index import index_star
+
+STAR_DIR = os.path.join(DATA_DIR, "star")
+
+# Table name -> (columns, columns that identify one row of the merged table)
+STAR_TABLES = {
+    "orders": ([
+        "order_id", "customer_id", "order_status", "order_purchase_timestamp", "order_approved_at",
+        "order_delivered_carrier_date", "order_delivered_customer_date", "order_estimated_delivery_date",
+    ], ["order_id"]),
+    "items": ([
+        "order_id", "order_item_id", "product_id", "seller_id", "price", "freight_value",
+    ], ["order_id", "order_item_id"]),
+    "payments": (["order_id", "payment_type", "payment_value"], ["order_id", "payment_type", "payment_value"]),
+    "reviews": (["order_id", "review_score"], ["order_id", "review_score"]),
+    "customers": (["customer_id", "customer_unique_id", "customer_city", "customer_state"], ["customer_id"]),
+    "products": (["product_id", "product_category_name"], ["product_id"]),
+    "sellers": (["seller_id", "seller_city", "seller_state"], ["seller_id"]),
+}
+
+# Pipeline table name for each star table
+_PIPELINE_TABLES = {
+    "orders": "orders",
+    "items": "order_items",
+    "payments": "order_payments",
+    "reviews": "order_reviews",
+    "customers": "customers",
+    "products": "products",
+    "sellers": "sellers",
+}
+
+# Tables with a row per order (or part of one), stored partitioned by purchase month
+FACT_TABLES = ["orders", "items", "payments", "reviews"]
+PARTITION_COLUMNS = ["year", "month"]
+
+
+def star_from_tables(tables):
+    """Project the pipeline's cleaned raw tables onto the star schema."""
+    star = {}
+    for name, (columns, _) in STAR_TABLES.items():
+        table = tables[_PIPELINE_TABLES[name]]
+        star[name] = table[[column for column in columns if column in table.columns]].reset_index(drop=True)
+    return star
+
+
+def star_from_merged(df):
+    """Recover the star schema from the merged order x item x payment x review table.
+
+    Items, orders and dimensions are exact. Payments and reviews are keyed on
+    their values because the merged table carries no payment or review ID, so
+    two identical payments (or equal scores) on the same order collapse into
+    one.
+    """
+    star = {}
+    for name, (columns, key) in STAR_TABLES.items():
+        columns = [column for column in columns if column in df.columns]
+        if key[0] not in df.columns:
+            star[name] = pd.DataFrame(columns=columns)
+            continue
+        table = df[columns].dropna(subset=key)
+        star[name] = table.drop_duplicates(subset=key, ignore_index=True)
+    if "order_item_id" in star["items"]:
+        star["items"]["order_item_id"] = star["items"]["order_item_id"].astype("int32")
+    return star
+
+
+def _order_months(orders):
+    """Purchase ``year``/``month`` per ``order_id``; 0 for orders without a purchase date."""
+    purchase = pd.to_datetime(orders["order_purchase_timestamp"])
+    return pd.DataFrame({
+        "year": purchase.dt.year.fillna(0).astype(np.int16).to_numpy(),
+        "month": purchase.dt.month.fillna(0).astype(np.int8).to_numpy(),
+    }, index=pd.Index(orders["order_id"]))
+
+
+def _write_tables(star, root, batch):
+    """Add the rows of ``star`` to the tables at ``root`` as new part files named after ``batch``."""
+    months = _order_months(star["orders"])
+    for name in STAR_TABLES:
+        table, path = star[name], os.path.join(root, name)
+        if not len(table) and os.path.isdir(path):
+            continue
+        os.makedirs(path, exist_ok=True)
+        if name in FACT_TABLES and len(table):
+            # Facts of orders missing from ``star["orders"]`` go to month 0 as well
+            table = table.join(months, on="order_id").fillna({"year": 0, "month": 0})
+            table = table.astype({"year": np.int16, "month": np.int8})
+            pq.write_to_dataset(pa.Table.from_pandas(table, preserve_index=False), path,
+                                partition_cols=PARTITION_COLUMNS, basename_template=f"part-{batch}-{{i}}.parquet")
+        else:
+            table.to_parquet(os.path.join(path, f"part-{batch}.parquet"), index=False)
+
+
+def _month_dir(root, name, year, month):
+    return os.path.join(root, name, f"year={year}", f"month={month}")
+
+
+def write_star(star, root=STAR_DIR):
+    replace_directory(root, lambda tmp_root: _write_tables(star, tmp_root, "0"))
+
+
+def update_star(star, months, root=STAR_DIR):
+    """Replace the facts of the purchase ``months`` at ``root`` with those of ``star`` and add its dimension rows.
+
+    ``star`` holds the facts of every order purchased in one of ``months``
+    ((year, month) pairs) and of no other order, and only the dimension rows
+    that ``root`` does not have yet (see ``star_keys``). The partitions of
+    other months are not read or rewritten. As with ``write_star``, readers
+    see the tables before or after the update (see
+    ``data_loader.update_directory``).
+    """
+    def update(tmp_root):
+        for name in FACT_TABLES:
+            for year, month in months:
+                # Unlinks the staged copies only; the live tables keep their files until the swap
+                shutil.rmtree(_month_dir(tmp_root, name, int(year), int(month)), ignore_errors=True)
+        _write_tables(star, tmp_root, f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}")
+
+    update_directory(root, update)
+
+
+def star_dataset(name, root=STAR_DIR):
+    """Star table ``name`` at ``root`` as a pyarrow dataset (with the partition columns of a fact)."""
+    return ds.dataset(os.path.join(root, name), format="parquet", partitioning="hive")
+
+
+def star_keys(name, root=STAR_DIR):
+    """The keys (first column) of star table ``name`` at ``root``, as a pandas Series."""
+    return star_dataset(name, root).to_table(columns=[STAR_TABLES[name][0][0]]).column(0).to_pandas()
+
+
+def _read_table(name, dataset):
+    columns = STAR_TABLES[name][0]
+    return dataset.to_table(columns=[column for column in columns if column in dataset.schema.names]).to_pandas()
+
+
+def read_star_months(name, months, root=STAR_DIR):
+    """Rows of fact ``name`` purchased in one of ``months``, read from those partitions only."""
+    paths = [_month_dir(root, name, int(year), int(month)) for year, month in months]
+    parts = [ds.dataset(path, format="parquet") for path in paths if os.path.isdir(path)]
+    if not parts:
+        return _read_table(name, ds.dataset([], schema=star_dataset(name, root).schema))
+    return _read_table(name, ds.dataset(parts))
+
+
+def read_star(root=STAR_DIR):
+    """Read the star tables written by ``write_star`` as they are on disk."""
+    return {name: _read_table(name, star_dataset(name, root)) for name in STAR_TABLES}
+
+
+def star_columns():
+    """Columns of the merged table that make up the star schema."""
+    return {column for columns, _ in STAR_TABLES.values() for column in columns}
+
+
+def _read_source(root):
+    if os.path.isdir(root):
+        return read_star(root)
+    return star_from_merged(read_main_data(default_source(), star_columns()))
+
+
+def prepare_star(star):
+    """Compact, time-index and derive the order features of a raw star schema."""
+    star = index_star(compact_star(star))
+    star["order_features"] = order_features(star["orders"])
+    return star
+
+
+def star_key(root=STAR_DIR):
+    """Version key of the data ``load_star(root)`` reads."""
+    if os.path.isdir(root):
+        return source_key(root)
+    key = source_key(default_source())
+    return (f"star:{key[0]}",) + key[1:]
+
+
+def load_star(root=STAR_DIR):
+    """Return the star schema, cached per process like ``load_main_data``.
+
+    Reads the tables written by the pipeline, or de-duplicates the merged
+    dataset when they have not been built. Columns are compacted (see
+    ``compact.py``), the facts come back sorted by purchase time with a
+    ``time_index`` entry (see ``time_index.index_star``) and an
+    ``order_features`` table aligned with the orders fact.
+
+    The result is memory-mapped from a per-version export shared by every
+    process (see ``shared.py``) and must be treated as read-only.
+    """
+    key = star_key(root)
+    return cached(key, lambda: load_shared(key, lambda: prepare_star(_read_source(root))))
+
+
+if __name__ == "__main__":
+    raw = _read_source(STAR_DIR)
+    with pd.option_context("display.max_rows", None, "display.width", 120):
+        print(memory_report(raw, compact_star(raw)))
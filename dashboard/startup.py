@@ -0,0 +1,162 @@
+"""Cold start of the dashboard: profile it, and pay for it before users do.
+
+``profile`` starts the app headless (through Streamlit's ``AppTest``) in a
+fresh interpreter per page and reports where a cold start goes: the time to
+the end of the first render, a warm rerun for comparison, and the import
+time of each top-level package from ``python -X importtime``. Pages are
+opened with ``?page=<name>``; the backend follows ``DASHBOARD_BACKEND`` and
+``DASHBOARD_SNAPSHOT`` as usual.
+
+``prewarm`` opens the dataset and computes the landing page. Besides
+filling the in-process caches, this writes the on-disk artifacts a cold
+process would otherwise build on the first request (the shared star export,
+Parquet sidecars). ``prewarm_in_background`` runs it on a daemon thread,
+once per process; the dashboard starts it before drawing anything, and
+``serve`` starts it before the Streamlit server, so that the first user
+finds the data loaded.
+
+Usage:
+    python dashboard/startup.py profile [--pages NAME ...] [--top N] [--prewarmed]
+    python dashboard/startup.py prewarm
+    python dashboard/startup.py serve [streamlit run options]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import analytics
+import live_views
+import views
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dashboard.py")
+
+_prewarm_lock = threading.Lock()
+_prewarm_thread = None
+
+
+def prewarm():
+    """Load the dataset and compute the landing page; return the seconds it took."""
+    start = time.perf_counter()
+    live = live_views.LiveViews(analytics.open_dataset())
+    years = live.value("years")
+    if years:
+        live.figure("monthly_orders", years[0])
+    return time.perf_counter() - start
+
+
+def prewarm_in_background():
+    """Start ``prewarm`` on a daemon thread unless this process already did; return the thread."""
+    global _prewarm_thread
+    with _prewarm_lock:
+        if _prewarm_thread is None:
+            _prewarm_thread = threading.Thread(target=prewarm, name="dashboard-prewarm", daemon=True)
+            _prewarm_thread.start()
+    return _prewarm_thread
+
+
+def import_times(report):
+    """Seconds of import per top-level package, from ``-X importtime`` output, slowest first.
+
+    Sums each module's own ("self") time, so nested imports are not counted twice.
+    Imports on other threads (the prewarm) can make a module's own time come
+    out negative; those count as zero.
+    """
+    totals = defaultdict(float)
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, _, name = line[len("import time:"):].split("|")
+        totals[name.strip().split(".")[0]] += max(int(own), 0) / 1e6
+    return sorted(totals.items(), key=lambda item: -item[1])
+
+
+def _render(page, prewarmed):
+    """Render ``page`` cold in this process; print its timings as JSON.
+
+    With ``prewarmed``, the clock starts once ``prewarm`` has finished, as
+    for the first user of a server started with ``serve``.
+    """
+    if prewarmed:
+        # Through the module the app imports, not __main__, so the app finds it started
+        import startup
+        startup.prewarm_in_background().join()
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(APP, default_timeout=600)
+    app.query_params["page"] = page
+    app.run()
+    first = time.perf_counter() - start
+    rerun_start = time.perf_counter()
+    app.run()
+    print(json.dumps({
+        "first": first,
+        "warm": time.perf_counter() - rerun_start,
+        "errors": [exception.message for exception in app.exception],
+    }))
+
+
+def profile(pages=None, prewarmed=False):
+    """Cold-start ``{page: {"first", "warm", "errors", "imports"}}`` of each page, each in a new process."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(APP),
+                                                                    os.environ.get("PYTHONPATH")])))
+    results = {}
+    for page in pages or views.PAGES:
+        command = [sys.executable, "-X", "importtime", os.path.abspath(__file__), "--render", page]
+        if prewarmed:
+            command.append("--prewarmed")
+        output = subprocess.run(command, capture_output=True, text=True, env=env, check=True)
+        results[page] = dict(json.loads(output.stdout.strip().splitlines()[-1]), imports=import_times(output.stderr))
+    return results
+
+
+def format_profile(results, top=8):
+    lines = []
+    for page, result in results.items():
+        imports = result["imports"]
+        lines.append(page)
+        lines.append(f"  first render {result['first']:.2f}s, warm rerun {result['warm']:.3f}s, "
+                     f"imports {sum(seconds for _, seconds in imports):.2f}s (all threads)")
+        lines.append("  " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in imports[:top]))
+        lines += [f"  error: {error}" for error in result["errors"]]
+    return "\n".join(lines)
+
+
+def serve(streamlit_args):
+    """Run the dashboard's Streamlit server in this process, prewarming while it starts."""
+    import startup
+    startup.prewarm_in_background()
+    from streamlit.web import cli
+
+    sys.argv = ["streamlit", "run", APP] + streamlit_args
+    cli.main(prog_name="streamlit")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile the dashboard's cold start, or pay for it ahead of time.")
+    parser.add_argument("command", nargs="?", choices=["profile", "prewarm", "serve"], default="profile")
+    parser.add_argument("--pages", nargs="+", help="pages to profile (default: all)")
+    parser.add_argument("--top", type=int, default=8, help="packages listed per page")
+    parser.add_argument("--prewarmed", action="store_true", help="profile after prewarm has finished")
+    parser.add_argument("--render", help=argparse.SUPPRESS)
+    args, rest = parser.parse_known_args(argv)
+
+    if args.render:
+        _render(args.render, args.prewarmed)
+    elif args.command == "serve":
+        serve(rest)
+    elif rest:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    elif args.command == "prewarm":
+        print(f"Prewarmed in {prewarm():.1f}s")
+    else:
+        print(format_profile(profile(args.pages, args.prewarmed), args.top))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Purchase-time index over the star schema's order facts.
+
+``index_star`` sorts the orders fact by ``order_purchase_timestamp`` and every
+other order-keyed fact (items, payments, reviews) by the position of its order
+in that sorted fact. A year, a month or any date range of orders is then one
+contiguous block of rows in every fact, found with a binary search and taken
+with a positional slice, which pandas returns without copying the data.
+"""
+import numpy as np
+import pandas as pd
+
+# Facts keyed by order_id that are laid out in order-time order
+ORDER_FACTS = ["items", "payments", "reviews"]
+
+
+class TimeIndex:
+    """Month boundaries and fact offsets for a time-sorted star schema."""
+
+    def __init__(self, timestamps, fact_positions):
+        # Sorted purchase timestamps of the orders fact (NaT sorts last)
+        self.timestamps = np.asarray(timestamps, dtype="datetime64[ns]")
+        # For each fact, the (sorted) position of every row's order; -1 first
+        self.fact_positions = fact_positions
+
+        valid = self.timestamps[~np.isnat(self.timestamps)]
+        self.months, month_starts = np.unique(valid.astype("datetime64[M]"), return_index=True)
+        # Offsets into the orders fact: month i is rows month_offsets[i]:month_offsets[i + 1]
+        self.month_offsets = np.append(month_starts, len(valid))
+        self.years = sorted({int(year) for year in self.months.astype("datetime64[Y]").astype(int) + 1970})
+
+    def _month_range(self, first_month, end_month):
+        lo = np.searchsorted(self.months, first_month)
+        hi = np.searchsorted(self.months, end_month)
+        return slice(int(self.month_offsets[lo]), int(self.month_offsets[hi]))
+
+    def year_slice(self, year):
+        """Orders purchased in ``year``, as a slice of the orders fact."""
+        return self._month_range(np.datetime64(f"{int(year):04d}-01", "M"), np.datetime64(f"{int(year) + 1:04d}-01", "M"))
+
+    def month_slice(self, year, month):
+        first_month = np.datetime64(f"{int(year):04d}-{int(month):02d}", "M")
+        return self._month_range(first_month, first_month + 1)
+
+    def range_slice(self, start=None, end=None):
+        """Orders purchased in ``[start, end)``; either bound may be None."""
+        lo = 0 if start is None else np.searchsorted(self.timestamps, np.datetime64(pd.Timestamp(start)), "left")
+        hi = (
+            len(self.timestamps) - np.isnat(self.timestamps).sum() if end is None
+            else np.searchsorted(self.timestamps, np.datetime64(pd.Timestamp(end)), "left")
+        )
+        return slice(int(lo), int(max(lo, hi)))
+
+    def fact_slice(self, name, orders):
+        """Rows of fact ``name`` belonging to the orders in slice ``orders``."""
+        positions = self.fact_positions[name]
+        return slice(
+            int(np.searchsorted(positions, orders.start, "left")),
+            int(np.searchsorted(positions, orders.stop, "left")),
+        )
+
+
+def index_star(star):
+    """Return a copy of ``star`` with time-sorted facts and a ``time_index`` entry."""
+    indexed = dict(star)
+    orders = star["orders"].sort_values("order_purchase_timestamp", kind="stable", ignore_index=True)
+    indexed["orders"] = orders
+
+    order_ids = pd.Index(orders["order_id"])
+    fact_positions = {}
+    for name in ORDER_FACTS:
+        positions = order_ids.get_indexer(star[name]["order_id"])
+        order = np.argsort(positions, kind="stable")
+        indexed[name] = star[name].take(order).reset_index(drop=True)
+        fact_positions[name] = positions[order]
+
+    indexed["time_index"] = TimeIndex(orders["order_purchase_timestamp"].to_numpy(), fact_positions)
+    return indexed
@@ -0,0 +1,64 @@
+"""Every figure, table and value the dashboard renders, addressed by name.
+
+``dashboard.py`` asks a view source for ``figure(name, *params)``,
+``table(name, *params)`` or ``value(name, *params)``.
+``live_views.LiveViews`` computes them from a dataset through ``analytics``
+and ``figures``; ``snapshot.SnapshotViews`` reads what ``snapshot.py``
+exported. Both return the same plain structures: a ``CachedFigure``, table
+rows as a list of dicts (JSON-ready), and JSON-ready values.
+
+This module holds what both sources share: the pages and the choices they
+offer, and the structures they return. It imports nothing heavier than the
+standard library, so a dashboard serving a snapshot loads neither pandas
+nor the data backends.
+"""
+from collections import namedtuple
+
+# ``json`` is ``figure.to_json()``, for payload sizes and snapshots
+CachedFigure = namedtuple("CachedFigure", ["figure", "json"])
+
+# Pages of the dashboard, in menu order
+PAGES = ["Monthly Orders Trend", "Total Sales by Product Category", "Average Rating by Product Category",
+         "Customer Distribution", "Customer Segments", "Time Analysis", "Sales and Product by City", "Delivery Performance",
+         "Customer and Seller Map"]
+
+# Choices offered by the "Sales and Product by City" page
+CITY_RANKINGS = ["Top-selling", "Worst-selling"]
+CITY_COUNTS = list(range(5, 55, 5))
+CITY_PAGE_SIZE = 25
+
+# Choices offered by the product tables of the "Average Rating by Product Category" page
+PRODUCT_RANKINGS = ["Highest-rated", "Lowest-rated"]
+PRODUCT_MIN_REVIEWS = [1, 3, 5, 10, 20]
+PRODUCT_COUNT = 5
+# Reviews at the overall mean added to every product's (see ranking.py)
+PRIOR_REVIEWS = 10
+
+# Groups the "Delivery Performance" page breaks down by -> label of their column (see delivery.py)
+DELIVERY_GROUPS = {
+    "state": "Customer state",
+    "seller": "Seller",
+    "category": "Product category",
+    "payment_type": "Payment type",
+    "month": "Purchase month",
+}
+# How many groups the "Delivery Performance" chart shows
+DELIVERY_CHART_GROUPS = 15
+
+
+def city_sales_page(rows, search, page, page_size):
+    """``city_sales_page`` over exported rows, matching ``analytics.city_sales_page``."""
+    if search:
+        rows = [row for row in rows if search.lower() in row['City'].lower()]
+    page = min(page, max(0, len(rows) - 1) // page_size)
+    return rows[page * page_size:(page + 1) * page_size], len(rows)
+
+
+def map_cells(rows, zoom, lat, lng):
+    """``map_cells`` over the exported rows of one zoom level, matching ``geo.visible_cells``."""
+    # Only the map page needs geo, and with it numpy and pandas
+    import geo
+
+    x_min, x_max, y_min, y_max = geo.viewport(zoom, lat, lng, geo.MAP_WIDTH, geo.MAP_HEIGHT)
+    return [dict(row, polygon=geo.cell_polygon(row["x"], row["y"], zoom)) for row in rows
+            if x_min <= row["x"] <= x_max and y_min <= row["y"] <= y_max]